@@ -77,11 +77,73 @@ def register():
         description = "Invert the values in the map. Low becomes high, high becomes low.",
         default = False
         )
+    bpy.types.Scene.mol_import_map_sparse = bpy.props.BoolProperty(
+        name = "mol_import_map_sparse", 
+        description = "Leave out the voxels below the threshold, which greatly reduces the size of the .vdb file for maps with a lot of empty space.",
+        default = False
+        )
+    bpy.types.Scene.mol_import_map_threshold = bpy.props.FloatProperty(
+        name = "mol_import_map_threshold", 
+        description = "Density below which voxels are left out of the volume.",
+        default = 0.0
+        )
+    bpy.types.Scene.mol_import_map_pyramid = bpy.props.BoolProperty(
+        name = "mol_import_map_pyramid", 
+        description = "Also create 2x, 4x and 8x binned versions of the map, which the volume can be switched to for a faster viewport.",
+        default = False
+        )
+    bpy.types.Scene.mol_import_map_surface = bpy.props.BoolProperty(
+        name = "mol_import_map_surface", 
+        description = "Import the map as a mesh of the isosurface at the contour level, which is much faster to render than a volume.",
+        default = False
+        )
+    bpy.types.Scene.mol_import_map_contour = bpy.props.FloatProperty(
+        name = "mol_import_map_contour", 
+        description = "Density of the isosurface of the map.",
+        default = 0.0
+        )
+    bpy.types.Scene.mol_import_map_budget = bpy.props.IntProperty(
+        name = "mol_import_map_budget", 
+        description = "Largest number of triangles of the isosurface, above which it is decimated. 0 for no limit", 
+        subtype = 'NONE',
+        default = 0, 
+        min = 0
+    )
+    bpy.types.Scene.mol_import_map_series = bpy.props.StringProperty(
+        name = 'path_map_series', 
+        description = 'Folder of map files, or a pattern such as tomograms/*.rec, to import as a series.', 
+        options = {'TEXTEDIT_UPDATE'}, 
+        default = '', 
+        subtype = 'FILE_PATH', 
+        maxlen = 0
+        )
+    bpy.types.Scene.mol_import_map_series_sequence = bpy.props.BoolProperty(
+        name = "mol_import_map_series_sequence", 
+        description = "Import the series as a single volume showing one map per frame, starting at the current frame.",
+        default = False
+        )
+    bpy.types.Scene.mol_import_map_n_workers = bpy.props.IntProperty(
+        name = "mol_import_map_n_workers", 
+        description = "Number of processes used to convert the maps of the series", 
+        subtype = 'NONE',
+        default = 4, 
+        min = 1
+    )
     bpy.types.Scene.mol_import_include_bonds = bpy.props.BoolProperty(
         name = "mol_import_include_bonds", 
         description = "Include bonds in the imported structure.",
         default = True
         )
+    bpy.types.Scene.mol_import_attributes = bpy.props.EnumProperty(
+        name = "mol_import_attributes", 
+        description = "Which of the per-atom attributes are computed on import", 
+        items = (
+            ('minimal', "Minimal", "Only the attributes needed to display the atoms (atomic number, radii, chain and residue id)"), 
+            ('render', "Render", "The attributes used by the default styles"), 
+            ('full', "Full", "All of the attributes")
+        ), 
+        default = 'full'
+        )
     bpy.types.Scene.mol_import_panel_selection = bpy.props.IntProperty(
         name = "mol_import_panel_selection", 
         description = "Import Panel Selection", 
@@ -186,6 +248,28 @@ def register():
         subtype = 'NONE',
         default = 49
     )
+    bpy.types.Scene.mol_import_md_streaming = bpy.props.BoolProperty(
+        name = "mol_import_md_streaming", 
+        description = "Read the frames from the trajectory as the scene frame changes, instead of importing every frame as an object", 
+        default = False
+    )
+    bpy.types.Scene.mol_import_md_cache_coords = bpy.props.BoolProperty(
+        name = "mol_import_md_cache_coords", 
+        description = "Store the coordinates of the imported frames in a packed .npy file next to the trajectory, which is reused by later imports", 
+        default = False
+    )
+    bpy.types.Scene.mol_import_md_sec_struct = bpy.props.BoolProperty(
+        name = "mol_import_md_sec_struct", 
+        description = "Compute the secondary structure of the proteins for the topology and for every frame", 
+        default = False
+    )
+    bpy.types.Scene.mol_import_md_n_workers = bpy.props.IntProperty(
+        name = "mol_import_md_n_workers", 
+        description = "Number of processes used to read the frames of the trajectory", 
+        subtype = 'NONE',
+        default = 1, 
+        min = 1
+    )
     bpy.types.Scene.mol_import_default_style = bpy.props.IntProperty(
         name = "mol_import_default_style", 
         description = "Default style for importing molecules.", 
@@ -207,6 +291,9 @@ def register():
     )
     
     bpy.types.NODE_MT_add.append(mol_add_node_menu)
+    bpy.app.handlers.frame_change_post.append(update_trajectories)
+    bpy.app.handlers.frame_change_post.append(density.update_map_series)
+    bpy.app.handlers.load_post.append(load.touch_attribute_stores)
 
     bpy.utils.register_class(MOL_PT_panel)
     bpy.utils.register_class(MOL_MT_Add_Node_Menu)
@@ -232,6 +319,9 @@ def register():
     bpy.utils.register_class(MOL_OT_Import_Protein_Local)
     bpy.utils.register_class(MOL_OT_Import_Protein_MD)
     bpy.utils.register_class(MOL_OT_Import_Map)
+    bpy.utils.register_class(MOL_OT_Map_Level)
+    bpy.utils.register_class(MOL_OT_Import_Map_Series)
+    bpy.utils.register_class(MOL_OT_Map_Contour)
     bpy.utils.register_class(MOL_OT_Import_Star_File)
     bpy.utils.register_class(MOL_OT_Assembly_Bio)
     bpy.utils.register_class(MOL_OT_Default_Style)
@@ -241,6 +331,7 @@ def register():
     bpy.utils.register_class(MOL_OT_Install_Package)
 
     bpy.utils.register_class(MOL_OT_Add_Custom_Node_Group)
+    bpy.utils.register_class(MOL_OT_Materialise_Attributes)
 
     bpy.utils.register_class(MOL_OT_Residues_Selection_Custom)
     bpy.utils.register_class(MolecularNodesPreferences)
@@ -252,8 +343,18 @@ def unregister():
     del bpy.types.Scene.mol_import_center
     del bpy.types.Scene.mol_import_del_solvent
     del bpy.types.Scene.mol_import_include_bonds
+    del bpy.types.Scene.mol_import_attributes
     del bpy.types.Scene.mol_import_map_nodes
     del bpy.types.Scene.mol_import_map_invert
+    del bpy.types.Scene.mol_import_map_sparse
+    del bpy.types.Scene.mol_import_map_threshold
+    del bpy.types.Scene.mol_import_map_pyramid
+    del bpy.types.Scene.mol_import_map_surface
+    del bpy.types.Scene.mol_import_map_contour
+    del bpy.types.Scene.mol_import_map_budget
+    del bpy.types.Scene.mol_import_map_series
+    del bpy.types.Scene.mol_import_map_series_sequence
+    del bpy.types.Scene.mol_import_map_n_workers
     del bpy.types.Scene.mol_import_panel_selection
     del bpy.types.Scene.mol_import_local_path
     del bpy.types.Scene.mol_import_md_topology
@@ -266,6 +367,10 @@ def unregister():
     del bpy.types.Scene.mol_import_md_frame_start
     del bpy.types.Scene.mol_import_md_frame_step
     del bpy.types.Scene.mol_import_md_frame_end
+    del bpy.types.Scene.mol_import_md_streaming
+    del bpy.types.Scene.mol_import_md_cache_coords
+    del bpy.types.Scene.mol_import_md_n_workers
+    del bpy.types.Scene.mol_import_md_sec_struct
     del bpy.types.Scene.mol_import_default_style
     
     del bpy.types.Scene.mol_esmfold_name
@@ -275,6 +380,9 @@ def unregister():
     del bpy.types.Scene.list_index
     
     bpy.types.NODE_MT_add.remove(mol_add_node_menu)
+    bpy.app.handlers.frame_change_post.remove(update_trajectories)
+    bpy.app.handlers.frame_change_post.remove(density.update_map_series)
+    bpy.app.handlers.load_post.remove(load.touch_attribute_stores)
     
     bpy.utils.unregister_class(TrajectorySelectionList)
     bpy.utils.unregister_class(MOL_UL_TrajectorySelectionListUI)
@@ -304,6 +412,9 @@ def unregister():
     bpy.utils.unregister_class(MOL_OT_Import_Protein_ESMFold)
     bpy.utils.unregister_class(MOL_OT_Import_Protein_MD)
     bpy.utils.unregister_class(MOL_OT_Import_Map)
+    bpy.utils.unregister_class(MOL_OT_Map_Level)
+    bpy.utils.unregister_class(MOL_OT_Import_Map_Series)
+    bpy.utils.unregister_class(MOL_OT_Map_Contour)
     bpy.utils.unregister_class(MOL_OT_Import_Star_File)
     bpy.utils.unregister_class(MOL_OT_Assembly_Bio)
     bpy.utils.unregister_class(MOL_OT_Default_Style)
@@ -311,6 +422,7 @@ def unregister():
     bpy.utils.unregister_class(MOL_OT_Chain_Selection_Custom)
     
     bpy.utils.unregister_class(MOL_OT_Add_Custom_Node_Group)
+    bpy.utils.unregister_class(MOL_OT_Materialise_Attributes)
     bpy.utils.unregister_class(MOL_OT_Install_Package)
 
     bpy.utils.unregister_class(MOL_OT_Residues_Selection_Custom)
@@ -0,0 +1,183 @@
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+# the name of the addon, as registered in Blender's preferences
+ADDON = 'MolecularNodes'
+
+# directories of the cache that are never evicted, as their files can't be downloaded or
+# computed again, such as the side stores of molecules (see `load.store_attribute_source()`).
+# Their files are removed by `prune()` instead, once nothing uses them
+PERSISTENT = ('attributes', )
+
+# the cache settings from the addon preferences, as last read on the main thread
+_preferences = None
+
+def preferences():
+    """Return the cache settings from the MolecularNodes addon preferences.
+
+    Blender data should only be read from the main thread, so the settings are read there 
+    and the last values are reused when called from a background thread (such as for 
+    downloads). Outside of Blender, such as in worker processes and tests, the last values 
+    are also reused. Returns None if the addon isn't registered.
+    """
+    global _preferences
+    if threading.current_thread() is not threading.main_thread():
+        return _preferences
+    try:
+        import bpy
+    except ImportError:
+        return _preferences
+    
+    addon = bpy.context.preferences.addons.get(ADDON)
+    if not addon:
+        return None
+    prefs = addon.preferences
+    _preferences = SimpleNamespace(
+        cache_dir = bpy.path.abspath(prefs.cache_dir) if prefs.cache_dir else "", 
+        cache_size = prefs.cache_size, 
+        cache_offline = prefs.cache_offline, 
+        vdb_size = prefs.vdb_size
+    )
+    return _preferences
+
+def cache_dir(subdir: str = "") -> str:
+    """Return the cache directory, creating it if it doesn't exist yet.
+
+    The location is set in the addon preferences, defaulting to `~/.MolecularNodes/cache`.
+    Each type of cached file is kept inside of its own `subdir`.
+
+    Args:
+        subdir (str, optional): Sub-directory inside of the cache directory. Defaults to "".
+
+    Returns:
+        str: Path to the directory.
+    """
+    prefs = preferences()
+    root = prefs.cache_dir if prefs else ""
+    if not root:
+        root = os.path.join(os.path.expanduser('~'), '.MolecularNodes', 'cache')
+    
+    path = os.path.join(root, subdir)
+    os.makedirs(path, exist_ok = True)
+    return path
+
+def is_offline() -> bool:
+    """Whether the offline mode is enabled in the addon preferences."""
+    prefs = preferences()
+    return bool(prefs and prefs.cache_offline)
+
+def max_size() -> int:
+    """Size limit of the cache in bytes, from the addon preferences (given in MB)."""
+    prefs = preferences()
+    size_mb = prefs.cache_size if prefs else 1024
+    return size_mb * 1024 ** 2
+
+def vdb_max_size() -> int:
+    """Size budget in bytes of the .vdb files converted from the maps in each folder, from
+    the addon preferences (given in MB), or None when it is 0 and nothing is evicted. This
+    is separate to the size of the cache, see `mrc.record_vdb()`."""
+    prefs = preferences()
+    size_mb = getattr(prefs, 'vdb_size', 0) if prefs else 0
+    return size_mb * 1024 ** 2 if size_mb else None
+
+def get(subdir: str, name: str) -> str:
+    """Return the path of a cached file, or None if it isn't in the cache.
+
+    The modification time of the file is updated, marking it as recently used so it is the
+    last to be evicted.
+    """
+    path = os.path.join(cache_dir(subdir), name)
+    if not os.path.exists(path):
+        return None
+    os.utime(path)
+    return path
+
+def store(subdir: str, name: str, data) -> str:
+    """Write the data (str or bytes) to a file in the cache and return its path.
+
+    The file is written to a temporary file first and then moved into place, so an 
+    interrupted write is never read back. Afterwards the least recently used files are 
+    evicted until the cache is within the size limit.
+    """
+    folder = cache_dir(subdir)
+    path = os.path.join(folder, name)
+    # unique temporary file, so files can be stored from multiple threads at once
+    fd, path_temp = tempfile.mkstemp(suffix = '.part', dir = folder)
+    mode = 'w' if isinstance(data, str) else 'wb'
+    with os.fdopen(fd, mode) as f:
+        f.write(data)
+    os.replace(path_temp, path)
+    
+    evict(max_size(), keep = path)
+    return path
+
+def evict(size: int, keep: str = None) -> None:
+    """Delete the least recently used files until the cache is smaller than `size` bytes.
+    
+    The directories in `PERSISTENT` are neither counted nor evicted.
+
+    Args:
+        size (int): The maximum size of the cache in bytes.
+        keep (str, optional): Path of a file that should never be evicted, such as the file 
+        that was just added. Defaults to None.
+    """
+    root = cache_dir()
+    files = []
+    for folder, subdirs, names in os.walk(root):
+        if folder == root:
+            subdirs[:] = [subdir for subdir in subdirs if subdir not in PERSISTENT]
+        for name in names:
+            # skip files that are still being written
+            if name.endswith('.part'):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    
+    total = sum(file[1] for file in files)
+    for mtime, file_size, path in sorted(files):
+        if total <= size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # already removed by another eviction
+            pass
+        total -= file_size
+
+def prune(subdir: str, keep: set, max_age: float) -> list:
+    """Delete the files of a directory of the cache that aren't in `keep` and haven't been
+    used for `max_age` seconds, see `get()`. This is for the `PERSISTENT` directories, 
+    whose files are only removed once nothing refers to them.
+
+    Args:
+        subdir (str): Directory of the cache.
+        keep (set): Names of the files that are still used.
+        max_age (float): Seconds since the last use of a file before it can be deleted.
+
+    Returns:
+        list: Names of the deleted files.
+    """
+    folder = cache_dir(subdir)
+    oldest = time.time() - max_age
+    removed = []
+    for name in os.listdir(folder):
+        if name in keep or name.endswith('.part'):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            if os.stat(path).st_mtime < oldest:
+                os.remove(path)
+                removed.append(name)
+        except FileNotFoundError:
+            # already removed by another prune
+            pass
+    return removed
@@ -0,0 +1,145 @@
+"""
+Downloads of structures from the PDB and predictions from ESMFold, which are kept in the
+cache (see `cache.py`) so that they are only downloaded once. This module doesn't import
+bpy, and the downloading libraries are only imported on a cache miss.
+"""
+
+import hashlib
+import os
+import time
+from . import cache
+
+ESMFOLD_URL = 'https://api.esmatlas.com/foldSequence/v1/pdb/'
+
+def fetch_rcsb(pdb_code, format = "mmtf"):
+    """
+    Returns the path to the structure file for `pdb_code`, downloading it from the PDB into
+    the cache if it isn't there already. In offline mode a missing structure raises a
+    FileNotFoundError rather than attempting to download it.
+    """
+    name = f"{pdb_code.lower()}.{format}"
+    file_path = cache.get('rcsb', name)
+    if file_path:
+        return file_path
+    
+    if cache.is_offline():
+        raise FileNotFoundError(
+            f"'{pdb_code}' is not in the cache at '{cache.cache_dir('rcsb')}' and offline mode is enabled."
+            )
+    
+    import biotite.database.rcsb as rcsb
+    
+    file = rcsb.fetch(pdb_code, format)
+    return cache.store('rcsb', name, file.getvalue())
+
+def normalise_sequence(amino_acid_sequence):
+    "Upper case amino acid sequence with any whitespace removed."
+    return "".join(amino_acid_sequence.split()).upper()
+
+def fold_esmfold(amino_acid_sequence, url = ESMFOLD_URL, session = None, retries = 0, backoff = 1.0):
+    """
+    Returns the path to the ESMFold predicted structure for the sequence as a .pdb file.
+    
+    Predictions are cached by a hash of the normalised sequence, so folding the same 
+    sequence again opens it from disk without contacting the ESMFold server. In offline 
+    mode a sequence that isn't in the cache raises a FileNotFoundError.
+    
+    Requests can be made through a `requests.Session` to reuse connections, and are 
+    retried up to `retries` times when the server is busy (429) or errors (5xx), waiting 
+    `backoff` seconds before the first retry and doubling each time.
+    """
+    sequence = normalise_sequence(amino_acid_sequence)
+    name = hashlib.sha256(sequence.encode()).hexdigest() + '.pdb'
+    
+    file_path = cache.get('esmfold', name)
+    if file_path:
+        return file_path
+    
+    if cache.is_offline():
+        raise FileNotFoundError(
+            f"The prediction for the sequence is not in the cache at '{cache.cache_dir('esmfold')}' and offline mode is enabled."
+            )
+    
+    import requests
+    
+    post = session.post if session else requests.post
+    for attempt in range(retries + 1):
+        r = post(url, data = sequence)
+        if r.status_code != 429 and r.status_code < 500:
+            break
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+    
+    if not r.ok:
+        raise ValueError(f'ESMFold returned an error for the amino acid sequence input. This is the error message: {r.text}')
+    
+    return cache.store('esmfold', name, r.text)
+
+def fold_esmfold_batch(sequences, url = ESMFOLD_URL, n_workers = 8, retries = 3, backoff = 1.0):
+    """
+    Folds each of the sequences with `fold_esmfold()`, with the requests made concurrently 
+    by `n_workers` threads that share a pool of connections, and retried on 429 / 5xx 
+    errors. Each unique sequence is only folded once.
+    
+    The cache settings are read from the main thread, so `cache.preferences()` should be 
+    called before this from inside of Blender.
+    
+    Returns:
+        dict: For each unique normalised sequence, the path to its predicted structure, or
+        the exception that was raised when folding it.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    
+    unique_sequences = list(dict.fromkeys(normalise_sequence(seq) for seq in sequences))
+    
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = n_workers, pool_maxsize = n_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    
+    def fold(sequence):
+        return fold_esmfold(sequence, url = url, session = session, retries = retries, backoff = backoff)
+    
+    with session, ThreadPoolExecutor(max_workers = n_workers) as pool:
+        futures = {seq: pool.submit(fold, seq) for seq in unique_sequences}
+    
+    results = {}
+    for seq, future in futures.items():
+        try:
+            results[seq] = future.result()
+        except Exception as e:
+            results[seq] = e
+    return results
+
+def read_fasta(fasta):
+    """
+    Reads the records of a FASTA file, or a string containing FASTA formatted text.
+    
+    Returns:
+        list: A (name, sequence) tuple for each record, where the name is the first word of
+        the header line.
+    
+    Raises:
+        ValueError: If there are no records, such as for a plain sequence without a header,
+        which should be given inside of a list instead.
+    """
+    if os.path.isfile(fasta):
+        with open(fasta) as f:
+            fasta = f.read()
+    
+    records = []
+    for record in fasta.split('>')[1:]:
+        lines = record.strip().splitlines()
+        if not lines:
+            continue
+        header = lines[0].split()
+        name = header[0] if header else f"Sequence_{len(records)}"
+        records.append((name, "".join(lines[1:])))
+    
+    if not records:
+        raise ValueError(
+            "No FASTA records were found, where each record starts with a '>' header line. "
+            "Plain sequences should be given as a list."
+            )
+    return records
@@ -0,0 +1,240 @@
+"""
+Secondary structure assignment based on DSSP (Kabsch & Sander, 1983), vectorised with
+numpy so the secondary structure of every model or frame of a structure is assigned at
+once.
+
+Like PyDSSP (https://github.com/ShintaroMinami/PyDSSP) this is a simplified DSSP, which
+assigns helices (H, G and I) and strands (E and B) from the backbone hydrogen bonds. All
+hydrogen bonds below the energy cutoff are used, rather than only the two strongest for
+each residue. The residues are returned with the codes of the 'sec_struct' attribute:
+`0: not a protein residue, 1: helix, 2: strand, 3: loop`.
+"""
+
+import numpy as np
+import functools
+
+# names of the backbone atoms, in the order they are stored
+BACKBONE = ('N', 'CA', 'C', 'O')
+
+# electrostatic hydrogen bond energy in kcal/mol, with partial charges of 0.42e and 0.20e
+HBOND_FACTOR = 0.084 * 332
+HBOND_CUTOFF = -0.5
+# a hydrogen bond can't be below the energy cutoff when the O and N are further apart
+MAX_DISTANCE_ON = 6.0
+# consecutive residues with a longer C-N distance are treated as a chain break
+MAX_PEPTIDE_BOND = 2.5
+# the number of donor / acceptor distances to compute at once, which bounds the memory use
+BLOCK_SIZE = 2 ** 22
+
+def backbone_indices(atom_names, res_index, mask = None):
+    """
+    Indices of the N, CA, C and O atoms of each residue that has all four of them.
+
+    Args:
+        atom_names (np.ndarray): The name of each atom.
+        res_index (np.ndarray): The index of the residue of each atom.
+        mask (np.ndarray, optional): Atoms that can be part of the backbone, such as the
+        amino acids. Defaults to None, for all atoms.
+
+    Returns:
+        tuple: The (n, 4) atom indices and the index of each of the n residues.
+    """
+    atom_names = np.asarray(atom_names)
+    res_index = np.asarray(res_index)
+
+    found = []
+    for name in BACKBONE:
+        is_atom = atom_names == name
+        if mask is not None:
+            is_atom &= mask
+        atoms = np.flatnonzero(is_atom)
+        # the first atom with the name in each residue
+        residues, first = np.unique(res_index[atoms], return_index = True)
+        found.append((residues, atoms[first]))
+
+    residues = functools.reduce(np.intersect1d, [res for res, atoms in found])
+    indices = np.stack(
+        [atoms[np.searchsorted(res, residues)] for res, atoms in found],
+        axis = -1
+        )
+
+    return indices.reshape(-1, len(BACKBONE)), residues
+
+def hydrogen_bonds(n, h, c, o, donor):
+    """
+    Finds the backbone hydrogen bonds of every frame.
+
+    Args:
+        n, h, c, o (np.ndarray): (n_frames, n_residues, 3) coordinates of the backbone N,
+        the amide H, C and O of each residue.
+        donor (np.ndarray): (n_frames, n_residues) whether the NH of each residue can
+        donate a hydrogen bond.
+
+    Returns:
+        np.ndarray: Sorted keys of the hydrogen bonds, where the bond from the CO of the
+        acceptor to the NH of the donor in a frame is
+        `(frame * n_residues + acceptor) * n_residues + donor`.
+    """
+    n_res = n.shape[1]
+    rows = np.flatnonzero(donor)
+    block = max(1, BLOCK_SIZE // n_res)
+
+    def dist(a, b):
+        return np.sqrt(np.sum((a - b) ** 2, axis = -1))
+
+    keys = [np.zeros(0, dtype = np.int64)]
+    for start in range(0, len(rows), block):
+        frame, don = np.divmod(rows[start:start + block], n_res)
+
+        # only the pairs with the O close to the N can be below the energy cutoff, and
+        # there are no hydrogen bonds between a residue and itself or its neighbours
+        d_on = dist(o[frame], n[frame, don][:, None])
+        near = d_on < MAX_DISTANCE_ON
+        near &= np.abs(np.arange(n_res) - don[:, None]) > 1
+
+        pair, acc = np.nonzero(near)
+        frame, don = frame[pair], don[pair]
+        energy = HBOND_FACTOR * (
+            1 / d_on[pair, acc] +
+            1 / dist(c[frame, acc], h[frame, don]) -
+            1 / dist(o[frame, acc], h[frame, don]) -
+            1 / dist(c[frame, acc], n[frame, don])
+        )
+        bonded = energy < HBOND_CUTOFF
+        keys.append(((frame[bonded] * n_res + acc[bonded]) * n_res + don[bonded]).astype(np.int64))
+
+    return np.sort(np.concatenate(keys))
+
+def assign(backbone, donor = None):
+    """
+    Assigns the secondary structure of consecutive protein residues.
+
+    Args:
+        backbone (np.ndarray): (n_frames, n_residues, 4, 3) coordinates of the N, CA, C
+        and O of each residue.
+        donor (np.ndarray, optional): (n_residues) whether the NH of each residue can
+        donate a hydrogen bond, which isn't the case for proline. Defaults to None, for
+        all residues.
+
+    Returns:
+        np.ndarray: (n_frames, n_residues) 1 for helix, 2 for strand and 3 for loop.
+    """
+    backbone = np.asarray(backbone, dtype = float)
+    n_frames, n_res = backbone.shape[:2]
+    n, c, o = backbone[:, :, 0], backbone[:, :, 2], backbone[:, :, 3]
+    frame = np.arange(n_frames)[:, None]
+    res = np.arange(n_res)[None, :]
+
+    # residues are in the same segment when there is no chain break between them
+    linked = np.sqrt(np.sum((n[:, 1:] - c[:, :-1]) ** 2, axis = -1)) < MAX_PEPTIDE_BOND
+    segment = np.zeros((n_frames, n_res), dtype = int)
+    segment[:, 1:] = np.cumsum(~linked, axis = 1)
+
+    def same_segment(f, i, j):
+        valid = (i >= 0) & (j < n_res)
+        return valid & (segment[f, np.clip(i, 0, n_res - 1)] == segment[f, np.clip(j, 0, n_res - 1)])
+
+    # the amide H is placed along the C=O of the previous residue, so the first residue
+    # of each segment can't be a donor
+    co = c[:, :-1] - o[:, :-1]
+    h = n.copy()
+    h[:, 1:] += co / np.linalg.norm(co, axis = -1)[..., None]
+    can_donate = np.zeros((n_frames, n_res), dtype = bool)
+    can_donate[:, 1:] = linked
+    if donor is not None:
+        can_donate &= donor
+
+    keys = hydrogen_bonds(n, h, c, o, can_donate)
+
+    def hbond(f, acc, don):
+        "Whether there is a hydrogen bond from the CO of `acc` to the NH of `don`."
+        valid = (acc >= 0) & (acc < n_res) & (don >= 0) & (don < n_res)
+        if len(keys) == 0:
+            return np.zeros(np.broadcast(f, acc, don).shape, dtype = bool)
+        key = (f * n_res + np.clip(acc, 0, n_res - 1)) * n_res + np.clip(don, 0, n_res - 1)
+        found = keys[np.minimum(np.searchsorted(keys, key), len(keys) - 1)] == key
+        return valid & found
+
+    # an n-turn at i is a hydrogen bond from i to i + n, and two consecutive n-turns at
+    # i - 1 and i make the residues i to i + n - 1 a helix
+    helix = {}
+    for turn in (3, 4, 5):
+        is_turn = hbond(frame, res, res + turn) & same_segment(frame, res, res + turn)
+        start = np.zeros((n_frames, n_res), dtype = bool)
+        start[:, 1:] = is_turn[:, :-1] & is_turn[:, 1:]
+        helix[turn] = start.copy()
+        for shift in range(1, turn):
+            helix[turn][:, shift:] |= start[:, :-shift]
+
+    # bridges between residues i and j, found from each of the hydrogen bonds
+    frame, acc = np.divmod(keys // n_res, n_res)
+    don = keys % n_res
+    strand = np.zeros((n_frames, n_res), dtype = bool)
+
+    def add_bridges(is_bridge, i, j):
+        is_bridge &= np.abs(i - j) > 2
+        strand[frame[is_bridge], i[is_bridge]] = True
+        strand[frame[is_bridge], j[is_bridge]] = True
+
+    # antiparallel: hbond(i, j) and hbond(j, i)
+    add_bridges(hbond(frame, don, acc), acc, don)
+    # antiparallel: hbond(i - 1, j + 1) and hbond(j - 1, i + 1)
+    add_bridges(
+        hbond(frame, don - 2, acc + 2) &
+        same_segment(frame, acc, acc + 2) & same_segment(frame, don - 2, don),
+        acc + 1, don - 1
+        )
+    # parallel: hbond(i - 1, j) and hbond(j, i + 1), which covers hbond(j - 1, i) and
+    # hbond(i, j + 1) as well when i and j are swapped
+    add_bridges(
+        hbond(frame, don, acc + 2) & same_segment(frame, acc, acc + 2),
+        acc + 1, don
+        )
+
+    # the 4-helix takes priority over strands, which take priority over the other helices
+    sse = np.full((n_frames, n_res), 3)
+    sse[helix[3] | helix[5]] = 1
+    sse[strand] = 2
+    sse[helix[4]] = 1
+
+    return sse
+
+def secondary_structure(coord, atom_names, res_index, n_residues = None, mask = None, res_names = None):
+    """
+    Assigns the secondary structure of each residue, for every frame.
+
+    Args:
+        coord (np.ndarray): (n_atoms, 3) or (n_frames, n_atoms, 3) atom coordinates.
+        atom_names (np.ndarray): The name of each atom.
+        res_index (np.ndarray): The index of the residue of each atom, where residues
+        that follow each other in the chain have consecutive indices.
+        n_residues (int, optional): The number of residues. Defaults to None, for the
+        largest residue index plus one.
+        mask (np.ndarray, optional): Atoms that are part of protein residues. Defaults to
+        None, for all atoms.
+        res_names (np.ndarray, optional): The residue name of each atom, used to find the
+        prolines which can't donate a hydrogen bond. Defaults to None.
+
+    Returns:
+        np.ndarray: (n_frames, n_residues) secondary structure of each residue, as
+        `0: not a protein residue, 1: helix, 2: strand, 3: loop`.
+    """
+    coord = np.asarray(coord)
+    if coord.ndim == 2:
+        coord = coord[None]
+    res_index = np.asarray(res_index)
+    if n_residues is None:
+        n_residues = res_index.max() + 1 if len(res_index) else 0
+
+    sse = np.zeros((coord.shape[0], n_residues), dtype = int)
+    indices, residues = backbone_indices(atom_names, res_index, mask)
+    if len(residues) == 0:
+        return sse
+
+    donor = None
+    if res_names is not None:
+        donor = np.asarray(res_names)[indices[:, 0]] != 'PRO'
+
+    sse[:, residues] = assign(coord[:, indices], donor)
+
+    return sse
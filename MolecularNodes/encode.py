@@ -0,0 +1,196 @@
+"""
+Encodings of the elements, residue names, atom names and chain IDs of atoms as the integer
+values of their attributes, shared by structures (`load.py`) and trajectories (`md.py`).
+
+Everything here is plain numpy and doesn't need Blender.
+"""
+
+import functools
+import numpy as np
+from . import data
+
+def _compile_table(table):
+    """
+    Compile a dictionary into a sorted array of keys and a matching array of values, 
+    which can be searched with `np.searchsorted()` instead of per-atom dictionary lookups.
+    """
+    keys = np.array(sorted(table.keys()))
+    values = np.array([table[key] for key in keys])
+    return keys, values
+
+@functools.lru_cache(maxsize = None)
+def _element_table(field, default):
+    # the element symbols are added as written, upper and lower case so that the lookup
+    # matches the same symbols that `np.char.title()` previously normalised to
+    table = {}
+    for symbol, values in data.elements.items():
+        for key in (symbol, symbol.upper(), symbol.lower()):
+            table.setdefault(key, values.get(field, default))
+    return _compile_table(table)
+
+@functools.lru_cache(maxsize = None)
+def _residue_table():
+    return _compile_table({name: values['res_name_num'] for name, values in data.residues.items()})
+
+@functools.lru_cache(maxsize = None)
+def _atom_name_table():
+    return _compile_table(data.atom_names)
+
+def lookup(values, keys, table, default):
+    """
+    Look up each of the values in the sorted `keys` array and return the matching entries 
+    of `table`, with `default` for values that are not found.
+    
+    This is a single `np.searchsorted()` & `np.take()` pass over the values, which is 
+    much faster than mapping a python dictionary over millions of atoms.
+    """
+    values = np.asarray(values)
+    idx = np.searchsorted(keys, values)
+    idx[idx == len(keys)] = 0
+    found = np.take(keys, idx) == values
+    return np.where(found, np.take(table, idx), default)
+
+def atomic_numbers(elements):
+    """Atomic number of each element, -1 for unknown elements."""
+    keys, table = _element_table('atomic_number', -1)
+    return lookup(elements, keys, table, -1)
+
+def vdw_radii(elements):
+    """Van der Waals radii (in picometres) of each element, 100 for unknown elements."""
+    keys, table = _element_table('vdw_radii', 100)
+    return lookup(elements, keys, table, 100)
+
+def res_name_numbers(res_names, default = 9999):
+    """Numerical representation of each residue name, `default` for non-standard residues."""
+    keys, table = _residue_table()
+    return lookup(res_names, keys, table, default)
+
+def atom_name_numbers(atom_names):
+    """Numerical representation of each atom name, 9999 for unknown atom names."""
+    keys, table = _atom_name_table()
+    return lookup(atom_names, keys, table, 9999)
+
+def count_preceding_smaller(values):
+    """
+    For each of the distinct values, the number of values before it that are smaller.
+    
+    The values are split into blocks that double in width, and for each block the values of
+    its right half count the smaller values of its left half, with the cumulative sum of the
+    left half in the order of the values. This is log2(n) vectorised passes rather than a 
+    loop over the values.
+
+    Returns:
+        np.ndarray: The count for each value.
+    """
+    values = np.asarray(values)
+    # the position of each value, in the order of the values
+    positions = np.argsort(values, kind = 'stable')
+    counts = np.zeros(len(values), dtype = np.int64)
+    width = 1
+    while width < len(values):
+        block = positions // (2 * width)
+        order = np.argsort(block, kind = 'stable')
+        block = block[order]
+        is_left = (positions[order] // width) % 2 == 0
+        
+        # the left half values of the block that are smaller than each value
+        left_before = np.cumsum(is_left) - is_left
+        is_start = np.ones(len(block), dtype = bool)
+        is_start[1:] = block[1:] != block[:-1]
+        start = np.maximum.accumulate(np.where(is_start, np.arange(len(block)), 0))
+        smaller = left_before - left_before[start]
+        
+        is_right = ~is_left
+        counts[positions[order][is_right]] += smaller[is_right]
+        width *= 2
+    return counts
+
+def res_name_encode(res_names, res_ids):
+    """
+    Encode the residue names as integers, giving each non-standard residue (ligands, lipids
+    etc) a unique number starting from 100.
+    
+    Residue boundaries are found by comparing each atom's res_name and res_id with the 
+    previous atom, so the cost scales with the number of atoms rather than the number of 
+    ligands squared. Each ligand is labelled '<id + 100>_<res_name>' and numbered by its rank
+    among the labels preceding it, matching the original per-atom numbering.
+
+    Returns:
+        tuple: An array of the residue numbers for each atom and the sorted unique ligand labels.
+    """
+    res_nums = res_name_numbers(res_names)
+    is_other = res_nums == 9999
+    
+    # np.roll compares the first atom with the last, as the original per-atom loop did
+    is_new = (np.roll(res_names, 1) != res_names) | (np.roll(res_ids, 1) != res_ids)
+    ligand_id = np.cumsum(is_new & is_other) - 1
+    
+    other_idx = np.flatnonzero(is_other)
+    ids, first, inverse = np.unique(ligand_id[other_idx], return_index = True, return_inverse = True)
+    names = res_names[other_idx[first]]
+    labels = np.char.add(np.char.add((ids + 100).astype(str), "_"), names.astype(str))
+    
+    # rank of each label among the labels seen so far, which only differs from the 
+    # order of appearance once the ids reach 4 digits
+    label_nums = count_preceding_smaller(labels) + 100
+    
+    res_nums[other_idx] = label_nums.astype(res_nums.dtype)[inverse]
+    
+    return res_nums, np.sort(labels)
+
+def chain_id_encode(chain_ids):
+    """
+    Encode the chain IDs as integers, in the alphabetical order of the unique chain IDs.
+    
+    Uses a single `np.unique(return_inverse = True)` pass, so it scales with the number of
+    atoms regardless of the number of chains.
+
+    Returns:
+        tuple: An array of the chain number for each atom and a list of the unique chain IDs.
+    """
+    chain_id_unique, chain_id = np.unique(np.asarray(chain_ids).astype(str), return_inverse = True)
+    return chain_id.reshape(-1), chain_id_unique.tolist()
+
+# the annotations of the atoms that the attributes of a molecule are computed from
+SOURCE_FIELDS = ('element', 'res_name', 'atom_name', 'res_id', 'chain_id', 'hetero', 'res_index', 'b_factor')
+
+def pack_annotations(mol_array, fields = SOURCE_FIELDS):
+    """
+    Packs the annotations of an AtomArray into compact arrays, to be saved with `np.savez()`.
+    
+    Each string annotation is stored as its unique values and the index of each atom into 
+    them, in the smallest unsigned type that fits, so a few bytes per atom are kept rather 
+    than a string. Numeric annotations are kept as float32 and int32, and annotations that
+    the atoms don't have are skipped.
+
+    Returns:
+        dict: Arrays keyed by 'unique_<field>' and 'codes_<field>', or 'values_<field>'.
+    """
+    arrays = {}
+    categories = mol_array.get_annotation_categories()
+    for field in fields:
+        if field not in categories:
+            continue
+        values = mol_array.get_annotation(field)
+        if values.dtype.kind in 'UO':
+            unique, codes = np.unique(values.astype(str), return_inverse = True)
+            arrays['unique_' + field] = unique
+            arrays['codes_' + field] = codes.reshape(-1).astype(np.min_scalar_type(max(len(unique) - 1, 0)))
+        elif values.dtype.kind == 'f':
+            arrays['values_' + field] = values.astype(np.float32)
+        elif values.dtype.kind in 'iu':
+            arrays['values_' + field] = values.astype(np.int32)
+        else:
+            arrays['values_' + field] = values
+    return arrays
+
+def unpack_annotations(arrays):
+    """The annotations packed by `pack_annotations()`, as a dictionary of arrays."""
+    annotations = {}
+    for key in arrays:
+        kind, _, field = key.partition('_')
+        if kind == 'codes':
+            annotations[field] = arrays['unique_' + field][arrays[key]]
+        elif kind == 'values':
+            annotations[field] = arrays[key]
+    return annotations
@@ -0,0 +1,239 @@
+"""
+Isosurface extraction from density maps, vectorised with numpy so that a surface can be
+extracted without any compiled dependencies.
+
+The surface is found with marching tetrahedra, the variant of marching cubes that splits
+each cube of 8 voxels into 6 tetrahedra along its main diagonal. This needs only a 16
+case table rather than the 256 cases of marching cubes, and has none of its ambiguous
+cases, so the surface is always closed where it doesn't meet the edge of the map. Each
+vertex lies on an edge between two voxels, and is shared by all of the triangles that
+cross that edge.
+
+Large surfaces can be reduced to a triangle budget with `decimate()`, which clusters the
+vertices on a grid.
+"""
+
+import numpy as np
+import itertools
+
+# the number of voxels that are read from the volume at a time
+CHUNK_SIZE = 2 ** 22
+# the number of cubes that are split into tetrahedra at a time, which bounds the memory use
+BLOCK_SIZE = 2 ** 16
+
+# the offsets of the 8 corners of a cube, with the corner at `(z, y, x)` at `4z + 2y + x`
+CORNERS = np.array(list(itertools.product((0, 1), repeat = 3)))
+
+def _tetrahedra():
+    """
+    The 6 tetrahedra of a cube, as the indices into `CORNERS` of their 4 corners. Each
+    follows a path along the x, y and z edges in a different order, from the corner at
+    (0, 0, 0) to the one at (1, 1, 1).
+    """
+    tetrahedra = []
+    for order in itertools.permutations(range(3)):
+        corner = np.zeros(3, dtype = int)
+        path = [corner.copy()]
+        for axis in order:
+            corner[axis] = 1
+            path.append(corner.copy())
+        tetrahedra.append([int(p @ (4, 2, 1)) for p in path])
+    return np.array(tetrahedra)
+
+# the 6 edges of a tetrahedron, as pairs of its corners
+TET_EDGES = np.array(list(itertools.combinations(range(4), 2)))
+
+def _case_table():
+    """
+    The triangles for each of the 16 cases of the corners of a tetrahedron that are inside
+    the surface, as up to 2 triangles of 3 edges of `TET_EDGES` each, with -1 when there
+    is no triangle. The triangles are oriented afterwards, see `triangles()`.
+    """
+    def edge(a, b):
+        return int(np.flatnonzero((TET_EDGES == sorted((a, b))).all(axis = 1))[0])
+
+    table = np.full((16, 2, 3), -1)
+    for case in range(16):
+        inside = [corner for corner in range(4) if case >> corner & 1]
+        outside = [corner for corner in range(4) if not case >> corner & 1]
+        if len(inside) in (1, 3):
+            # a single triangle cuts off the corner that is on its own
+            lone, others = (inside, outside) if len(inside) == 1 else (outside, inside)
+            table[case, 0] = [edge(lone[0], other) for other in others]
+        elif len(inside) == 2:
+            # a quad between the two pairs of corners, split into two triangles
+            (a, b), (c, d) = inside, outside
+            quad = [edge(a, c), edge(a, d), edge(b, d), edge(b, c)]
+            table[case, 0] = quad[0], quad[1], quad[2]
+            table[case, 1] = quad[0], quad[2], quad[3]
+    return table
+
+TETRAHEDRA = _tetrahedra()
+CASES = _case_table()
+
+def triangles(volume, level, invert = False, chunk_size = CHUNK_SIZE):
+    """
+    Extracts the isosurface of a volume, where the surface encloses the voxels with a
+    value of at least `level`, or of at most `level` when inverted.
+
+    The volume can be a memory-mapped array, as it is read in slabs of about `chunk_size`
+    voxels along the first axis.
+
+    Args:
+        volume (np.ndarray): The 3D values.
+        level (float): The contour level of the surface.
+        invert (bool, optional): Enclose the voxels below the level. Defaults to False.
+        chunk_size (int, optional): Number of voxels in each slab that is read.
+
+    Returns:
+        tuple: The (n, 3) vertices in voxel coordinates, in the order of the axes of the
+        volume, and the (m, 3) vertex indices of the triangles. The triangles face away
+        from the voxels inside the surface.
+    """
+    shape = np.array(volume.shape)
+    strides = np.array([shape[1] * shape[2], shape[2], 1], dtype = np.int64)
+    slab_depth = max(1, chunk_size // max(1, shape[1] * shape[2]))
+    edges, positions = [], []
+    # the values are negated when inverted, which keeps the triangles facing outwards
+    sign = -1 if invert else 1
+    level = sign * level
+    for start in range(0, max(shape[0] - 1, 0), slab_depth):
+        stop = min(start + slab_depth + 1, shape[0])
+        values = sign * np.asarray(volume[start:stop], dtype = np.float32)
+        inside = values >= level
+
+        # the cubes with corners on both sides of the surface
+        count = np.zeros(np.array(inside.shape) - 1, dtype = np.int8)
+        for corner in CORNERS:
+            z, y, x = corner
+            count += inside[z:z + count.shape[0], y:y + count.shape[1], x:x + count.shape[2]]
+        cubes = np.argwhere((count > 0) & (count < 8)).astype(np.int32)
+        if len(cubes) == 0:
+            continue
+
+        # the triangles of the cubes, a block at a time to bound the memory that is used
+        for block in range(0, len(cubes), BLOCK_SIZE):
+            keys, vertices = _cube_triangles(values, cubes[block:block + BLOCK_SIZE], level)
+            keys += start * strides[0] * 8
+            vertices[..., 0] += start
+            edges.append(keys.reshape(-1))
+            positions.append(vertices.reshape(-1, 3).astype(np.float32))
+
+    if not edges:
+        return np.zeros((0, 3), dtype = np.float32), np.zeros((0, 3), dtype = np.int32)
+
+    # the vertices on the same edge are merged, including those on the edges between slabs
+    edges = np.concatenate(edges)
+    positions = np.concatenate(positions)
+    _, first, inverse = np.unique(edges, return_index = True, return_inverse = True)
+    vertices = positions[first]
+    faces = inverse.reshape(-1, 3).astype(np.int32)
+
+    return vertices, remove_degenerate(faces)
+
+def _cube_triangles(values, cubes, level):
+    """
+    The triangles of the tetrahedra of the cubes, as the keys of the edges and the
+    positions of the vertices of their corners, in the voxel coordinates of the `values`.
+    The key of an edge is from the index of its lower voxel and the direction to its
+    upper voxel, so the same edge has the same key in each slab.
+    """
+    strides = np.array([values.shape[1] * values.shape[2], values.shape[2], 1], dtype = np.int64)
+
+    # the corners of each tetrahedron of the cubes, and which of them are inside
+    corners = cubes[:, None, None, :] + CORNERS[TETRAHEDRA].astype(np.int32)[None]
+    corner_values = values[corners[..., 0], corners[..., 1], corners[..., 2]]
+    case = ((corner_values >= level) << np.arange(4)).sum(axis = -1)
+    cube, tet = np.nonzero(case % 15 != 0)
+    corners, corner_values, case = corners[cube, tet], corner_values[cube, tet], case[cube, tet]
+
+    # the edges that are crossed by each triangle
+    tri_edges = CASES[case].reshape(-1, 3)
+    tri_tet = np.repeat(np.arange(len(case)), 2)
+    has_tri = tri_edges[:, 0] >= 0
+    tri_edges, tri_tet = tri_edges[has_tri], tri_tet[has_tri]
+    a = corners[tri_tet[:, None], TET_EDGES[tri_edges, 0]]
+    b = corners[tri_tet[:, None], TET_EDGES[tri_edges, 1]]
+    value_a = corner_values[tri_tet[:, None], TET_EDGES[tri_edges, 0]]
+    value_b = corner_values[tri_tet[:, None], TET_EDGES[tri_edges, 1]]
+
+    # the vertex of each edge, interpolated to where it crosses the contour level
+    t = (level - value_a) / (value_b - value_a)
+    vertices = a + t[..., None] * (b - a)
+    direction = np.abs(b - a) @ (4, 2, 1)
+    keys = (np.minimum(a, b) @ strides) * 8 + direction
+
+    # orient each triangle to face from the inside corners to the outside corners
+    is_inside = corner_values[tri_tet] >= level
+    n_inside = is_inside.sum(axis = 1)[:, None]
+    inside_centre = (corners[tri_tet] * is_inside[..., None]).sum(axis = 1) / n_inside
+    outside_centre = (corners[tri_tet] * ~is_inside[..., None]).sum(axis = 1) / (4 - n_inside)
+    normal = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+    flip = np.sum(normal * (outside_centre - inside_centre), axis = -1) < 0
+    keys[flip] = keys[flip][:, ::-1]
+    vertices[flip] = vertices[flip][:, ::-1]
+
+    return keys, vertices
+
+def remove_degenerate(faces):
+    "Removes the triangles with a repeated vertex, and the repeats of the same triangle."
+    faces = faces[
+        (faces[:, 0] != faces[:, 1]) &
+        (faces[:, 1] != faces[:, 2]) &
+        (faces[:, 2] != faces[:, 0])
+    ]
+    # the same triangle is kept once, whichever vertex it starts from
+    start = np.argmin(faces, axis = 1)
+    rows = np.arange(len(faces))[:, None]
+    canonical = faces[rows, (start[:, None] + np.arange(3)) % 3]
+    canonical, index = np.unique(canonical, axis = 0, return_index = True)
+    return faces[np.sort(index)]
+
+def reverse_axes(vertices, faces):
+    """
+    Reverses the order of the axes of the vertices, from the (z, y, x) of the voxels of a
+    volume to (x, y, z). This mirrors the surface, so the order of the vertices of each
+    triangle is reversed with it to keep the triangles facing outwards.
+    """
+    return vertices[:, ::-1], faces[:, ::-1]
+
+def decimate(vertices, faces, budget):
+    """
+    Reduces a surface to at most `budget` triangles, by merging the vertices that fall
+    into the same cell of a grid into their mean position. The grid starts from the size
+    expected to give the budget, and is made coarser until the surface is within it.
+
+    Args:
+        vertices (np.ndarray): (n, 3) positions of the vertices.
+        faces (np.ndarray): (m, 3) vertex indices of the triangles.
+        budget (int): The largest number of triangles.
+
+    Returns:
+        tuple: The vertices and triangles of the decimated surface.
+    """
+    if len(faces) <= budget or len(vertices) == 0:
+        return vertices, faces
+
+    # the number of triangles falls with the square of the size of the cells
+    spacing = np.mean(np.linalg.norm(vertices[faces[:, 1]] - vertices[faces[:, 0]], axis = 1))
+    cell_size = spacing * np.sqrt(len(faces) / max(budget, 1))
+    origin = vertices.min(axis = 0)
+
+    while True:
+        cells = np.floor((vertices - origin) / cell_size).astype(np.int64)
+        unique, cluster = np.unique(cells, axis = 0, return_inverse = True)
+        cluster = cluster.reshape(-1)
+        counts = np.bincount(cluster)
+        merged = np.stack(
+            [np.bincount(cluster, weights = vertices[:, axis]) for axis in range(3)], 
+            axis = -1
+            ) / counts[:, None]
+
+        merged_faces = remove_degenerate(cluster[faces])
+        if len(merged_faces) <= budget:
+            break
+        cell_size *= 1.2
+
+    # drop the vertices that are no longer used by a triangle
+    used, merged_faces = np.unique(merged_faces, return_inverse = True)
+    return merged[used].astype(np.float32), merged_faces.reshape(-1, 3).astype(np.int32)
@@ -1,12 +1,17 @@
-import requests
 import io
+import hashlib
 import bpy
+from bpy.app.handlers import persistent
 import numpy as np
 from . import coll
 import warnings
-from . import data
 from . import assembly
 from . import nodes
+from . import cache
+from . import dssp
+from .download import ESMFOLD_URL, fetch_rcsb, normalise_sequence, fold_esmfold, fold_esmfold_batch, read_fasta
+from .parsed import structure_cache_name, save_structure, load_structure
+from .encode import atomic_numbers, vdw_radii, atom_name_numbers, res_name_encode, chain_id_encode, pack_annotations, unpack_annotations
 
 def molecule_rcsb(
     pdb_code,               
@@ -14,12 +19,18 @@ def molecule_rcsb(
     del_solvent = True,               
     include_bonds = True,   
     starting_style = 0,               
-    setup_nodes = True              
+    setup_nodes = True, 
+    structure = None, 
+    attributes = 'full'
     ):
-    mol, file = open_structure_rcsb(
-        pdb_code = pdb_code, 
-        include_bonds=include_bonds
-        )
+    # the structure can be given if it was already opened with open_structure_rcsb(), 
+    # such as when it was downloaded on a background thread
+    if structure is None:
+        structure = open_structure_rcsb(
+            pdb_code = pdb_code, 
+            include_bonds=include_bonds
+            )
+    mol, file = structure
     
     mol_object, coll_frames = create_molecule(
         mol_array = mol,
@@ -28,7 +39,8 @@ def molecule_rcsb(
         calculate_ss = False,
         center_molecule = center_molecule,
         del_solvent = del_solvent, 
-        include_bonds = include_bonds
+        include_bonds = include_bonds, 
+        attributes = attributes
         )
     
     if setup_nodes:
@@ -49,12 +61,18 @@ def molecule_esmfold(
     del_solvent = True,               
     include_bonds = True,   
     starting_style = 0,               
-    setup_nodes = True              
+    setup_nodes = True, 
+    structure = None, 
+    attributes = 'full'
     ):
-    mol, file = open_structure_esm_fold(
-        amino_acid_sequence = amino_acid_sequence, 
-        include_bonds=include_bonds
-        )
+    # the structure can be given if it was already opened with open_structure_esm_fold(), 
+    # such as when it was folded on a background thread
+    if structure is None:
+        structure = open_structure_esm_fold(
+            amino_acid_sequence = amino_acid_sequence, 
+            include_bonds=include_bonds
+            )
+    mol, file = structure
     
     mol_object, coll_frames = create_molecule(
         mol_array = mol,
@@ -63,7 +81,8 @@ def molecule_esmfold(
         calculate_ss = True,
         center_molecule = center_molecule,
         del_solvent = del_solvent, 
-        include_bonds = True
+        include_bonds = True, 
+        attributes = attributes
         )
     
     if setup_nodes:
@@ -74,6 +93,73 @@ def molecule_esmfold(
             )    
     return mol_object
 
+def molecule_esmfold_batch(
+    sequences, 
+    mol_name = "Name", 
+    center_molecule = False, 
+    del_solvent = True, 
+    include_bonds = True, 
+    starting_style = 0, 
+    setup_nodes = True, 
+    n_workers = 8, 
+    retries = 3, 
+    url = ESMFOLD_URL, 
+    attributes = 'full'
+    ):
+    """
+    Folds multiple sequences with ESMFold and creates an object for each of them.
+    
+    The sequences can be given as a FASTA file or FASTA text, where each object is named 
+    from the header of its record, or as a list of sequences which are named 
+    `<mol_name>_<index>`. The sequences are folded concurrently by `n_workers` threads 
+    (see `download.fold_esmfold_batch()`), and the objects are then created one at a time, 
+    as Blender data can only be created from the main thread. Sequences that fail to fold
+    are warned about and skipped.
+    
+    Returns:
+        list: The created molecule objects.
+    """
+    if isinstance(sequences, str):
+        records = read_fasta(sequences)
+    else:
+        records = [(f"{mol_name}_{i}", seq) for i, seq in enumerate(sequences)]
+    
+    # read the cache settings on the main thread, for use by the worker threads
+    cache.preferences()
+    
+    results = fold_esmfold_batch(
+        [seq for name, seq in records], url = url, n_workers = n_workers, retries = retries
+        )
+    
+    mol_objects = []
+    for name, seq in records:
+        file_path = results[normalise_sequence(seq)]
+        if isinstance(file_path, Exception):
+            warnings.warn(f"Unable to fold '{name}': {file_path}")
+            continue
+        
+        mol, file = open_structure_local_pdb(file_path, include_bonds = include_bonds)
+        mol_object, coll_frames = create_molecule(
+            mol_array = mol,
+            mol_name = name,
+            file = file,
+            calculate_ss = True,
+            center_molecule = center_molecule,
+            del_solvent = del_solvent, 
+            include_bonds = True, 
+            attributes = attributes
+            )
+        
+        if setup_nodes:
+            nodes.create_starting_node_tree(
+                obj = mol_object, 
+                coll_frames=coll_frames, 
+                starting_style = starting_style
+                )
+        mol_objects.append(mol_object)
+    
+    return mol_objects
+
 def molecule_local(
     file_path,                    
     mol_name = "Name",                   
@@ -81,7 +167,8 @@ def molecule_local(
     center_molecule = False,                    
     del_solvent = True,                    
     default_style = 0,                    
-    setup_nodes = True
+    setup_nodes = True, 
+    attributes = 'full'
     ): 
     
     import biotite.structure as struc
@@ -94,12 +181,20 @@ def molecule_local(
         mol, file = open_structure_local_pdb(file_path, include_bonds)
         transforms = assembly.get_transformations_pdb(file)
     elif file_ext == '.pdbx' or file_ext == '.cif':
-        mol, file = open_structure_local_pdbx(file_path, include_bonds)
-        try:
-            transforms = assembly.get_transformations_pdbx(file)
-        except:
+        # large .cif files are slow to parse, so the parsed structure is cached
+        stat = os.stat(file_path)
+        cache_name = structure_cache_name(file_path, stat.st_size, stat.st_mtime_ns, include_bonds)
+        cached = load_structure(cache_name)
+        if cached:
+            mol, file = cached
             transforms = None
-            # self.report({"WARNING"}, message='Unable to parse biological assembly information.')
+        else:
+            mol, file = open_structure_local_pdbx(file_path, include_bonds)
+            try:
+                transforms = assembly.get_transformations_pdbx(file)
+            except:
+                transforms = None
+                # self.report({"WARNING"}, message='Unable to parse biological assembly information.')
     else:
         warnings.warn("Unable to open local file. Format not supported.")
     # if include_bonds chosen but no bonds currently exist (mol.bonds is None)
@@ -107,6 +202,9 @@ def molecule_local(
     if include_bonds and not mol.bonds:
         mol.bonds = struc.connect_via_distances(mol[0], inter_residue=True)
     
+    if file_ext in ('.pdbx', '.cif') and not cached:
+        save_structure(mol, cache_name)
+    
     if not (file_ext == '.pdb' and file.get_model_count() > 1):
         file = None
         
@@ -118,7 +216,8 @@ def molecule_local(
         calculate_ss = True,
         center_molecule = center_molecule,
         del_solvent = del_solvent, 
-        include_bonds = include_bonds
+        include_bonds = include_bonds, 
+        attributes = attributes
         )
     
     # setup the required initial node tree on the object 
@@ -138,48 +237,38 @@ def molecule_local(
 
 def open_structure_rcsb(pdb_code, include_bonds = True):
     import biotite.structure.io.mmtf as mmtf
-    import biotite.database.rcsb as rcsb
     
-    file = mmtf.MMTFFile.read(rcsb.fetch(pdb_code, "mmtf"))
+    # when the parsed structure is cached, the fields of the file that are used later 
+    # are returned as a dictionary in place of the file
+    cache_name = structure_cache_name('rcsb', pdb_code.lower(), include_bonds)
+    cached = load_structure(cache_name)
+    if cached:
+        return cached
+    
+    file = mmtf.MMTFFile.read(fetch_rcsb(pdb_code, "mmtf"))
     
     # returns a numpy array stack, where each array in the stack is a model in the 
     # the file. The stack will be of length = 1 if there is only one model in the file
     mol = mmtf.get_structure(file, extra_fields = ["b_factor", "charge"], include_bonds = include_bonds) 
+    
+    file_fields = {'bioAssemblyList': file['bioAssemblyList']}
+    try:
+        file_fields['secStructList'] = file['secStructList']
+    except KeyError:
+        pass
+    save_structure(mol, cache_name, file_fields)
+    
     return mol, file
 
 def open_structure_esm_fold(amino_acid_sequence, include_bonds=True):
     import biotite.structure.io.pdb as pdb
     
+    file = pdb.PDBFile.read(fold_esmfold(amino_acid_sequence))
     
-    
-    # output_of_subprocess = subprocess.Popen([
-    # 'curl',
-    # '-X',
-    # 'POST',
-    # '--data',
-    # amino_acid_sequence,
-    # 'https://api.esmatlas.com/foldSequence/v1/pdb/'
-    # ], stdout=subprocess.PIPE)
-
-    # (esm_folded_pdb_str, err) = output_of_subprocess.communicate()
-
-    r = requests.post('https://api.esmatlas.com/foldSequence/v1/pdb/', data=amino_acid_sequence)
-    
-    if r.ok:
-    
-        esm_folded_pdb_str = r.text
-        with io.StringIO() as f:
-            f.write(esm_folded_pdb_str)
-            f.seek(0)
-            file = pdb.PDBFile.read(f)
-    
-        # returns a numpy array stack, where each array in the stack is a model in the 
-        # the file. The stack will be of length = 1 if there is only one model in the file
-        mol = pdb.get_structure(file, extra_fields = ['b_factor', 'charge'], include_bonds = include_bonds)
-        return mol, file
-
-    else:
-        raise ValueError(f'ESMFold returned an error for the amino acid sequence input. This is the error message: {r.text}')
+    # returns a numpy array stack, where each array in the stack is a model in the 
+    # the file. The stack will be of length = 1 if there is only one model in the file
+    mol = pdb.get_structure(file, extra_fields = ['b_factor', 'charge'], include_bonds = include_bonds)
+    return mol, file
     
 def open_structure_local_pdb(file_path, include_bonds = True):
     import biotite.structure.io.pdb as pdb
@@ -210,10 +299,22 @@ def create_object(name, collection, locations, bonds=[]):
     """
     Creates a mesh with the given name in the given collection, from the supplied
     values for the locations of vertices, and if supplied, bonds as edges.
+    
+    The vertices and edges are allocated up front and filled with a single `foreach_set()`
+    from contiguous float32 / int32 buffers, which avoids `Mesh.from_pydata()` converting
+    the numpy arrays into python sequences.
     """
+    locations = np.ascontiguousarray(locations, dtype = np.float32).reshape(-1)
+    bonds = np.ascontiguousarray(bonds, dtype = np.int32).reshape(-1)
+    
     # create a new mesh
     mol_mesh = bpy.data.meshes.new(name)
-    mol_mesh.from_pydata(locations, bonds, faces=[])
+    mol_mesh.vertices.add(len(locations) // 3)
+    mol_mesh.vertices.foreach_set('co', locations)
+    if len(bonds) > 0:
+        mol_mesh.edges.add(len(bonds) // 2)
+        mol_mesh.edges.foreach_set('vertices', bonds)
+    mol_mesh.update()
     mol_object = bpy.data.objects.new(name, mol_mesh)
     collection.objects.link(mol_object)
     return mol_object
@@ -224,6 +325,35 @@ def add_attribute(object, name, data, type = "FLOAT", domain = "POINT", add = Tr
     attribute = object.data.attributes.new(name, type, domain)
     attribute.data.foreach_set('value', data)
 
+def remap_bonds(bonds, indices, n_atoms):
+    """
+    Remaps the atom indices of bonds after a selection, dropping any bonds that include an
+    atom which is no longer present.
+    
+    An inverse index array of length `n_atoms` is filled with -1 and the new index of each 
+    of the selected atoms, then gathered for both columns of the bonds in a single pass. Any
+    extra columns of the bonds (such as the bond type) are kept.
+
+    Args:
+        bonds (np.ndarray): Array of bonds, where the first two columns are atom indices.
+        indices (np.ndarray): The original indices of the selected atoms, in their new order.
+        n_atoms (int): The number of atoms before the selection.
+
+    Returns:
+        np.ndarray: The bonds between the selected atoms, with their new indices.
+    """
+    # signed copy of the bonds, so the -1 of removed atoms can be stored
+    bonds = np.array(bonds, dtype = int)
+    if len(bonds) == 0:
+        return bonds
+    
+    inverse = np.full(n_atoms, -1, dtype = int)
+    inverse[indices] = np.arange(len(indices))
+    
+    bonds[:, :2] = inverse[bonds[:, :2]]
+    
+    return bonds[np.all(bonds[:, :2] >= 0, axis = 1)]
+
 def pdb_get_b_factors(file):
     """
     Get a list, which contains a numpy array for each model containing the b-factors.
@@ -234,6 +364,36 @@ def pdb_get_b_factors(file):
         b_factors.append(atoms.b_factor)
     return b_factors
 
+# the secondary structure of each of the MMTF codes, indexed by the code plus one, where the
+# codes -1 to 7 are the DSSP classes 'X', 'I', 'S', 'H', 'E', 'G', 'B', 'T' and 'C'
+MMTF_SEC_STRUCT = np.array([
+    0, # X
+    1, # I: a
+    3, # S: c
+    1, # H: a
+    2, # E: b
+    1, # G: a
+    2, # B: b
+    3, # T: c
+    3  # C: c
+])
+
+def residue_index(mol_array):
+    """
+    The index of the residue of each atom. 
+    
+    If the atoms have a 'res_index' annotation, which is added by `create_molecule()` before
+    any atoms are removed, that is used so the index still matches the residues of the file.
+    """
+    import biotite.structure as struc
+    
+    if 'res_index' in mol_array.get_annotation_categories():
+        return mol_array.get_annotation('res_index')
+    
+    res_index = np.zeros(mol_array.array_length(), dtype = int)
+    res_index[struc.get_residue_starts(mol_array)[1:]] = 1
+    return np.cumsum(res_index)
+
 def get_secondary_structure(mol_array, file) -> np.array:
     """
     Gets the secondary structure annotation that is included in mmtf files and returns it as a numerical numpy array.
@@ -254,117 +414,96 @@ def get_secondary_structure(mol_array, file) -> np.array:
     ------------
     This function uses the biotite.structure package to extract the secondary structure information from the MMTF file.
     The resulting secondary structures are `1: Alpha Helix, 2: Beta-sheet, 3: loop`.
+    
+    The 'secStructList' has an entry for every residue in the file, so the residue of each
+    atom is found through `residue_index()`, which stays aligned with the file after 
+    solvent or other atoms have been removed.
     """
     
-    from biotite.structure import spread_residue_wise
-    
-    sec_struct_codes = {
-        -1: "X",
-        0 : "I",
-        1 : "S",
-        2 : "H",
-        3 : "E",
-        4 : "G",
-        5 : "B",
-        6 : "T",
-        7 : "C"
-    }
-    
-    dssp_to_abc = {
-        "X" : 0,
-        "I" : 1, #"a",
-        "S" : 3, #"c",
-        "H" : 1, #"a",
-        "E" : 2, #"b",
-        "G" : 1, #"a",
-        "B" : 2, #"b",
-        "T" : 3, #"c",
-        "C" : 3 #"c"
-    }
+    res_index = residue_index(mol_array)
     
     try:
-        sse = file["secStructList"]
+        sse = np.asarray(file["secStructList"], dtype = int)
     except KeyError:
-        ss_int = np.full(len(mol_array), 3)
         print('Warning: "secStructList" field missing from MMTF file. Defaulting \
             to "loop" for all residues.')
-    else:
-        ss_int = np.array(
-            [dssp_to_abc.get(sec_struct_codes.get(ss)) for ss in sse], 
-            dtype = int
-        )
-    atom_sse = spread_residue_wise(mol_array, ss_int)
+        return np.full(len(mol_array), 3)
+    
+    if len(res_index) and res_index.max() >= len(sse):
+        warnings.warn('"secStructList" has fewer entries than the residues of the structure. Defaulting to "loop" for all residues.')
+        return np.full(len(mol_array), 3)
+    
+    # unknown codes are treated as 'X'
+    ss_int = MMTF_SEC_STRUCT[np.where((sse >= -1) & (sse <= 7), sse + 1, 0)]
+    atom_sse = ss_int[res_index]
     
     return atom_sse
 
 
 def comp_secondary_structure(mol_array):
-    """Use dihedrals to compute the secondary structure of proteins
+    """Compute the secondary structure of proteins from their backbone hydrogen bonds
 
-    Through biotite built-in method derivated from P-SEA algorithm (Labesse 1997)
-    Returns an array with secondary structure for each atoms where:
-    - 0 = '' = non-protein or not assigned by biotite annotate_sse
+    Through a vectorised implementation of DSSP (Kabsch & Sander 1983), see `dssp.py`. 
+    An AtomArrayStack is assigned as a single batch, giving the secondary structure of 
+    every model.
+    Returns an array with secondary structure for each atom (of each model) where:
+    - 0 = non-protein or missing backbone atoms
     - 1 = a = alpha helix
     - 2 = b = beta sheet
     - 3 = c = coil
-
-    Inspired from https://www.biotite-python.org/examples/gallery/structure/transketolase_sse.html
     """
-    #TODO Port [PyDSSP](https://github.com/ShintaroMinami/PyDSSP)
-    #TODO Read 'secStructList' field from mmtf files
-    from biotite.structure import annotate_sse, spread_residue_wise
-
-    conv_sse_char_int = {'a': 1, 'b': 2, 'c': 3, '': 0} 
-
-    char_sse = annotate_sse(mol_array)
-    int_sse = np.array([conv_sse_char_int[char] for char in char_sse], dtype=int)
-    atom_sse = spread_residue_wise(mol_array, int_sse)
-        
-    return atom_sse
-
-def create_molecule(mol_array, 
-                    mol_name, 
-                    center_molecule = False, 
-                    file = None,
-                    calculate_ss = False,
-                    del_solvent = False, 
-                    include_bonds = False, 
-                    collection = None
-                    ):
     import biotite.structure as struc
-    
-    if np.shape(mol_array)[0] > 1:
-        mol_frames = mol_array
-    else:
-        mol_frames = None
-    
-    mol_array = mol_array[0]
-    
-    # remove the solvent from the structure if requested
-    if del_solvent:
-        mol_array = mol_array[np.invert(struc.filter_solvent(mol_array))]
 
-    world_scale = 0.01
-    locations = mol_array.coord * world_scale
-    
-    centroid = np.array([0, 0, 0])
-    if center_molecule:
-        centroid = struc.centroid(mol_array) * world_scale
+    # residues are numbered from 0, as removed atoms can leave gaps in the 'res_index'
+    res_index = np.unique(residue_index(mol_array), return_inverse = True)[1]
+    
+    res_sse = dssp.secondary_structure(
+        coord = mol_array.coord, 
+        atom_names = mol_array.atom_name, 
+        res_index = res_index, 
+        mask = struc.filter_amino_acids(mol_array), 
+        res_names = mol_array.res_name
+        )
+    atom_sse = res_sse[:, res_index]
     
+    if mol_array.coord.ndim == 2:
+        return atom_sse[0]
+    return atom_sse
 
-    # subtract the centroid from all of the positions to localise the molecule on the world origin
-    if center_molecule:
-        locations = locations - centroid
+# the attributes to compute for each of the attribute profiles, where 'full' is all of them
+ATTRIBUTE_PROFILES = {
+    'minimal': ['atomic_number', 'vdw_radii', 'chain_id', 'res_id'], 
+    'render': [
+        'atomic_number', 'vdw_radii', 'chain_id', 'res_id', 'res_name', 'atom_name', 
+        'b_factor', 'is_backbone', 'is_alpha_carbon', 'is_peptide', 'is_nucleic', 'sec_struct'
+        ]
+}
 
-    if not collection:
-        collection = coll.mn()
-    
-    if include_bonds and mol_array.bonds:
-        bonds = mol_array.bonds.as_array()
-        mol_object = create_object(name = mol_name, collection = collection, locations = locations, bonds = bonds[:, [0,1]])
-    else:
-        mol_object = create_object(name = mol_name, collection = collection, locations = locations)
+def attribute_names(attributes = 'full'):
+    """
+    Names of the attributes to compute for an attribute profile ('minimal', 'render' or 
+    'full') or an explicit list of attribute names. Returns None for 'full', meaning all 
+    of the attributes.
+    """
+    if isinstance(attributes, str):
+        if attributes == 'full':
+            return None
+        try:
+            return ATTRIBUTE_PROFILES[attributes]
+        except KeyError:
+            raise ValueError(
+                f"Unknown attribute profile '{attributes}', expected one of: 'full', {', '.join(ATTRIBUTE_PROFILES)}"
+                )
+    return list(attributes)
 
+def molecule_attributes(mol_object, mol_array, file = None, calculate_ss = False, world_scale = 0.01):
+    """
+    All of the attributes that can be added to a molecule, as a tuple of dictionaries with 
+    the name, the function that computes the values, the type and domain of each attribute.
+    The values are only computed when the function is called.
+    """
+    import biotite.structure as struc
+    
     # The attributes for the model are initially defined as single-use functions. This allows
     # for a loop that attempts to add each attibute by calling the function. Only during this
     # loop will the call fail if the attribute isn't accessible, and the warning is reported
@@ -375,65 +514,33 @@ def create_molecule(mol_array,
     # anybody might have.
     
     def att_atomic_number():
-        atomic_number = np.array(list(map(
-            lambda x: data.elements.get(x, {'atomic_number': -1}).get("atomic_number"), 
-            np.char.title(mol_array.element))))
-        return atomic_number
+        return atomic_numbers(mol_array.element)
     
     def att_res_id():
         return mol_array.res_id
     
     def att_res_name():
-        other_res = []
-        counter = 0
-        id_counter = -1
-        res_names = mol_array.res_name
-        res_names_new = []
-        res_ids = mol_array.res_id
-        res_nums  = []
-        
-        for name in res_names:
-            res_num = data.residues.get(name, {'res_name_num': 9999}).get('res_name_num')
-            
-            if res_num == 9999:
-                if res_names[counter - 1] != name or res_ids[counter] != res_ids[counter - 1]:
-                    id_counter += 1
-                
-                unique_res_name = str(id_counter + 100) + "_" + str(name)
-                other_res.append(unique_res_name)
-                
-                num = np.where(np.isin(np.unique(other_res), unique_res_name))[0][0] + 100
-                res_nums.append(num)
-            else:
-                res_nums.append(res_num)
-            counter += 1
-
-        mol_object['ligands'] = np.unique(other_res)
-        return np.array(res_nums)
+        res_nums, ligands = res_name_encode(mol_array.res_name, mol_array.res_id)
+        mol_object['ligands'] = ligands
+        return res_nums
 
     
     def att_chain_id():
-        chain_id = np.searchsorted(np.unique(mol_array.chain_id), mol_array.chain_id)
+        chain_id, chain_id_unique = chain_id_encode(mol_array.chain_id)
+        # add the unique chain names as a property of the object, so they can be used
+        # for labelling the chains in the interface
+        mol_object['chain_id_unique'] = chain_id_unique
         return chain_id
     
     def att_b_factor():
         return mol_array.b_factor
     
     def att_vdw_radii():
-        vdw_radii =  np.array(list(map(
-            # divide by 100 to convert from picometres to angstroms which is what all of coordinates are in
-            lambda x: data.elements.get(x, {'vdw_radii': 100}).get('vdw_radii', 100) / 100,  
-            np.char.title(mol_array.element)
-            )))
-        return vdw_radii * world_scale
+        # divide by 100 to convert from picometres to angstroms which is what all of coordinates are in
+        return vdw_radii(mol_array.element) / 100 * world_scale
     
     def att_atom_name():
-        atom_name = np.array(list(map(
-            lambda x: data.atom_names.get(x, 9999), 
-            mol_array.atom_name
-        )))
-        
-        return atom_name
+        return atom_name_numbers(mol_array.atom_name)
     
     def att_is_alpha():
         return np.isin(mol_array.atom_name, 'CA')
@@ -468,26 +575,7 @@ def create_molecule(mol_array,
             return get_secondary_structure(mol_array, file)
     
 
-    # Add information about the bond types to the model on the edge domain
-    # Bond types: 'ANY' = 0, 'SINGLE' = 1, 'DOUBLE' = 2, 'TRIPLE' = 3, 'QUADRUPLE' = 4
-    # 'AROMATIC_SINGLE' = 5, 'AROMATIC_DOUBLE' = 6, 'AROMATIC_TRIPLE' = 7
-    # https://www.biotite-python.org/apidoc/biotite.structure.BondType.html#biotite.structure.BondType
-    if include_bonds:
-        try:
-            add_attribute(
-                object = mol_object, 
-                name = 'bond_type', 
-                data = bonds[:, 2].copy(order = 'C'), # the .copy(order = 'C') is to fix a weird ordering issue with the resulting array
-                type = "INT", 
-                domain = "EDGE"
-                )
-        except:
-            warnings.warn('Unable to add bond types to the molecule.')
-
-    
-    # these are all of the attributes that will be added to the structure
-    # TODO add capcity for selection of particular attributes to include / not include to potentially
-    # boost performance, unsure if actually a good idea of not. Need to do some testing.
+    # these are all of the attributes that can be added to the structure
     attributes = (
         {'name': 'res_id',          'value': att_res_id,              'type': 'INT',     'domain': 'POINT'},
         {'name': 'res_name',        'value': att_res_name,            'type': 'INT',     'domain': 'POINT'},
@@ -506,12 +594,306 @@ def create_molecule(mol_array,
         {'name': 'sec_struct',      'value': att_sec_struct,          'type': 'INT',     'domain': 'POINT'}
     )
     
-    # assign the attributes to the object
-    for att in attributes:
+    return attributes
+
+def add_attributes(mol_object, mol_array, attributes = 'full', file = None, calculate_ss = False, world_scale = 0.01):
+    """
+    Computes and adds the requested attributes to a molecule object. 
+    
+    Attributes which the object already has are skipped, so this can also be used to add 
+    attributes that were left out on import to an existing object, from the same AtomArray
+    that was used to create it.
+
+    Args:
+        mol_object (bpy.types.Object): The molecule object.
+        mol_array (AtomArray): The atoms of the object, in the same order as its vertices.
+        attributes (str | list, optional): Attribute profile or list of attribute names, 
+        see `attribute_names()`. Defaults to 'full'.
+        file (optional): The structure file, used for secondary structure from MMTF files.
+        calculate_ss (bool, optional): Compute the secondary structure rather than reading
+        it from the file. Defaults to False.
+        world_scale (float, optional): Scale of the object in the world. Defaults to 0.01.
+    """
+    names = attribute_names(attributes)
+    added = []
+    
+    for att in molecule_attributes(mol_object, mol_array, file, calculate_ss, world_scale):
+        if names is not None and att['name'] not in names:
+            continue
+        if att['name'] in mol_object.data.attributes:
+            continue
         # try:
         add_attribute(mol_object, att['name'], att['value'](), att['type'], att['domain'])
+        added.append(att['name'])
         # except:
             # warnings.warn(f"Unable to add attribute: {att['name']}")
+    
+    return added
+
+def add_molecule_properties(mol_object, mol_array):
+    """
+    Adds the unique names of the ligands and chains of a molecule as properties of the 
+    object, which are used to label the selections in the interface. They are set by the
+    'res_name' and 'chain_id' attributes, but are needed whichever attributes were added.
+    """
+    if 'ligands' not in mol_object:
+        mol_object['ligands'] = res_name_encode(mol_array.res_name, mol_array.res_id)[1]
+    if 'chain_id_unique' not in mol_object:
+        mol_object['chain_id_unique'] = chain_id_encode(mol_array.chain_id)[1]
+
+# the directory of the cache with the side stores of molecules, which isn't evicted
+ATTRIBUTE_CACHE = 'attributes'
+# seconds after their last use that side stores which no object in the current .blend file
+# uses are deleted, which leaves time to reopen the other .blend files that use them
+ATTRIBUTE_STORE_AGE = 30 * 24 * 60 * 60
+
+def attribute_store_name(arrays):
+    """
+    Name of a side store from the contents of its arrays, so importing the same atoms 
+    again with the same options reuses the store rather than adding another.
+    """
+    digest = hashlib.sha1()
+    for key in sorted(arrays):
+        values = np.ascontiguousarray(arrays[key])
+        digest.update(f"{key}:{values.dtype.str}:{values.shape}".encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest() + '.npz'
+
+def attribute_stores_in_use():
+    "Names of the side stores that the objects of the current .blend file use."
+    return {obj['attribute_store'] for obj in bpy.data.objects if obj.get('attribute_store')}
+
+@persistent
+def touch_attribute_stores(*args):
+    """
+    Load handler which marks the side stores of the objects in an opened .blend file as 
+    used, so they are kept for `ATTRIBUTE_STORE_AGE` after the file was last opened.
+    """
+    for name in attribute_stores_in_use():
+        cache.get(ATTRIBUTE_CACHE, name)
+
+def store_attribute_source(mol_object, mol_array, file = None, calculate_ss = False, world_scale = 0.01):
+    """
+    Keeps the annotations of the atoms of a molecule object in a side store, so attributes
+    that were skipped on import can be added later with `materialise_attributes()`.
+    
+    Only the annotations that the attributes are computed from are kept, packed as compact
+    codes (see `encode.pack_annotations()`), in a directory of the cache that is never 
+    evicted so they can be reopened after the .blend file is reloaded. The coordinates 
+    are read back from the object when needed. Only the secondary structure of the file 
+    is kept, if it will be needed.
+    
+    The stores are named by their contents, so the same atoms share a store. A store is 
+    deleted once no object in the current .blend file uses it and it hasn't been used for
+    `ATTRIBUTE_STORE_AGE`, see `touch_attribute_stores()`.
+    """
+    arrays = pack_annotations(mol_array)
+    if file is not None and not calculate_ss:
+        try:
+            arrays['array_secStructList'] = np.asarray(file['secStructList'])
+        except (KeyError, TypeError):
+            pass
+    
+    name = attribute_store_name(arrays)
+    if not cache.get(ATTRIBUTE_CACHE, name):
+        with io.BytesIO() as f:
+            np.savez(f, **arrays)
+            cache.store(ATTRIBUTE_CACHE, name, f.getvalue())
+    
+    mol_object['attribute_store'] = name
+    mol_object['attribute_calculate_ss'] = calculate_ss
+    mol_object['attribute_world_scale'] = world_scale
+    
+    # the stores that no object has used for a while are removed
+    cache.prune(ATTRIBUTE_CACHE, attribute_stores_in_use(), ATTRIBUTE_STORE_AGE)
+
+def attribute_source(mol_object):
+    """
+    The atoms and file fields kept by `store_attribute_source()` for a molecule object, 
+    or None if the object has no side store, it is no longer in the cache or the object 
+    no longer has the same number of atoms.
+    
+    The coordinates of the atoms are those of the vertices of the object, which are only 
+    used for the secondary structure, where the centring of the molecule doesn't matter.
+    """
+    import biotite.structure as struc
+    
+    name = mol_object.get('attribute_store')
+    if not name:
+        return None
+    file_path = cache.get(ATTRIBUTE_CACHE, name)
+    if not file_path:
+        return None
+    
+    with np.load(file_path) as arrays:
+        annotations = unpack_annotations(arrays)
+        file_fields = None
+        if 'array_secStructList' in arrays.files:
+            file_fields = {'secStructList': arrays['array_secStructList']}
+    
+    n_atoms = len(mol_object.data.vertices)
+    if any(len(values) != n_atoms for values in annotations.values()):
+        return None
+    
+    coord = np.zeros(n_atoms * 3, dtype = np.float32)
+    mol_object.data.vertices.foreach_get('co', coord)
+    mol_array = struc.AtomArray(n_atoms)
+    mol_array.coord = coord.reshape(-1, 3) / mol_object.get('attribute_world_scale', 0.01)
+    for field, values in annotations.items():
+        mol_array.set_annotation(field, values)
+    
+    return mol_array, file_fields
+
+def has_attribute_source(mol_object):
+    """
+    Whether the skipped attributes of an object can be added later, from the side store of
+    a molecule or from the files of a trajectory (see `md.materialise_attributes()`).
+    """
+    return bool(mol_object.get('attribute_store') or mol_object.get('md_attribute_source'))
+
+def materialise_attributes(mol_object, names = None):
+    """
+    Adds attributes that were skipped on import to a molecule object, computing them from
+    its side store, or from the re-opened files of a trajectory.
+
+    Args:
+        mol_object (bpy.types.Object): The molecule object.
+        names (iterable, optional): Names of the attributes to add. Names which aren't 
+        molecule attributes or are already on the object are ignored. Defaults to None, 
+        which adds all of the missing attributes.
+
+    Returns:
+        list: Names of the attributes that were added.
+    """
+    if names is not None:
+        names = [name for name in names if name not in mol_object.data.attributes]
+        if not names:
+            return []
+    
+    # the topology of a trajectory is re-opened rather than kept in a side store
+    if mol_object.get('md_attribute_source'):
+        from . import md
+        return md.materialise_attributes(mol_object, names)
+    
+    if not mol_object.get('attribute_store'):
+        return []
+    
+    source = attribute_source(mol_object)
+    if source is None:
+        warnings.warn(f"Atoms of '{mol_object.name}' are no longer cached or have changed, unable to add missing attributes.")
+        return []
+    mol_array, file = source
+    
+    return add_attributes(
+        mol_object = mol_object, 
+        mol_array = mol_array, 
+        attributes = 'full' if names is None else names, 
+        file = file, 
+        calculate_ss = mol_object.get('attribute_calculate_ss', False), 
+        world_scale = mol_object.get('attribute_world_scale', 0.01)
+        )
+
+def materialise_node_attributes(mol_object):
+    """
+    Adds the attributes which are read by the geometry nodes modifiers of a molecule 
+    object, but were skipped on import. See `materialise_attributes()`.
+    """
+    if not has_attribute_source(mol_object):
+        return []
+    
+    names = set()
+    for modifier in mol_object.modifiers:
+        if modifier.type == 'NODES' and modifier.node_group:
+            names |= nodes.node_tree_attributes(modifier.node_group)
+    
+    return materialise_attributes(mol_object, names)
+
+def create_molecule(mol_array, 
+                    mol_name, 
+                    center_molecule = False, 
+                    file = None,
+                    calculate_ss = False,
+                    del_solvent = False, 
+                    include_bonds = False, 
+                    collection = None, 
+                    attributes = 'full'
+                    ):
+    import biotite.structure as struc
+    
+    if np.shape(mol_array)[0] > 1:
+        mol_frames = mol_array
+    else:
+        mol_frames = None
+    
+    mol_array = mol_array[0]
+    
+    # the secondary structure from the file is given for each of its residues, so the 
+    # residue of each atom is kept to look it up after the solvent has been removed
+    if file is not None and not calculate_ss:
+        mol_array.set_annotation('res_index', residue_index(mol_array))
+    
+    # remove the solvent from the structure if requested
+    if del_solvent:
+        mol_array = mol_array[np.invert(struc.filter_solvent(mol_array))]
+
+    world_scale = 0.01
+    locations = mol_array.coord * world_scale
+    
+    centroid = np.array([0, 0, 0])
+    if center_molecule:
+        centroid = struc.centroid(mol_array) * world_scale
+    
+
+    # subtract the centroid from all of the positions to localise the molecule on the world origin
+    if center_molecule:
+        locations = locations - centroid
+
+    if not collection:
+        collection = coll.mn()
+    
+    if include_bonds and mol_array.bonds:
+        bonds = mol_array.bonds.as_array()
+        mol_object = create_object(name = mol_name, collection = collection, locations = locations, bonds = bonds[:, [0,1]])
+    else:
+        mol_object = create_object(name = mol_name, collection = collection, locations = locations)
+
+    # Add information about the bond types to the model on the edge domain
+    # Bond types: 'ANY' = 0, 'SINGLE' = 1, 'DOUBLE' = 2, 'TRIPLE' = 3, 'QUADRUPLE' = 4
+    # 'AROMATIC_SINGLE' = 5, 'AROMATIC_DOUBLE' = 6, 'AROMATIC_TRIPLE' = 7
+    # https://www.biotite-python.org/apidoc/biotite.structure.BondType.html#biotite.structure.BondType
+    if include_bonds:
+        try:
+            add_attribute(
+                object = mol_object, 
+                name = 'bond_type', 
+                data = bonds[:, 2].copy(order = 'C'), # the .copy(order = 'C') is to fix a weird ordering issue with the resulting array
+                type = "INT", 
+                domain = "EDGE"
+                )
+        except:
+            warnings.warn('Unable to add bond types to the molecule.')
+
+    
+    # add the requested attributes to the object
+    add_attributes(
+        mol_object = mol_object, 
+        mol_array = mol_array, 
+        attributes = attributes, 
+        file = file, 
+        calculate_ss = calculate_ss, 
+        world_scale = world_scale
+        )
+    add_molecule_properties(mol_object, mol_array)
+    
+    # keep the atoms if any of the attributes were skipped, so they can be added later
+    if attribute_names(attributes) is not None:
+        store_attribute_source(
+            mol_object = mol_object, 
+            mol_array = mol_array, 
+            file = file, 
+            calculate_ss = calculate_ss, 
+            world_scale = world_scale
+            )
 
     if mol_frames:
         try:
@@ -519,6 +901,15 @@ def create_molecule(mol_array,
         except:
             b_factors = None
         
+        # the secondary structure of every frame is computed together
+        names = attribute_names(attributes)
+        frames_sse = None
+        if calculate_ss and (names is None or 'sec_struct' in names):
+            try:
+                frames_sse = comp_secondary_structure(mol_frames)
+            except:
+                warnings.warn('Unable to compute the secondary structure of the frames.')
+        
         coll_frames = coll.frames(mol_object.name)
         
         for i, frame in enumerate(mol_frames):
@@ -532,19 +923,14 @@ def create_molecule(mol_array,
                     add_attribute(obj_frame, 'b_factor', b_factors[i])
                 except:
                     b_factors = False
+            if frames_sse is not None:
+                add_attribute(obj_frame, 'sec_struct', frames_sse[i], 'INT')
         
         # disable the frames collection so it is not seen
         bpy.context.view_layer.layer_collection.children[collection.name].children[coll_frames.name].exclude = True
     else:
         coll_frames = None
     
-    # add custom properties to the actual blender object, such as number of chains, biological assemblies etc
-    # currently biological assemblies can be problematic to holding off on doing that
-    try:
-        mol_object['chain_id_unique'] = list(np.unique(mol_array.chain_id))
-    except:
-        warnings.warn('No chain information detected.')
-    
     return mol_object, coll_frames
 
 
@@ -1,10 +1,21 @@
 import bpy
 import numpy as np
-from . import data
+import os
+import hashlib
+import functools
+import uuid
+from collections import OrderedDict
+from bpy.app.handlers import persistent
 from . import coll
-from .load import create_object, add_attribute
+from . import dssp
+from .trajectory import read_coords
+from .load import create_object, add_attribute, remap_bonds, attribute_names
+from .encode import atomic_numbers, res_name_numbers, chain_id_encode
 import warnings
 
+# the number of atoms times frames that the secondary structure is computed for at once
+SSE_CHUNK_SIZE = 2 ** 24
+
 class TrajectorySelectionList(bpy.types.PropertyGroup):
     """Group of properties for custom selections for MDAnalysis import."""
     
@@ -73,7 +84,44 @@ def load_trajectory(file_top,
                     selection = "not (name H* or name OW)",
                     name = "default",
                     custom_selections = None,
+                    streaming = False,
+                    cache_size = 50,
+                    cache_coords = False,
+                    n_workers = 1,
+                    attributes = 'full',
+                    calculate_ss = False
                     ):
+    """
+    Load a molecular dynamics trajectory through MDAnalysis.
+    
+    By default every frame of the trajectory is created as a separate object inside of a 
+    frames collection. If `streaming` is True, only the topology object is created and the 
+    coordinates are read from the trajectory when the scene frame changes, keeping the 
+    most recent `cache_size` frames in memory. Returns the molecule object and the frames 
+    collection, which is None when streaming.
+    
+    If `cache_coords` is True, the coordinates of the selected atoms and frames are written
+    once to a packed .npy file next to the trajectory (see `path_to_coords()`), and later 
+    imports with the same files, selection and frames read from it instead of decoding the
+    trajectory again.
+    
+    If `n_workers` is greater than 1, the frames are decoded in parallel by that many 
+    processes (see `trajectory.read_coords()`) before the frame objects are created.
+    
+    The frame objects get the frame-specific 'occupancy' of trajectories that have it, such
+    as multi-model PDB files, but only when the frames are decoded one at a time. With 
+    `cache_coords` or `n_workers` the frames are built from the coordinates alone, and a 
+    warning is given when the occupancy is skipped.
+    
+    Only the per-atom attributes given by `attributes` are computed, as an attribute 
+    profile ('minimal', 'render' or 'full') or a list of attribute names (see 
+    `load.attribute_names()`). Custom selections are always added. The skipped attributes
+    can be added later with `load.materialise_attributes()`, which re-opens the files.
+    
+    If `calculate_ss` is True, the secondary structure of the proteins is computed with 
+    DSSP (see `dssp.py`) and added as the 'sec_struct' attribute of the topology, and of 
+    every frame unless streaming.
+    """
     
     import MDAnalysis as mda
     import MDAnalysis.transformations as trans
@@ -94,37 +142,45 @@ def load_trajectory(file_top,
             univ = univ.select_atoms(selection)
         except:
             warnings.warn(f"Unable to apply selection: '{selection}'. Loading entire topology.")
+            selection = ""
     
-    # Try and extract the elements from the topology. If the universe doesn't contain
-    # the element information, then guess based on the atom names in the toplogy
-    try:
-        elements = univ.atoms.elements.tolist()
-    except:
-        try:
-            elements = [mda.topology.guessers.guess_atom_element(x) for x in univ.atoms.names]
-        except:
-            pass
-        
+    frames = range(univ.universe.trajectory.n_frames)[md_start:md_end:md_step]
+    
+    coords = None
+    file_coords = None
+    if cache_coords:
+        file_coords = path_to_coords(file_top, file_traj, selection, md_start, md_end, md_step)
+        if os.path.exists(file_coords):
+            coords = np.load(file_coords, mmap_mode = 'r')
     
+    # the workers write straight into the sidecar when the coordinates are cached
+    parallel = n_workers > 1 and file_traj != "" and not streaming
+    if coords is None and (parallel or file_coords is not None):
+        try:
+            if parallel:
+                coords = read_coords(
+                    file_top, file_traj, selection, frames, len(univ.atoms), n_workers, 
+                    file_path = file_coords
+                    )
+            else:
+                coords = trajectory_to_coords(univ.atoms, traj, file_coords)
+        except OSError as error:
+            if file_coords is None:
+                raise
+            # the trajectory can be in a read-only or full directory, which only loses the cache
+            warnings.warn(f"Unable to cache the coordinates at: {file_coords}, continuing without caching. {error}")
+            file_coords = None
     
     if hasattr(univ, 'bonds') and include_bonds:
 
-            # If there is a selection, we need to recalculate the bond indices
+            # If there is a selection, we need to recalculate the bond indices. Bonds 
+            # where one of the atoms was deleted by the selection are dropped.
             if selection != "":
-                index_map = { index:i for i, index in enumerate(univ.atoms.indices) }
-
-                new_bonds = []
-                for bond in univ.bonds.indices:
-                    try:
-                        new_index = [index_map[y] for y in bond]
-                        new_bonds.append(new_index)
-                    except KeyError:
-                        # fragment - one of the atoms in the bonds was 
-                        # deleted by the selection, so we shouldn't 
-                        # pass this as a bond.  
-                        pass
-                    
-                bonds = np.array(new_bonds)
+                bonds = remap_bonds(
+                    bonds = univ.bonds.indices, 
+                    indices = univ.atoms.indices, 
+                    n_atoms = univ.universe.atoms.n_atoms
+                    )
             else:
                 bonds = univ.bonds.indices
 
@@ -140,7 +196,165 @@ def load_trajectory(file_top,
         bonds = bonds
     )
     
-    ## add the attributes for the model
+    # the built-in selections of the requested attributes and the custom selections are 
+    # evaluated together, and cached for the attributes and later imports
+    names = attribute_names(attributes)
+    key = (file_key(file_top, file_traj), selection)
+    selections = [sel for att, sel in SELECTIONS.items() if names is None or att in names]
+    # the secondary structure is only computed for the protein residues
+    if calculate_ss and SEL_PEPTIDE not in selections:
+        selections.append(SEL_PEPTIDE)
+    if custom_selections:
+        selections += [sel.selection for sel in custom_selections]
+    masks = selection_masks(atoms = univ.atoms, selections = selections, key = key)
+    
+    add_attributes(
+        mol_object = mol_object, 
+        atoms = univ.atoms, 
+        attributes = attributes, 
+        world_scale = world_scale, 
+        calculate_ss = calculate_ss, 
+        key = key
+        )
+    
+    # the chain selections of the interface need the chain names whichever attributes 
+    # were added
+    if 'chain_id_unique' not in mol_object:
+        try:
+            mol_object['chain_id_unique'] = chain_id_encode(univ.atoms.chainIDs)[1]
+        except AttributeError:
+            pass
+
+    # add the custom selections if they exist
+    if custom_selections:
+        for sel in custom_selections:
+            try:
+                add_attribute(
+                    object=mol_object, 
+                    name=sel.name, 
+                    data=masks[sel.selection], 
+                    type = "BOOLEAN", 
+                    domain = "POINT"
+                    )
+            except:
+                warnings.warn("Unable to add custom selection: {}".format(sel.name))
+
+    # store what is needed to re-open the trajectory, as the universe itself can't be 
+    # saved with the .blend file, for streaming and to add the skipped attributes later
+    if streaming or names is not None:
+        mol_object['md_file_top'] = file_top
+        mol_object['md_file_traj'] = file_traj
+        mol_object['md_selection'] = selection
+        mol_object['md_world_scale'] = world_scale
+    if names is not None:
+        mol_object['md_attribute_source'] = True
+        mol_object['md_calculate_ss'] = calculate_ss
+    
+    if streaming:
+        mol_object['md_streaming'] = True
+        mol_object['md_start'] = md_start
+        mol_object['md_end'] = md_end if md_end is not None else univ.universe.trajectory.n_frames
+        mol_object['md_step'] = md_step
+        mol_object['md_cache_size'] = cache_size
+        if file_coords is not None:
+            mol_object['md_file_coords'] = file_coords
+        
+        _streams[stream_id(mol_object)] = TrajectoryStream(
+            atoms = univ.atoms, 
+            frames = frames, 
+            world_scale = world_scale, 
+            cache_size = cache_size, 
+            coords = coords
+        )
+        return mol_object, None
+
+    coll_frames = coll.frames(name)
+    
+    if coords is not None:
+        # the secondary structure is computed for a chunk of frames at a time, so the memory
+        # it uses doesn't grow with the length of the trajectory
+        sse_chunk = max(1, SSE_CHUNK_SIZE // max(len(univ.atoms), 1))
+        
+        # the frames are read from the packed coordinates rather than decoding the 
+        # trajectory, so the frame-specific occupancy (see below) isn't added
+        if 'occupancy' in univ.universe.trajectory.ts.data:
+            warnings.warn(
+                "The frame-specific occupancy of the trajectory isn't added to the frames when "
+                "the coordinates are cached or decoded by multiple workers. Import with "
+                "`cache_coords = False` and `n_workers = 1` to add it."
+                )
+        for i, frame in enumerate(frames):
+            obj_frame = create_object(
+                name = name + "_frame_" + str(frame), 
+                collection = coll_frames, 
+                locations = coords[i] * world_scale
+            )
+            if calculate_ss:
+                if i % sse_chunk == 0:
+                    frames_sse = sec_struct(univ.atoms, coords[i:i + sse_chunk], key)
+                add_attribute(obj_frame, 'sec_struct', frames_sse[i % sse_chunk], 'INT')
+    else:
+        add_occupancy = True
+        for ts in traj:
+            frame = create_object(
+                name = name + "_frame_" + str(ts.frame),
+                collection = coll_frames, 
+                locations = univ.atoms.positions * world_scale
+            )
+            # adds occupancy data to each frame if it exists
+            # This is mostly for people who want to store frame-specific information in the 
+            # b_factor but currently neither biotite nor MDAnalysis give access to frame-specific
+            # b_factor information. MDAnalysis gives frame-specific access to the `occupancy` 
+            # so currently this is the only method to get frame-specific data into MN
+            # for more details: https://github.com/BradyAJohnston/MolecularNodes/issues/128
+            if add_occupancy:
+                try:
+                    add_attribute(frame, 'occupancy', ts.data['occupancy'])
+                except:
+                    add_occupancy = False
+            if calculate_ss:
+                add_attribute(frame, 'sec_struct', sec_struct(univ.atoms, univ.atoms.positions, key)[0], 'INT')
+    
+    # disable the frames collection from the viewer
+    bpy.context.view_layer.layer_collection.children[coll.mn().name].children[coll_frames.name].exclude = True
+    
+    return mol_object, coll_frames
+
+
+# the selections of the boolean attributes of a trajectory
+SEL_PEPTIDE = 'protein'
+SELECTIONS = {
+    'is_backbone':     'backbone or nucleicbackbone', 
+    'is_alpha_carbon': 'name CA', 
+    'is_solvent':      'name OW or name HW1 or name HW2', 
+    'is_nucleic':      'nucleic', 
+    'is_peptide':      SEL_PEPTIDE
+}
+
+def sec_struct(atoms, positions, key = None):
+    """
+    The secondary structure of each atom computed with DSSP, for each frame of the 
+    (n_frames, n_atoms, 3) positions of the atoms. See `selection_masks()` for the `key`.
+    """
+    is_peptide = selection_masks(atoms, [SEL_PEPTIDE], key)[SEL_PEPTIDE]
+    # residue of each atom, numbered from 0 inside of the selection
+    res_index = np.unique(atoms.resindices, return_inverse = True)[1]
+    res_sse = dssp.secondary_structure(
+        coord = positions, 
+        atom_names = atoms.names, 
+        res_index = res_index, 
+        mask = is_peptide, 
+        res_names = atoms.resnames
+    )
+    return res_sse[:, res_index].astype(np.int32)
+
+def trajectory_attributes(mol_object, atoms, world_scale = 0.01, key = None):
+    """
+    All of the attributes that can be added to the topology object of a trajectory, like 
+    `load.molecule_attributes()`. The values are only computed when the function is called,
+    with the selections evaluated through `selection_masks()` with the `key`.
+    """
+    import MDAnalysis as mda
     
     # The attributes for the model are initially defined as single-use functions. This allows
     # for a loop that attempts to add each attibute by calling the function. Only during this
@@ -148,130 +362,352 @@ def load_trajectory(file_top,
     # there rather than setting up a try: except: for each individual attribute which makes
     # some really messy code.
     
+    @functools.lru_cache(maxsize = None)
+    def elements():
+        # Try and extract the elements from the topology. If the universe doesn't contain
+        # the element information, then guess based on the atom names in the toplogy
+        try:
+            return atoms.elements.tolist()
+        except:
+            return [mda.topology.guessers.guess_atom_element(x) for x in atoms.names]
+    
     def att_atomic_number():
-        atomic_number = np.array(list(map(
-            # if getting the element fails for some reason, return an atomic number of -1
-            lambda x: data.elements.get(x, {"atomic_number": -1}).get("atomic_number"), 
-            np.char.title(elements) 
-        )))
-        return atomic_number
+        # if getting the element fails for some reason, return an atomic number of -1
+        return atomic_numbers(elements())
 
     def att_vdw_radii():
         try:
             vdw_radii = np.array(list(map(
                 lambda x: mda.topology.tables.vdwradii.get(x, 1), 
-                np.char.upper(elements)
+                np.char.upper(elements())
             )))
         except:
             # if fail to get radii, just return radii of 1 for everything as a backup
-            vdw_radii = np.ones(len(univ.atoms.names))
+            vdw_radii = np.ones(len(atoms.names))
             warnings.warn("Unable to extract VDW Radii. Defaulting to 1 for all points.")
         
         return vdw_radii * world_scale
     
     def att_res_id():
-        return univ.atoms.resnums
+        return atoms.resnums
     
     def att_res_name():
-        res_names =  np.array(list(map(lambda x: x[0: 3], univ.atoms.resnames)))
-        res_numbers = np.array(list(map(
-            lambda x: data.residues.get(x, {'res_name_num': 0}).get('res_name_num'), 
-            res_names
-            )))
-        return res_numbers
+        # only the first 3 characters of the residue names are used for the lookup
+        res_names = np.asarray(atoms.resnames).astype('<U3')
+        return res_name_numbers(res_names, default = 0)
     
     def att_b_factor():
-        return univ.atoms.tempfactors
+        return atoms.tempfactors
     
     def att_chain_id():
-        chain_id = univ.atoms.chainIDs
-        chain_id_unique = np.unique(chain_id)
-        chain_id_num = np.array(list(map(lambda x: np.where(x == chain_id_unique)[0][0], chain_id)))
+        chain_id_num, chain_id_unique = chain_id_encode(atoms.chainIDs)
         mol_object['chain_id_unique'] = chain_id_unique
         return chain_id_num
     
-    # returns a numpy array of booleans for each atom, whether or not they are in that selection
-    def bool_selection(selection):
-        return np.isin(univ.atoms.ix, univ.select_atoms(selection).ix).astype(bool)
-    
-    def att_is_backbone():
-        return bool_selection("backbone or nucleicbackbone")
-    
-    def att_is_alpha_carbon():
-        return bool_selection('name CA')
-    
-    def att_is_solvent():
-        return bool_selection('name OW or name HW1 or name HW2')
-    
     def att_atom_type():
-        return np.array(univ.atoms.types, dtype = int)
+        return np.array(atoms.types, dtype = int)
     
-    def att_is_nucleic():
-        return bool_selection('nucleic')
+    def selection(name):
+        sel = SELECTIONS[name]
+        return lambda: selection_masks(atoms, [sel], key)[sel]
     
-    def att_is_peptide():
-        return bool_selection('protein')
+    def att_sec_struct():
+        return sec_struct(atoms, atoms.positions, key)[0]
 
     attributes = (
-        {'name': 'atomic_number',   'value': att_atomic_number,   'type': 'INT',     'domain': 'POINT'}, 
-        {'name': 'vdw_radii',       'value': att_vdw_radii,       'type': 'FLOAT',   'domain': 'POINT'},
-        {'name': 'res_id',          'value': att_res_id,          'type': 'INT',     'domain': 'POINT'}, 
-        {'name': 'res_name',        'value': att_res_name,        'type': 'INT',     'domain': 'POINT'}, 
-        {'name': 'b_factor',        'value': att_b_factor,        'type': 'float',   'domain': 'POINT'}, 
-        {'name': 'chain_id',        'value': att_chain_id,        'type': 'INT',     'domain': 'POINT'}, 
-        {'name': 'atom_types',      'value': att_atom_type,       'type': 'INT',     'domain': 'POINT'}, 
-        {'name': 'is_backbone',     'value': att_is_backbone,     'type': 'BOOLEAN', 'domain': 'POINT'}, 
-        {'name': 'is_alpha_carbon', 'value': att_is_alpha_carbon, 'type': 'BOOLEAN', 'domain': 'POINT'}, 
-        {'name': 'is_solvent',      'value': att_is_solvent,      'type': 'BOOLEAN', 'domain': 'POINT'}, 
-        {'name': 'is_nucleic',      'value': att_is_nucleic,      'type': 'BOOLEAN', 'domain': 'POINT'}, 
-        {'name': 'is_peptide',      'value': att_is_peptide,      'type': 'BOOLEAN', 'domain': 'POINT'}, 
+        {'name': 'atomic_number',   'value': att_atomic_number,              'type': 'INT',     'domain': 'POINT'}, 
+        {'name': 'vdw_radii',       'value': att_vdw_radii,                  'type': 'FLOAT',   'domain': 'POINT'},
+        {'name': 'res_id',          'value': att_res_id,                     'type': 'INT',     'domain': 'POINT'}, 
+        {'name': 'res_name',        'value': att_res_name,                   'type': 'INT',     'domain': 'POINT'}, 
+        {'name': 'b_factor',        'value': att_b_factor,                   'type': 'float',   'domain': 'POINT'}, 
+        {'name': 'chain_id',        'value': att_chain_id,                   'type': 'INT',     'domain': 'POINT'}, 
+        {'name': 'atom_types',      'value': att_atom_type,                  'type': 'INT',     'domain': 'POINT'}, 
+        {'name': 'is_backbone',     'value': selection('is_backbone'),       'type': 'BOOLEAN', 'domain': 'POINT'}, 
+        {'name': 'is_alpha_carbon', 'value': selection('is_alpha_carbon'),   'type': 'BOOLEAN', 'domain': 'POINT'}, 
+        {'name': 'is_solvent',      'value': selection('is_solvent'),        'type': 'BOOLEAN', 'domain': 'POINT'}, 
+        {'name': 'is_nucleic',      'value': selection('is_nucleic'),        'type': 'BOOLEAN', 'domain': 'POINT'}, 
+        {'name': 'is_peptide',      'value': selection('is_peptide'),        'type': 'BOOLEAN', 'domain': 'POINT'}, 
+        {'name': 'sec_struct',      'value': att_sec_struct,                 'type': 'INT',     'domain': 'POINT'}, 
     )
     
-    for att in attributes:
+    return attributes
+
+def add_attributes(mol_object, atoms, attributes = 'full', world_scale = 0.01, calculate_ss = False, key = None):
+    """
+    Computes and adds the requested attributes to the topology object of a trajectory, 
+    skipping those that the object already has, like `load.add_attributes()`. The 
+    secondary structure is only added when `calculate_ss` is True. Returns the names of 
+    the attributes that were added.
+    """
+    names = attribute_names(attributes)
+    added = []
+    
+    for att in trajectory_attributes(mol_object, atoms, world_scale, key):
+        if names is not None and att['name'] not in names:
+            continue
+        if att['name'] == 'sec_struct' and not calculate_ss:
+            continue
+        if att['name'] in mol_object.data.attributes:
+            continue
         # tries to add the attribute to the mesh by calling the 'value' function which returns
         # the required values do be added to the domain.
         try:
             add_attribute(mol_object, att['name'], att['value'](), att['type'], att['domain'])
+            added.append(att['name'])
         except:
             warnings.warn(f"Unable to add attribute: {att['name']}.")
+    
+    return added
 
-    # add the custom selections if they exist
-    if custom_selections:
-        for sel in custom_selections:
-            try:
-                add_attribute(
-                    object=mol_object, 
-                    name=sel.name, 
-                    data=bool_selection(sel.selection), 
-                    type = "BOOLEAN", 
-                    domain = "POINT"
-                    )
-            except:
-                warnings.warn("Unable to add custom selection: {}".format(sel.name))
-
-    coll_frames = coll.frames(name)
+def open_atoms(obj):
+    """
+    Re-opens the universe of a trajectory object from the properties stored on it, 
+    returning the selected atoms.
+    """
+    import MDAnalysis as mda
     
-    add_occupancy = True
-    for ts in traj:
-        frame = create_object(
-            name = name + "_frame_" + str(ts.frame),
-            collection = coll_frames, 
-            locations = univ.atoms.positions * world_scale
-        )
-        # adds occupancy data to each frame if it exists
-        # This is mostly for people who want to store frame-specific information in the 
-        # b_factor but currently neither biotite nor MDAnalysis give access to frame-specific
-        # b_factor information. MDAnalysis gives frame-specific access to the `occupancy` 
-        # so currently this is the only method to get frame-specific data into MN
-        # for more details: https://github.com/BradyAJohnston/MolecularNodes/issues/128
-        if add_occupancy:
-            try:
-                add_attribute(frame, 'occupancy', ts.data['occupancy'])
-            except:
-                add_occupancy = False
+    if obj['md_file_traj'] == "":
+        univ = mda.Universe(obj['md_file_top'])
+    else:
+        univ = mda.Universe(obj['md_file_top'], obj['md_file_traj'])
     
-    # disable the frames collection from the viewer
-    bpy.context.view_layer.layer_collection.children[coll.mn().name].children[coll_frames.name].exclude = True
+    if obj['md_selection'] != "":
+        return univ.select_atoms(obj['md_selection'])
+    return univ.atoms
+
+def materialise_attributes(mol_object, names = None):
+    """
+    Adds attributes that were skipped when the trajectory was imported to its topology 
+    object, computing them from the re-opened universe, like `load.materialise_attributes()`.
+    """
+    # the files are only re-opened when one of the attributes can be added
+    if names is not None:
+        known = {att['name'] for att in trajectory_attributes(mol_object, atoms = None)}
+        names = [name for name in names if name in known and name not in mol_object.data.attributes]
+        if not names:
+            return []
     
-    return mol_object, coll_frames
+    try:
+        atoms = open_atoms(mol_object)
+        key = (file_key(mol_object['md_file_top'], mol_object['md_file_traj']), mol_object['md_selection'])
+    except Exception:
+        warnings.warn(f"Unable to open the trajectory of '{mol_object.name}', unable to add missing attributes.")
+        return []
+    
+    if len(atoms) != len(mol_object.data.vertices):
+        warnings.warn(f"Atoms of '{mol_object.name}' have changed, unable to add missing attributes.")
+        return []
+    
+    return add_attributes(
+        mol_object = mol_object, 
+        atoms = atoms, 
+        attributes = 'full' if names is None else names, 
+        world_scale = mol_object.get('md_world_scale', 0.01), 
+        calculate_ss = mol_object.get('md_calculate_ss', False), 
+        key = key
+        )
+
+def file_key(file_top, file_traj):
+    """
+    Identifies the topology & trajectory files by their paths, sizes and modification times, 
+    so that anything cached from them is no longer used once either of them changes.
+    """
+    key = []
+    for file in (file_top, file_traj):
+        if file:
+            stat = os.stat(file)
+            key += [os.path.abspath(file), stat.st_size, stat.st_mtime_ns]
+    return tuple(key)
+
+# boolean masks of selections that have already been evaluated, keyed by the files, the 
+# import selection and the selection string
+_selection_masks = OrderedDict()
+
+def selection_masks(atoms, selections, key = None, cache_size = 64):
+    """
+    Evaluates each of the selection strings against the atoms, returning a dictionary of 
+    a boolean mask for each selection string, of whether or not each atom is selected.
+    
+    Each selected AtomGroup is written straight into its mask through the position of its
+    atoms inside of `atoms`, using `.ix`. If `key` is given the masks are cached, so that 
+    importing the same files with the same selections again doesn't evaluate them again.
+    Selections that fail to evaluate are warned about and left out of the dictionary.
+    """
+    # position of each atom of the universe inside of the atoms, -1 if not included
+    inverse = np.full(atoms.universe.atoms.n_atoms, -1, dtype = int)
+    inverse[atoms.ix] = np.arange(len(atoms))
+    
+    masks = {}
+    for selection in selections:
+        if selection in masks:
+            continue
+        
+        cache_key = (key, selection)
+        if key is not None and cache_key in _selection_masks:
+            _selection_masks.move_to_end(cache_key)
+            masks[selection] = _selection_masks[cache_key]
+            continue
+        
+        try:
+            selected = atoms.select_atoms(selection)
+        except Exception:
+            warnings.warn(f"Unable to apply selection: '{selection}'.")
+            continue
+        
+        mask = np.zeros(len(atoms), dtype = bool)
+        mask[inverse[selected.ix]] = True
+        masks[selection] = mask
+        
+        if key is not None:
+            _selection_masks[cache_key] = mask
+            if len(_selection_masks) > cache_size:
+                _selection_masks.popitem(last = False)
     
+    return masks
+
+def path_to_coords(file_top, file_traj, selection, md_start, md_end, md_step):
+    """
+    Path of the packed coordinates file for a trajectory, which sits next to the trajectory.
+    
+    The name includes a hash of the topology & trajectory paths, sizes and modification 
+    times (see `file_key()`), the selection string and the frame range, so that a change 
+    to any of them results in a new file rather than stale coordinates.
+    """
+    key = [selection, md_start, md_end, md_step, *file_key(file_top, file_traj)]
+    digest = hashlib.sha1(str(key).encode()).hexdigest()[:12]
+    
+    file = file_traj if file_traj else file_top
+    name = os.path.basename(file).split(".")[0]
+    return os.path.join(os.path.dirname(file), f"{name}_{digest}.npy")
+
+def trajectory_to_coords(atoms, traj, file_path):
+    """
+    Writes the positions of the atoms for each frame of `traj` into a frame-major float32 
+    .npy file of shape (n_frames, n_atoms, 3), returning it opened as a read-only memmap.
+    
+    Raises an OSError if the file can't be written, leaving no partial file behind.
+    """
+    # write to a temporary file first, so an interrupted conversion is never read back
+    file_temp = file_path + '.part'
+    current_frame = atoms.universe.trajectory.ts.frame
+    try:
+        file_coords = np.lib.format.open_memmap(
+            file_temp, mode = 'w+', dtype = np.float32, shape = (len(traj), len(atoms), 3)
+        )
+        for i, ts in enumerate(traj):
+            file_coords[i] = atoms.positions
+        file_coords.flush()
+        del file_coords
+        os.replace(file_temp, file_path)
+    except OSError:
+        if os.path.exists(file_temp):
+            os.remove(file_temp)
+        raise
+    finally:
+        # return the trajectory to the frame it was on before writing
+        atoms.universe.trajectory[current_frame]
+    
+    return np.load(file_path, mmap_mode = 'r')
+
+
+class TrajectoryStream():
+    """
+    Reads the coordinates of a trajectory lazily, one frame at a time.
+    
+    The most recently used frames are kept in a bounded LRU cache, so that scrubbing back 
+    and forth over the timeline doesn't re-read them, while the memory used stays 
+    independent of the length of the trajectory.
+    """
+    def __init__(self, atoms, frames, world_scale = 0.01, cache_size = 50, coords = None):
+        self.atoms = atoms
+        self.frames = frames
+        self.world_scale = world_scale
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # optional packed (n_frames, n_atoms, 3) array of the coordinates of the frames, 
+        # read instead of the trajectory when available
+        self.coords = coords
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def positions(self, index):
+        "Returns the flattened float32 positions for the given index into the selected frames."
+        index = min(max(index, 0), len(self.frames) - 1)
+        frame = self.frames[index]
+        
+        if frame in self.cache:
+            self.cache.move_to_end(frame)
+            return self.cache[frame]
+        
+        if self.coords is not None:
+            positions = self.coords[index] * self.world_scale
+        else:
+            self.atoms.universe.trajectory[frame]
+            positions = self.atoms.positions * self.world_scale
+        positions = positions.astype(np.float32).reshape(-1)
+        
+        self.cache[frame] = positions
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+        
+        return positions
+
+# streams for the trajectories that are currently open, keyed by the `stream_id()` of 
+# their object
+_streams = {}
+
+def stream_id(obj):
+    """
+    The id of the stream of an object, stored on the object so that it stays the same when
+    the object is renamed. Objects from older files are given one when first streamed.
+    """
+    if 'md_stream_id' not in obj:
+        obj['md_stream_id'] = uuid.uuid4().hex
+    return obj['md_stream_id']
+
+def open_stream(obj):
+    """Re-opens the trajectory stream for an object, from the properties stored on it."""
+    atoms = open_atoms(obj)
+    
+    coords = None
+    file_coords = obj.get('md_file_coords')
+    if file_coords and os.path.exists(file_coords):
+        coords = np.load(file_coords, mmap_mode = 'r')
+    
+    stream = TrajectoryStream(
+        atoms = atoms, 
+        frames = range(atoms.universe.trajectory.n_frames)[obj['md_start']:obj['md_end']:obj['md_step']], 
+        world_scale = obj['md_world_scale'], 
+        cache_size = obj['md_cache_size'], 
+        coords = coords
+    )
+    _streams[stream_id(obj)] = stream
+    return stream
+
+@persistent
+def update_trajectories(scene):
+    """
+    Frame change handler that updates the positions of all streaming trajectory objects
+    to match the current frame of the scene.
+    """
+    for obj in bpy.data.objects:
+        if not obj.get('md_streaming'):
+            continue
+        
+        # the stream is checked against None, as an empty stream is falsy through `__len__`
+        stream = _streams.get(stream_id(obj))
+        if stream is None:
+            try:
+                stream = open_stream(obj)
+            except Exception:
+                warnings.warn(f"Unable to open trajectory for: {obj.name}")
+                obj['md_streaming'] = False
+                continue
+        
+        if len(stream) == 0:
+            continue
+        
+        positions = stream.positions(scene.frame_current - scene.frame_start)
+        obj.data.vertices.foreach_set('co', positions)
+        obj.data.update()
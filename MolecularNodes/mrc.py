@@ -0,0 +1,498 @@
+"""
+Reading MRC density maps and converting them to .vdb files with pyopenvdb, and the index of
+the conversions in each folder. This module doesn't import bpy, so the maps can be converted
+by worker processes (see `workers.py`), and the conversions are imported into Blender by 
+`density.py`. Like mrcfile, pyopenvdb is only imported by the functions that use it.
+"""
+
+import numpy as np
+import os
+import json
+import time
+import hashlib
+import tempfile
+from . import cache
+
+# the number of voxels that are read from the map and copied into the grid at a time
+CHUNK_SIZE = 2 ** 26
+
+def open_map(file: str, header_only: bool = False):
+    """Opens an MRC file with its data memory-mapped, so only the parts that are used are 
+    read from disk. Compressed files can't be memory-mapped and are read into memory.
+    
+    The file is opened in permissive mode, so maps with a slightly malformed header (which
+    are common) warn rather than fail to open. The file should be opened only once for a
+    conversion, with the header read from it by `map_header()` and the data by 
+    `map_volume()`.
+
+    Args:
+        file (str): The path to the MRC file.
+        header_only (bool, optional): Only read the header, without touching the data. 
+        Defaults to False.
+
+    Returns:
+        mrcfile.mrcfile.MrcFile: The opened file, to be used as a context manager.
+    """
+    import mrcfile
+    if header_only or file.endswith(('.gz', '.bz2')):
+        return mrcfile.open(file, mode = 'r', permissive = True, header_only = header_only)
+    return mrcfile.mmap(file, mode = 'r', permissive = True)
+
+def map_header(mrc) -> dict:
+    """The fields of the header of an opened MRC file, see `open_map()`.
+
+    The statistics are as written to the header, and are None where the header marks them
+    as not being set.
+
+    Returns:
+        dict: The `voxel_size` and `origin` as x, y, z arrays in Angstrom, the `axis_order`
+        of the columns, rows and sections of the data (1, 2, 3 for x, y, z), the `shape`
+        of the data in the order it is stored, its numpy `dtype`, and the `minimum`, 
+        `maximum`, `mean` and `rms` of the density.
+    """
+    import mrcfile
+    header = mrc.header
+    voxel_size = mrc.voxel_size
+    origin = header.origin
+    
+    # the data type of the mode, as the data itself may not have been read
+    dtype = mrcfile.utils.data_dtype_from_header(header)
+    
+    # a maximum smaller than the minimum marks the statistics as not being set
+    has_stats = header.dmax >= header.dmin
+    def stat(value):
+        return float(value) if has_stats else None
+    
+    return {
+        'voxel_size': np.array([voxel_size.x, voxel_size.y, voxel_size.z], dtype = float), 
+        'origin': np.array([origin.x, origin.y, origin.z], dtype = float), 
+        'axis_order': (int(header.mapc), int(header.mapr), int(header.maps)), 
+        'shape': (int(header.nz), int(header.ny), int(header.nx)), 
+        'dtype': np.dtype(dtype), 
+        'minimum': stat(header.dmin), 
+        'maximum': stat(header.dmax), 
+        'mean': stat(header.dmean), 
+        'rms': stat(header.rms) if header.rms >= 0 else None
+    }
+
+def read_map_header(file: str) -> dict:
+    "Reads the header fields of an MRC file without reading its data, see `map_header()`."
+    with open_map(file, header_only = True) as mrc:
+        return map_header(mrc)
+
+def map_volume(mrc) -> np.ndarray:
+    """The density of an opened MRC file, indexed by z, y and x.
+
+    Most maps are stored with the x axis as the columns and the z axis as the sections, 
+    but other axis orders are allowed by the format. Those are transposed into the usual 
+    order, which for a memory-mapped file is a view that still reads from disk as it is 
+    used.
+    """
+    if mrc.data is None:
+        raise ValueError("Unable to read the data of the map, as its header is invalid.")
+    
+    # the axis (1, 2, 3 for x, y, z) of the sections, rows and columns of the data
+    axes = (int(mrc.header.maps), int(mrc.header.mapr), int(mrc.header.mapc))
+    if sorted(axes) != [1, 2, 3] or axes == (3, 2, 1):
+        return mrc.data
+    return mrc.data.transpose([axes.index(axis) for axis in (3, 2, 1)])
+
+def map_to_grid(file: str, invert: bool = False, chunk_size: int = CHUNK_SIZE):
+    """Reads an MRC file and converts it into a pyopenvdb FloatGrid object.
+
+    This function reads a file in MRC format, and converts it into a pyopenvdb FloatGrid object,
+    which can be used to represent volumetric data in Blender. The file is memory-mapped and 
+    converted in slabs, see `volume_to_grid()`.
+
+    Args:
+        file (str): The path to the MRC file.
+        invert (bool): Whether to invert the data from the grid, defaulting to False. Some file types
+        such as EM tomograms have inverted values, where a high value == low density.
+        chunk_size (int, optional): Number of voxels in each slab that is converted.
+
+    Returns:
+        pyopenvdb.FloatGrid: A pyopenvdb FloatGrid object containing the density data.
+    """
+    with open_map(file) as mrc:
+        return volume_to_grid(map_volume(mrc), invert = invert, chunk_size = chunk_size)
+
+def volume_to_grid(
+    volume: np.ndarray, 
+    invert: bool = False, 
+    chunk_size: int = CHUNK_SIZE, 
+    threshold: float = None, 
+    tolerance: float = 0
+    ):
+    """Converts a volume into a pyopenvdb grid, one slab at a time.
+
+    The volume can be a memory-mapped array, as only a slab of about `chunk_size` voxels 
+    along the first axis is read into memory at once and copied into the grid at its 
+    offset. When inverting, the maximum of the whole volume is found in a first pass over
+    the slabs.
+    
+    Voxels that are within `tolerance` of the background value of 0 are inactive, as are 
+    voxels below `threshold` which are set to the background. The grid is then pruned, so 
+    the empty regions of the map take up next to no memory or disk space. The number of 
+    active and total voxels are stored in the grid's metadata, see `grid_stats()`.
+    
+    Only the reading of the map is bounded by the slabs. The grid holds every active voxel
+    in memory until it is written, so a dense map such as a tomogram without a threshold 
+    still needs about 4 bytes a voxel, as much memory as a float32 map on disk. A 
+    `threshold` or `tolerance` that leaves the background inactive keeps the grid sparse.
+
+    Args:
+        volume (np.ndarray): The 3D density values, such as `mrcfile.mmap(file).data`.
+        invert (bool): Whether to invert the data from the grid, defaulting to False.
+        chunk_size (int, optional): Number of voxels in each slab that is converted.
+        threshold (float, optional): Values below the threshold (after inverting) are 
+        inactive. Defaults to None, for no threshold.
+        tolerance (float, optional): Values within the tolerance of 0 are inactive. 
+        Defaults to 0.
+
+    Returns:
+        pyopenvdb.FloatGrid: A pyopenvdb grid containing the density data.
+    """
+    grids = volume_to_grids(
+        volume, 
+        invert = invert, 
+        chunk_size = chunk_size, 
+        threshold = threshold, 
+        tolerance = tolerance
+        )
+    return grids[1]
+
+def bin_volume(volume: np.ndarray, factor: int) -> np.ndarray:
+    """Averages the volume over blocks of `factor` voxels along each axis.
+
+    Blocks at the far edges that are cut off by the size of the volume are averaged over 
+    the voxels that they do have.
+    """
+    binned = volume.astype('float32')
+    for axis, size in enumerate(volume.shape):
+        starts = np.arange(0, size, factor)
+        # float32 counts, so the binned volume isn't promoted to float64
+        counts = np.diff(np.append(starts, size)).astype('float32')
+        shape = [1, 1, 1]
+        shape[axis] = len(starts)
+        binned = np.add.reduceat(binned, starts, axis = axis) / counts.reshape(shape)
+    return binned
+
+def volume_to_grids(
+    volume: np.ndarray, 
+    invert: bool = False, 
+    chunk_size: int = CHUNK_SIZE, 
+    threshold: float = None, 
+    tolerance: float = 0, 
+    levels = (1, )
+    ) -> dict:
+    """Converts a volume into a pyopenvdb grid for each of the levels of a pyramid.
+
+    Level 1 is the volume at full resolution, and each other level `n` is the volume 
+    averaged over blocks of n x n x n voxels (see `bin_volume()`), stored as a float grid.
+    Every level is built in the same pass over the slabs of the volume, see 
+    `volume_to_grid()` for the other arguments.
+
+    Returns:
+        dict: The grid of each level.
+    """
+    import pyopenvdb as vdb
+    
+    dataType = volume.dtype
+    
+    # enables different grid types
+    dtype = None
+    if dataType == "float32" or dataType == "float64":
+        grid_type = vdb.FloatGrid
+    elif dataType == "float16":
+        dtype = 'float32'
+        grid_type = vdb.FloatGrid
+    elif dataType in ("int8", "int16", "int32", "uint8", "uint16"):
+        dtype = 'int32'
+        grid_type = vdb.Int32Grid
+    elif dataType == "int64":
+        grid_type = vdb.Int64Grid
+    else:
+        raise ValueError(f"Grid data type '{dataType}' is an unsupported type.")
+    
+    # the binned levels are averages, so are always float grids
+    grids = {level: grid_type() if level == 1 else vdb.FloatGrid() for level in levels}
+    
+    # the slabs are planes along the first axis, so each is contiguous in the file, and 
+    # they are a multiple of every level deep so the blocks don't span two slabs
+    plane = int(np.prod(volume.shape[1:]))
+    depth = max(1, chunk_size // max(plane, 1))
+    block = int(np.lcm.reduce(list(levels)))
+    depth = -(-depth // block) * block
+    slabs = range(0, volume.shape[0], depth)
+
+    if invert:
+        volume_max = max(np.max(volume[i:i + depth]) for i in slabs)
+        volume_max = np.asarray(volume_max, dtype = dtype or dataType)
+    
+    # the tolerance has to match the value type of the grid
+    tolerances = {}
+    for level, grid in grids.items():
+        if isinstance(grid, vdb.FloatGrid):
+            tolerances[level] = float(tolerance)
+        else:
+            tolerances[level] = int(tolerance)
+    
+    for i in slabs:
+        slab = np.asarray(volume[i:i + depth], dtype = dtype)
+        if invert:
+            slab = volume_max - slab
+        
+        for level, grid in grids.items():
+            values = slab if level == 1 else bin_volume(slab, level)
+            if threshold is not None:
+                values = np.where(values < threshold, 0, values).astype(values.dtype, copy = False)
+            try:
+                grid.copyFromArray(values, ijk = (i // level, 0, 0), tolerance = tolerances[level])
+            except ValueError:
+                print(f"Grid data type '{values.dtype}' is an unsupported type.")
+    
+    for level, grid in grids.items():
+        # collapse the inactive regions into tiles
+        grid.prune(tolerances[level])
+        
+        grid.gridClass = vdb.GridClass.FOG_VOLUME
+        grid.name = 'density'
+        # stored as floats, as the counts of large maps can overflow 32-bit int metadata
+        grid['active_voxel_count'] = float(grid.activeVoxelCount())
+        grid['total_voxel_count'] = float(np.prod([-(-size // level) for size in volume.shape]))
+        grid['level'] = level
+    
+    return grids
+
+def grid_stats(grid) -> dict:
+    """The number of active and total voxels of a grid from `volume_to_grid()`, and the 
+    compression ratio of the total over the active voxels.
+
+    Args:
+        grid: The grid, or a dictionary of its metadata such as from a .vdb file.
+
+    Returns:
+        dict: 'active_voxel_count', 'total_voxel_count' and 'compression_ratio', or None 
+        if the grid doesn't have the counts.
+    """
+    try:
+        active = int(grid['active_voxel_count'])
+        total = int(grid['total_voxel_count'])
+    except KeyError:
+        return None
+    
+    return {
+        'active_voxel_count': active, 
+        'total_voxel_count': total, 
+        'compression_ratio': total / max(active, 1)
+    }
+
+def vdb_stats(file: str) -> dict:
+    """The `grid_stats()` of the density grid in a .vdb file, reading only its metadata.
+
+    Args:
+        file (str): Path to the VDB file.
+
+    Returns:
+        dict: The statistics of the grid, or None if it doesn't have them.
+    """
+    import pyopenvdb as vdb
+    
+    for metadata in vdb.readAllGridMetadata(file):
+        if metadata.name == 'density':
+            return grid_stats(metadata)
+    return None
+
+# the levels of the pyramid, as the number of voxels of the map along each axis of a voxel
+PYRAMID_LEVELS = (1, 2, 4, 8)
+
+def path_to_vdb(file: str, level: int = 1, key: str = None):
+    # Set up file paths, where each conversion of the map has its key as a suffix and the
+    # binned levels of a pyramid have the level as a suffix
+    folder_path = os.path.dirname(file)
+    name = os.path.basename(file).split(".")[0]
+    if key:
+        name += f"_{key}"
+    if level != 1:
+        name += f"_bin{level}"
+    file_name = name + '.vdb'
+    file_path = os.path.join(folder_path, file_name)
+    return file_path
+
+def convert_map(file: str, key: str, params: dict) -> dict:
+    """Converts a map to the .vdb files of a conversion, see `density.map_to_vdb()`.
+
+    This doesn't touch any Blender data, so it can be run on a background thread or in a 
+    worker process. The conversion still has to be recorded with `record_vdb()`.
+    Each file is written to a temporary file first, so an interrupted conversion is never
+    mistaken for a finished one.
+
+    Args:
+        file (str): The path to the input MRC file.
+        key (str): The key of the conversion, from `vdb_key()`.
+        params (dict): The parameters of the conversion, from `vdb_params()`.
+
+    Returns:
+        dict: The `grid_stats()` of the full resolution grid.
+    """
+    import pyopenvdb as vdb
+    
+    levels = PYRAMID_LEVELS if params['pyramid'] else (1, )
+    world_scale = params['world_scale']
+    
+    # The file is opened once, with the data memory-mapped and the voxel size from the header
+    with open_map(file) as mrc:
+        voxel_size = map_header(mrc)['voxel_size']
+        
+        # Convert the memory-mapped MRC data to a pyopenvdb grid, one slab at a time
+        grids = volume_to_grids(
+            map_volume(mrc), 
+            invert = params['invert'], 
+            threshold = params['threshold'], 
+            tolerance = params['tolerance'], 
+            levels = levels
+            )
+    
+    for level, grid in grids.items():
+        # Each binned voxel is centred on the block of voxels it was averaged from
+        if level != 1:
+            grid.transform.translate(np.full(3, (level - 1) / (2 * level)))
+        
+        # Rotate and scale the grid for import into Blender
+        grid.transform.rotate(np.pi / 2, vdb.Axis(1))
+        grid.transform.scale(np.array((-1, 1, 1)) * world_scale * voxel_size * level)
+        
+        # Write the grid to a .vdb file
+        file_path = path_to_vdb(file, level, key)
+        vdb.write(file_path + '.part', grid)
+        os.replace(file_path + '.part', file_path)
+    
+    stats = grid_stats(grids[1])
+    print(
+        f"Converted '{file}' with {stats['active_voxel_count']} of {stats['total_voxel_count']} "
+        f"voxels active, a compression ratio of {stats['compression_ratio']:.1f}."
+    )
+    return stats
+
+# the index of the .vdb files converted from the maps in a folder, which is kept in the folder
+VDB_INDEX = '.mn_vdb_index.json'
+
+def vdb_params(invert = False, world_scale = 0.01, threshold = None, tolerance = 0, pyramid = False) -> dict:
+    "The parameters of `density.map_to_vdb()` that change the converted .vdb files."
+    return {
+        'invert': bool(invert), 
+        'world_scale': float(world_scale), 
+        'threshold': None if threshold is None else float(threshold), 
+        'tolerance': float(tolerance), 
+        'pyramid': bool(pyramid)
+    }
+
+def vdb_key(file: str, params: dict) -> str:
+    """Identifies a conversion of a map by the path, size and modification time of the map 
+    and the parameters from `vdb_params()`, so a change to any of them gives a new key."""
+    stat = os.stat(file)
+    key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns, sorted(params.items()))
+    return hashlib.sha1(str(key).encode()).hexdigest()[:12]
+
+def read_vdb_index(folder: str) -> dict:
+    "Reads the index of the converted .vdb files in a folder, see `record_vdb()`."
+    try:
+        with open(os.path.join(folder, VDB_INDEX)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def write_vdb_index(folder: str, index: dict) -> None:
+    # written to a temporary file first, so an interrupted write never leaves a broken index
+    fd, path_temp = tempfile.mkstemp(suffix = '.part', dir = folder)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f, indent = 1)
+    os.replace(path_temp, os.path.join(folder, VDB_INDEX))
+
+def remove_vdb(index: dict, key: str) -> None:
+    "Deletes the files of a conversion and removes it from the index."
+    for path in index.pop(key)['files']:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def record_vdb(
+    file: str, 
+    key: str, 
+    params: dict, 
+    in_use: set, 
+    max_size: int = None, 
+    keep: set = None
+    ) -> None:
+    """Records a conversion of a map in the index of its folder, marking it as the most 
+    recently used.
+
+    When there is a size budget, conversions of an older version of the map are deleted, 
+    and then the least recently used conversions are deleted until the .vdb files of the 
+    folder fit in `max_size` bytes. The files in `in_use` are kept, which are those of the
+    volumes in the current .blend file (see `density.vdbs_in_use()`), but other .blend 
+    files that use a deleted conversion can no longer load it, which is why the budget is 
+    off unless it is set in the addon preferences.
+
+    Args:
+        file (str): Path to the MRC file.
+        key (str): The key of the conversion, from `vdb_key()`.
+        params (dict): The parameters of the conversion, from `vdb_params()`.
+        in_use (set): Absolute paths of the .vdb files that are in use, which are never 
+        deleted.
+        max_size (int, optional): Size budget for the .vdb files in bytes. Defaults to None, 
+        for the VDB budget from the addon preferences (see `cache.vdb_max_size()`), 
+        where nothing is deleted when it is off.
+        keep (set, optional): Keys of other conversions that are never deleted, such as 
+        the rest of a series of maps that is being loaded. Defaults to None.
+    """
+    if max_size is None:
+        max_size = cache.vdb_max_size()
+    
+    source = os.path.abspath(file)
+    folder = os.path.dirname(source)
+    stat = os.stat(source)
+    levels = PYRAMID_LEVELS if params['pyramid'] else (1, )
+    files = [path_to_vdb(source, level, key) for level in levels]
+    
+    index = read_vdb_index(folder)
+    
+    keep = keep or set()
+    
+    def used(entry):
+        return any(path in in_use for path in entry['files'])
+    
+    index[key] = {
+        'source': source, 
+        'size': stat.st_size, 
+        'mtime': stat.st_mtime_ns, 
+        'params': params, 
+        'files': files, 
+        'bytes': sum(os.path.getsize(path) for path in files), 
+        'used': time.time()
+    }
+    
+    if max_size is not None:
+        # conversions of an older version of the map are stale
+        for other, entry in list(index.items()):
+            stale = (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime_ns)
+            if entry['source'] == source and stale and not used(entry) and other not in keep:
+                remove_vdb(index, other)
+        
+        # evict the least recently used conversions
+        total = sum(entry['bytes'] for entry in index.values())
+        for other, entry in sorted(index.items(), key = lambda item: item[1]['used']):
+            if total <= max_size:
+                break
+            if other == key or other in keep or used(entry):
+                continue
+            remove_vdb(index, other)
+            total -= entry['bytes']
+    
+    write_vdb_index(folder, index)
+
+def is_converted(file: str, key: str, params: dict) -> bool:
+    "Whether all of the .vdb files of a conversion of the map exist."
+    levels = PYRAMID_LEVELS if params['pyramid'] else (1, )
+    return all(os.path.exists(path_to_vdb(file, level, key)) for level in levels)
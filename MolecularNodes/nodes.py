@@ -294,6 +294,33 @@ def create_starting_node_tree(obj, coll_frames, starting_style = "atoms"):
         link(node_colour.outputs['Atoms'], node_animate_frames.inputs['Atoms'])
         link(node_animate_frames.outputs['Atoms'], node_style.inputs['Atoms'])
         link(node_animate.outputs['Animate 0..1'], node_animate_frames.inputs['Animate 0..1'])
+    
+    # add any of the attributes used by the node tree that were skipped on import
+    from . import load
+    load.materialise_node_attributes(obj)
+
+def node_tree_attributes(node_group, names = None, visited = None):
+    """
+    Names of the attributes that are read by 'Named Attribute' nodes inside of the node 
+    group, including inside of any nested node groups.
+    """
+    if names is None:
+        names = set()
+    if visited is None:
+        visited = set()
+    if node_group.name in visited:
+        return names
+    visited.add(node_group.name)
+    
+    for node in node_group.nodes:
+        if node.bl_idname == 'GeometryNodeInputNamedAttribute':
+            name = node.inputs['Name']
+            if not name.is_linked and name.default_value:
+                names.add(name.default_value)
+        elif node.bl_idname == 'GeometryNodeGroup' and node.node_tree:
+            node_tree_attributes(node.node_tree, names, visited)
+    
+    return names
 
 
 def create_custom_surface(name, n_chains):
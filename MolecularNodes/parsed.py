@@ -0,0 +1,77 @@
+"""
+Parsed structures kept in the cache (see `cache.py`) as compressed .npz files, so a large
+structure only has to be parsed from its original file once. This module doesn't import
+bpy, and biotite is only imported when a structure is opened.
+"""
+
+import io
+import json
+import hashlib
+import numpy as np
+from . import cache
+
+# the directory of the cache with the parsed structures
+PARSED_CACHE = 'parsed'
+
+def structure_cache_name(*key):
+    "Name of the cached parsed structure for the given key, such as the file path and modification time."
+    return hashlib.sha1(str(key).encode()).hexdigest() + '.npz'
+
+def save_structure(mol, name, file_fields = None, subdir = PARSED_CACHE):
+    """
+    Saves the coordinates, annotations and bonds of an AtomArrayStack into the cache as a
+    compressed .npz file, so it can be opened again without parsing the original file.
+    
+    Args:
+        mol (AtomArrayStack): The parsed structure.
+        name (str): Name of the file in the cache, from `structure_cache_name()`.
+        file_fields (dict, optional): Fields of the original file that are needed later, 
+        which are returned in place of the file by `load_structure()`. Values must be 
+        arrays or JSON serialisable.
+        subdir (str, optional): Directory of the cache to save into. Defaults to `PARSED_CACHE`.
+    """
+    arrays = {'coord': mol.coord}
+    for category in mol.get_annotation_categories():
+        arrays['annotation_' + category] = mol.get_annotation(category)
+    if mol.bonds is not None:
+        arrays['bonds'] = mol.bonds.as_array()
+    for field, value in (file_fields or {}).items():
+        if isinstance(value, np.ndarray):
+            arrays['array_' + field] = value
+        else:
+            arrays['json_' + field] = np.array(json.dumps(value, default = lambda x: x.tolist()))
+    
+    with io.BytesIO() as f:
+        np.savez_compressed(f, **arrays)
+        return cache.store(subdir, name, f.getvalue())
+
+def load_structure(name, subdir = PARSED_CACHE):
+    """
+    Opens a structure saved with `save_structure()`.
+    
+    Returns:
+        tuple: The AtomArrayStack and a dictionary of the saved file fields (None if there 
+        were none), or None if the structure isn't in the cache.
+    """
+    import biotite.structure as struc
+    
+    file_path = cache.get(subdir, name)
+    if not file_path:
+        return None
+    
+    file_fields = {}
+    with np.load(file_path) as data:
+        coord = data['coord']
+        mol = struc.AtomArrayStack(coord.shape[0], coord.shape[1])
+        mol.coord = coord
+        for key in data.files:
+            if key.startswith('annotation_'):
+                mol.set_annotation(key[len('annotation_'):], data[key])
+            elif key.startswith('array_'):
+                file_fields[key[len('array_'):]] = data[key]
+            elif key.startswith('json_'):
+                file_fields[key[len('json_'):]] = json.loads(str(data[key]))
+        if 'bonds' in data.files:
+            mol.bonds = struc.BondList(coord.shape[1], data['bonds'])
+    
+    return mol, (file_fields or None)
@@ -25,9 +25,45 @@ def button_install_pkg(layout, name, version, desc = ''):
 # installing and reinstalling the required python packages defined in 'requirements.txt'
 class MolecularNodesPreferences(AddonPreferences):
     bl_idname = 'MolecularNodes'
+    
+    cache_dir: bpy.props.StringProperty(
+        name = 'cache_dir', 
+        description = 'Directory for downloaded structures and other cached files. Defaults to ~/.MolecularNodes/cache', 
+        default = '', 
+        subtype = 'DIR_PATH'
+    )
+    cache_size: bpy.props.IntProperty(
+        name = 'cache_size', 
+        description = 'Maximum size of the cache in MB, after which the least recently used files are removed', 
+        default = 1024, 
+        min = 0
+    )
+    vdb_size: bpy.props.IntProperty(
+        name = 'vdb_size', 
+        description = 'Maximum size in MB of the .vdb files converted from the maps in each folder, after which the least recently used conversions are deleted. Other .blend files that use a deleted conversion can no longer load it. 0 keeps every conversion', 
+        default = 0, 
+        min = 0
+    )
+    cache_offline: bpy.props.BoolProperty(
+        name = 'cache_offline', 
+        description = 'Only open structures from the cache, without connecting to the internet', 
+        default = False
+    )
 
     def draw(self, context):
         layout = self.layout
+        
+        box = layout.box()
+        box.label(text = "Cache for downloaded structures.")
+        box.prop(self, 'cache_dir', text = 'Cache Directory')
+        row = box.row()
+        row.prop(self, 'cache_size', text = 'Cache Size (MB)')
+        row.prop(self, 'cache_offline', text = 'Offline Mode')
+        
+        box = layout.box()
+        box.label(text = "Converted .vdb files of density maps, kept next to the maps.")
+        box.prop(self, 'vdb_size', text = 'VDB Budget per Folder (MB)')
+        
         layout.label(text = "Install the required packages for MolecularNodes.")
         
         col_main = layout.column(heading = '', align = False)
@@ -0,0 +1,96 @@
+"""
+Reading the coordinates of trajectories in parallel, by worker processes that each decode
+a chunk of the frames (see `workers.py`). This module doesn't import bpy, so that it can
+be imported by the workers.
+"""
+
+import os
+import tempfile
+import numpy as np
+from . import workers
+
+def read_coords_chunk(file_top, file_traj, selection, start, stop, step, offset, file_path):
+    """
+    Writes the positions of the selected atoms for the frames `start:stop:step` into the
+    .npy file of coordinates, from the frame at `offset`. Runs inside of a worker process,
+    which opens its own universe.
+    """
+    import MDAnalysis as mda
+
+    univ = mda.Universe(file_top, file_traj)
+    atoms = univ.select_atoms(selection) if selection != "" else univ.atoms
+
+    coords = np.load(file_path, mmap_mode = 'r+')
+    n_frames = 0
+    for ts in univ.trajectory[start:stop:step]:
+        coords[offset + n_frames] = atoms.positions
+        n_frames += 1
+    coords.flush()
+
+    return n_frames
+
+def read_coords(file_top, file_traj, selection, frames, n_atoms, n_workers = 4, file_path = None):
+    """
+    Reads the positions of the selected atoms for each of the frames using a pool of
+    worker processes, returning them as a read-only float32 memmap of shape
+    (n_frames, n_atoms, 3).
+
+    The frames are split into contiguous chunks, one per worker, and each worker writes
+    its chunk directly into a .npy file, so the coordinates are never held in memory
+    more than once.
+
+    Args:
+        file_top (str): Path to the topology.
+        file_traj (str): Path to the trajectory.
+        selection (str): Selection of the atoms, or "" for all of the atoms.
+        frames (range): The frames of the trajectory to read.
+        n_atoms (int): The number of selected atoms.
+        n_workers (int, optional): Number of worker processes. Defaults to 4.
+        file_path (str, optional): Path of the .npy file to keep the coordinates in, such
+        as the sidecar of `md.path_to_coords()`. Defaults to None, for a temporary file that
+        is removed once it is opened, where the platform allows it.
+
+    Raises:
+        OSError: If the file of the coordinates can't be written, leaving no partial file.
+        workers.WorkerError: If a worker fails to read its frames.
+    """
+    temporary = file_path is None
+    if temporary:
+        handle, file_path = tempfile.mkstemp(prefix = 'coords_', suffix = '.npy')
+        os.close(handle)
+    # write to a temporary file first, so an interrupted read is never used as a sidecar
+    file_temp = file_path if temporary else file_path + '.part'
+
+    try:
+        coords = np.lib.format.open_memmap(
+            file_temp, mode = 'w+', dtype = np.float32, shape = (len(frames), n_atoms, 3)
+        )
+        del coords
+
+        n_workers = max(1, min(n_workers, len(frames)))
+        bounds = np.linspace(0, len(frames), n_workers + 1).astype(int)
+        jobs = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            chunk = frames[start:end]
+            jobs.append((file_top, file_traj, selection, chunk.start, chunk.stop, chunk.step, int(start), file_temp))
+
+        for i, future in workers.run(read_coords_chunk, jobs, n_workers):
+            future.result()
+
+        if not temporary:
+            os.replace(file_temp, file_path)
+    except BaseException:
+        if os.path.exists(file_temp):
+            os.remove(file_temp)
+        raise
+
+    coords = np.load(file_path, mmap_mode = 'r')
+    if temporary:
+        # the open memmap keeps the data of the file until it is closed, except on Windows
+        # where an open file can't be removed, and it is left to the temporary directory
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    return coords
@@ -5,7 +5,91 @@ from . import load
 from . import md
 from . import assembly
 from . import density
+from . import cache
 import os
+import threading
+
+class BackgroundJob(threading.Thread):
+    """Runs a function on a background thread, keeping its result or the error it raised."""
+    
+    def __init__(self, label, function, **kwargs):
+        super().__init__(daemon = True)
+        self.label = label
+        self.function = function
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+    
+    def run(self):
+        try:
+            self.result = self.function(**self.kwargs)
+        except Exception as e:
+            self.error = e
+
+# the background jobs of the network imports that are currently running
+_jobs = []
+
+def update_job_status(context):
+    # shows the running network imports in the status bar, or clears it if there are none
+    if not context.workspace:
+        return
+    if _jobs:
+        labels = ", ".join(job.label for job in _jobs)
+        context.workspace.status_text_set(f"MolecularNodes: {labels} (Esc to cancel)")
+    else:
+        context.workspace.status_text_set(None)
+
+def start_job(operator, context, job):
+    """
+    Starts the job on a background thread and the operator as a modal operator, which 
+    checks on the job with a timer so the interface stays responsive. Without a window
+    (such as running from a script in background mode) the job is run immediately.
+    """
+    # read the cache settings on the main thread, for use by the background thread
+    cache.preferences()
+    
+    if not context.window:
+        job.run()
+        return operator.finish_job(context, job)
+    
+    operator._job = job
+    _jobs.append(job)
+    job.start()
+    
+    wm = context.window_manager
+    operator._timer = wm.event_timer_add(0.1, window = context.window)
+    wm.modal_handler_add(operator)
+    update_job_status(context)
+    return {'RUNNING_MODAL'}
+
+def modal_job(operator, context, event):
+    """
+    Modal step of a network import, finishing the import on the main thread once its job 
+    is complete, or cancelling it when Esc is pressed. A cancelled job is left to finish 
+    on its own, but its result is discarded.
+    """
+    job = operator._job
+    # only the press cancels, otherwise its release would cancel the next running import
+    if event.type == 'ESC' and event.value == 'PRESS':
+        end_job(operator, context)
+        operator.report({'WARNING'}, message = f"Cancelled: {job.label}")
+        return {'CANCELLED'}
+    
+    if event.type != 'TIMER':
+        return {'PASS_THROUGH'}
+    if job.is_alive():
+        # the label of jobs that report their progress changes while they run
+        update_job_status(context)
+        return {'PASS_THROUGH'}
+    
+    end_job(operator, context)
+    return operator.finish_job(context, job)
+
+def end_job(operator, context):
+    context.window_manager.event_timer_remove(operator._timer)
+    if operator._job in _jobs:
+        _jobs.remove(operator._job)
+    update_job_status(context)
 
 # operator that calls the function to import the structure from the PDB
 class MOL_OT_Import_Protein_RCSB(bpy.types.Operator):
@@ -21,12 +105,33 @@ class MOL_OT_Import_Protein_RCSB(bpy.types.Operator):
     def execute(self, context):
         pdb_code = bpy.context.scene.mol_pdb_code
         
+        # download and parse the structure on a background thread, and only create the 
+        # object on the main thread once it is done
+        job = BackgroundJob(
+            label = f"Downloading '{pdb_code}'", 
+            function = load.open_structure_rcsb, 
+            pdb_code = pdb_code, 
+            include_bonds = bpy.context.scene.mol_import_include_bonds
+        )
+        return start_job(self, context, job)
+    
+    def modal(self, context, event):
+        return modal_job(self, context, event)
+    
+    def finish_job(self, context, job):
+        pdb_code = job.kwargs['pdb_code']
+        if job.error:
+            self.report({'ERROR'}, message = f"Unable to download '{pdb_code}': {job.error}")
+            return {'CANCELLED'}
+        
         mol_object = load.molecule_rcsb(
             pdb_code=pdb_code,
             center_molecule=bpy.context.scene.mol_import_center, 
             del_solvent=bpy.context.scene.mol_import_del_solvent,
-            include_bonds=bpy.context.scene.mol_import_include_bonds,
-            starting_style=bpy.context.scene.mol_import_default_style
+            include_bonds=job.kwargs['include_bonds'],
+            starting_style=bpy.context.scene.mol_import_default_style, 
+            structure = job.result, 
+            attributes = bpy.context.scene.mol_import_attributes
         )
         
         bpy.context.view_layer.objects.active = mol_object
@@ -49,16 +154,38 @@ class MOL_OT_Import_Protein_ESMFold(bpy.types.Operator):
         return not False
 
     def execute(self, context):
-        amino_acid_sequence = bpy.context.scene.mol_esmfold_sequence
+        mol_name = bpy.context.scene.mol_esmfold_name
+        
+        # fold and parse the structure on a background thread, and only create the 
+        # object on the main thread once it is done
+        job = BackgroundJob(
+            label = f"Folding '{mol_name}'", 
+            function = load.open_structure_esm_fold, 
+            amino_acid_sequence = bpy.context.scene.mol_esmfold_sequence, 
+            include_bonds = bpy.context.scene.mol_import_include_bonds
+        )
+        self._mol_name = mol_name
+        return start_job(self, context, job)
+    
+    def modal(self, context, event):
+        return modal_job(self, context, event)
+    
+    def finish_job(self, context, job):
+        amino_acid_sequence = job.kwargs['amino_acid_sequence']
+        if job.error:
+            self.report({'ERROR'}, message = f"Unable to fold '{self._mol_name}': {job.error}")
+            return {'CANCELLED'}
         
         mol_object = load.molecule_esmfold(
             amino_acid_sequence=amino_acid_sequence, 
-            mol_name=bpy.context.scene.mol_esmfold_name,
-            include_bonds=bpy.context.scene.mol_import_include_bonds, 
+            mol_name=self._mol_name,
+            include_bonds=job.kwargs['include_bonds'], 
             center_molecule=bpy.context.scene.mol_import_center, 
             del_solvent=bpy.context.scene.mol_import_del_solvent, 
             starting_style=bpy.context.scene.mol_import_default_style, 
-            setup_nodes=True
+            setup_nodes=True, 
+            structure = job.result, 
+            attributes = bpy.context.scene.mol_import_attributes
             )
         
         # return the good news!
@@ -90,7 +217,8 @@ class MOL_OT_Import_Protein_Local(bpy.types.Operator):
             center_molecule=bpy.context.scene.mol_import_center, 
             del_solvent=bpy.context.scene.mol_import_del_solvent, 
             default_style=bpy.context.scene.mol_import_default_style, 
-            setup_nodes=True
+            setup_nodes=True, 
+            attributes = bpy.context.scene.mol_import_attributes
             )
         
         # return the good news!
@@ -122,6 +250,9 @@ class MOL_OT_Import_Protein_MD(bpy.types.Operator):
         del_solvent = bpy.context.scene.mol_import_del_solvent
         include_bonds = bpy.context.scene.mol_import_include_bonds
         custom_selections = bpy.context.scene.trajectory_selection_list
+        streaming = bpy.context.scene.mol_import_md_streaming
+        cache_coords = bpy.context.scene.mol_import_md_cache_coords
+        n_workers = bpy.context.scene.mol_import_md_n_workers
         
         mol_object, coll_frames = md.load_trajectory(
             file_top    = file_top, 
@@ -134,8 +265,16 @@ class MOL_OT_Import_Protein_MD(bpy.types.Operator):
             selection   = selection,
             include_bonds=include_bonds,
             custom_selections = custom_selections,
+            streaming   = streaming, 
+            cache_coords = cache_coords, 
+            n_workers   = n_workers, 
+            attributes  = bpy.context.scene.mol_import_attributes, 
+            calculate_ss = bpy.context.scene.mol_import_md_sec_struct
         )
-        n_frames = len(coll_frames.objects)
+        if streaming:
+            n_frames = len(md._streams[md.stream_id(mol_object)])
+        else:
+            n_frames = len(coll_frames.objects)
         
         nodes.create_starting_node_tree(
             obj = mol_object, 
@@ -218,14 +357,146 @@ class MOL_OT_Import_Map(bpy.types.Operator):
         map_file = bpy.context.scene.mol_import_map
         invert = bpy.context.scene.mol_import_map_invert
         setup_node_tree = bpy.context.scene.mol_import_map_nodes
+        threshold = None
+        if bpy.context.scene.mol_import_map_sparse:
+            threshold = bpy.context.scene.mol_import_map_threshold
+        
+        if bpy.context.scene.mol_import_map_surface:
+            surface = density.load_surface(
+                file = map_file, 
+                contour = bpy.context.scene.mol_import_map_contour, 
+                invert = invert, 
+                budget = bpy.context.scene.mol_import_map_budget
+                )
+            self.report({'INFO'}, message = (
+                f"Imported '{surface.name}' with {len(surface.data.polygons)} triangles"
+            ))
+            return {"FINISHED"}
         
         vol = density.load(
             file = map_file, 
-            invert = invert
+            invert = invert, 
+            threshold = threshold, 
+            pyramid = bpy.context.scene.mol_import_map_pyramid
             )
         if setup_node_tree:
             nodes.create_starting_nodes_density(vol)
         
+        if 'active_voxel_count' in vol:
+            self.report({'INFO'}, message = (
+                f"Imported '{vol.name}' with {vol['active_voxel_count']} active voxels, "
+                f"a compression ratio of {vol['compression_ratio']:.1f}"
+            ))
+        
+        return {"FINISHED"}
+
+class MOL_OT_Map_Level(bpy.types.Operator):
+    bl_idname = "mol.map_level"
+    bl_label = "Map Level"
+    bl_description = "Switch the active volume to a level of its map. Binned levels keep \
+        the viewport responsive, while level 1 is the full resolution map for rendering"
+    bl_options = {"REGISTER", "UNDO"}
+    
+    level: bpy.props.IntProperty(
+        name = "level", 
+        description = "Number of voxels of the map along each axis of a voxel", 
+        default = 1, 
+        min = 1
+    )
+    
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.get('map_levels') is not None
+    
+    def execute(self, context):
+        try:
+            density.set_level(context.active_object, self.level)
+        except ValueError as e:
+            self.report({'ERROR'}, message = str(e))
+            return {'CANCELLED'}
+        return {"FINISHED"}
+
+class MOL_OT_Import_Map_Series(bpy.types.Operator):
+    bl_idname = "mol.import_map_series"
+    bl_label = "ImportMapSeries"
+    bl_description = "Convert a folder of maps in parallel and import them as volumes, \
+        or as a single volume that shows one map per frame"
+    bl_options = {"REGISTER"}
+
+    @classmethod
+    def poll(cls, context):
+        return True
+
+    def execute(self, context):
+        scene = bpy.context.scene
+        files = density.map_files(bpy.path.abspath(scene.mol_import_map_series))
+        if not files:
+            self.report({'ERROR'}, message = f"No maps found in '{scene.mol_import_map_series}'")
+            return {'CANCELLED'}
+        
+        threshold = None
+        if scene.mol_import_map_sparse:
+            threshold = scene.mol_import_map_threshold
+        
+        # convert the maps on a background thread, which reports the progress in its label
+        job = BackgroundJob(
+            label = f"Converting {len(files)} maps", 
+            function = density.convert_maps, 
+            files = files, 
+            invert = scene.mol_import_map_invert, 
+            threshold = threshold, 
+            pyramid = scene.mol_import_map_pyramid, 
+            n_workers = scene.mol_import_map_n_workers
+        )
+        
+        def progress(n_done, n_total, file):
+            job.label = f"Converted {n_done} of {n_total} maps"
+        
+        job.kwargs['progress'] = progress
+        return start_job(self, context, job)
+    
+    def modal(self, context, event):
+        return modal_job(self, context, event)
+    
+    def finish_job(self, context, job):
+        if job.error:
+            self.report({'ERROR'}, message = f"Unable to convert the maps: {job.error}")
+            return {'CANCELLED'}
+        
+        vol_objects = density.load_series(
+            job.kwargs['files'], 
+            invert = job.kwargs['invert'], 
+            threshold = job.kwargs['threshold'], 
+            pyramid = job.kwargs['pyramid'], 
+            sequence = bpy.context.scene.mol_import_map_series_sequence, 
+            converted = job.result
+            )
+        if bpy.context.scene.mol_import_map_nodes:
+            for vol in vol_objects:
+                nodes.create_starting_nodes_density(vol)
+        
+        n_failed = sum(isinstance(key, Exception) for key in job.result)
+        if n_failed:
+            self.report({'WARNING'}, message = f"Unable to convert {n_failed} of the maps")
+        else:
+            self.report({'INFO'}, message = f"Imported {len(job.result)} maps")
+        
+        return {"FINISHED"}
+
+class MOL_OT_Map_Contour(bpy.types.Operator):
+    bl_idname = "mol.map_contour"
+    bl_label = "Map Contour"
+    bl_description = "Change the isosurface of the active object to the contour level"
+    bl_options = {"REGISTER", "UNDO"}
+    
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.get('map_contour') is not None
+    
+    def execute(self, context):
+        density.set_contour(context.active_object, context.scene.mol_import_map_contour)
         return {"FINISHED"}
 
 def MOL_PT_panel_map(layout_function, scene):
@@ -242,6 +513,57 @@ def MOL_PT_panel_map(layout_function, scene):
     
     row.operator('mol.import_map', text = 'Load Map', icon = 'FILE_TICK')
     
+    row_sparse = col_main.row()
+    row_sparse.prop(bpy.context.scene, 'mol_import_map_sparse', 
+             text = 'Sparse', 
+             emboss = True
+            )
+    row_threshold = row_sparse.row()
+    row_threshold.enabled = bpy.context.scene.mol_import_map_sparse
+    row_threshold.prop(bpy.context.scene, 'mol_import_map_threshold', 
+             text = 'Threshold', 
+             emboss = True
+            )
+    row_sparse.prop(bpy.context.scene, 'mol_import_map_pyramid', 
+             text = 'Pyramid', 
+             emboss = True
+            )
+    
+    row_surface = col_main.row()
+    row_surface.prop(bpy.context.scene, 'mol_import_map_surface', 
+             text = 'Surface', 
+             emboss = True
+            )
+    row_contour = row_surface.row()
+    row_contour.enabled = bpy.context.scene.mol_import_map_surface
+    row_contour.prop(bpy.context.scene, 'mol_import_map_contour', 
+             text = 'Contour', 
+             emboss = True
+            )
+    row_contour.prop(bpy.context.scene, 'mol_import_map_budget', 
+             text = 'Triangles', 
+             emboss = True
+            )
+    
+    # change the contour level of the active surface
+    obj = bpy.context.active_object
+    if obj is not None and obj.get('map_contour') is not None:
+        row_level = col_main.row(align = True)
+        row_level.label(text = f"Contour of '{obj.name}': {obj['map_contour']:.3g}")
+        row_level.operator('mol.map_contour', text = 'Set Contour')
+    
+    # switch the level of the active volume, if it has a pyramid
+    if obj is not None and len(obj.get('map_levels', [])) > 1:
+        row_level = col_main.row(align = True)
+        row_level.label(text = f"Level of '{obj.name}':")
+        for level in obj['map_levels']:
+            op = row_level.operator(
+                'mol.map_level', 
+                text = f"{level}x", 
+                depress = level == obj.get('map_level', 1)
+                )
+            op.level = level
+    
     col_main.prop(bpy.context.scene, 'mol_import_map', 
              text = 'EM Map', 
              emboss = True
@@ -251,14 +573,31 @@ def MOL_PT_panel_map(layout_function, scene):
     box.alignment = "LEFT"
     box.scale_y = 0.4
     box.label(
-        text = f"Intermediate file: {density.path_to_vdb(bpy.context.scene.mol_import_map)}."
+        text = f"Intermediate .vdb files in: {os.path.dirname(bpy.context.scene.mol_import_map)}."
         )
     box.label(
-        text = "Please do not delete this file or the volume will not render."
+        text = "Please do not delete these files or the volume will not render."
     )
     box.label(
         text = "Move the original .map file to change this location."
     )
+    
+    # a series of maps, such as a time series or the tomograms of a tilt series
+    col_main.label(text = 'Import a Series of EM Maps')
+    col_main.prop(bpy.context.scene, 'mol_import_map_series', 
+             text = 'Folder or pattern', 
+             emboss = True
+            )
+    row_series = col_main.row()
+    row_series.prop(bpy.context.scene, 'mol_import_map_series_sequence', 
+             text = 'As Frames', 
+             emboss = True
+            )
+    row_series.prop(bpy.context.scene, 'mol_import_map_n_workers', 
+             text = 'Processes', 
+             emboss = True
+            )
+    row_series.operator('mol.import_map_series', text = 'Load Series', icon = 'FILE_TICK')
 
 
 def MOL_PT_panel_md_traj(layout_function, scene):
@@ -303,11 +642,32 @@ def MOL_PT_panel_md_traj(layout_function, scene):
         text = 'End',
         emboss = True
     )
+    row_frame.prop(
+        bpy.context.scene, 'mol_import_md_n_workers', 
+        text = 'Workers',
+        emboss = True
+    )
     col_main.prop(
         bpy.context.scene, 'mol_md_selection', 
         text = 'Import Filter', 
         emboss = True
     )
+    row_stream = col_main.row()
+    row_stream.prop(
+        bpy.context.scene, 'mol_import_md_streaming', 
+        text = 'Stream frames from trajectory', 
+        emboss = True
+    )
+    row_stream.prop(
+        bpy.context.scene, 'mol_import_md_cache_coords', 
+        text = 'Cache coordinates', 
+        emboss = True
+    )
+    col_main.prop(
+        bpy.context.scene, 'mol_import_md_sec_struct', 
+        text = 'Secondary structure', 
+        emboss = True
+    )
     col_main.separator()
     col_main.label(text="Custom Selections")
     row = col_main.row(align=True)
@@ -454,6 +814,8 @@ def MOL_PT_panel_ui(layout_function, scene):
                 text = 'Delete Solvent', icon_value=0, emboss=True)
     grid.prop(bpy.context.scene, 'mol_import_include_bonds', 
                 text = 'Import Bonds', icon_value=0, emboss=True)
+    grid.prop(bpy.context.scene, 'mol_import_attributes', 
+                text = 'Attributes')
     grid.menu(
         'MOL_MT_Default_Style', 
         text = ['Atoms', 'Cartoon', 'Ribbon', 'Ball and Stick'][
@@ -594,11 +956,48 @@ class MOL_OT_Add_Custom_Node_Group(bpy.types.Operator):
         except RuntimeError:
             self.report({'ERROR'}, 
                         message='Failed to add node. Ensure you are not in edit mode.')
+            return {"FINISHED"}
+        
+        # add any attributes the new node reads that were skipped on import
+        obj = context.active_object
+        if obj and obj.type == 'MESH':
+            load.materialise_node_attributes(obj)
         return {"FINISHED"}
     
     def invoke(self, context, event):
         return self.execute(context)
 
+class MOL_OT_Materialise_Attributes(bpy.types.Operator):
+    bl_idname = "mol.materialise_attributes"
+    bl_label = "Add Missing Attributes"
+    bl_description = "Add the attributes that were skipped when importing the active \
+        molecule. Only the attributes used by its node trees are added, unless All is set"
+    bl_options = {"REGISTER", "UNDO"}
+    
+    all_attributes: bpy.props.BoolProperty(
+        name = "All", 
+        description = "Add all of the missing attributes, not just the ones used by the node trees", 
+        default = False
+    )
+    
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and load.has_attribute_source(obj)
+    
+    def execute(self, context):
+        obj = context.active_object
+        if self.all_attributes:
+            added = load.materialise_attributes(obj)
+        else:
+            added = load.materialise_node_attributes(obj)
+        
+        if added:
+            self.report({'INFO'}, message = f"Added attributes: {', '.join(added)}")
+        else:
+            self.report({'INFO'}, message = "No missing attributes to add.")
+        return {"FINISHED"}
+
 def menu_item_interface(layout_function, 
                         label, 
                         node_name, 
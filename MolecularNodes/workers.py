@@ -0,0 +1,108 @@
+"""
+Runs functions of the addon in separate python processes, for work such as decoding
+trajectories and converting maps that is parallel across files or frames.
+
+Each call starts a fresh python interpreter, rather than forking Blender, as libraries
+such as OpenVDB and TBB aren't safe to use after a fork. The addon can't be imported in
+that interpreter, as its `__init__.py` imports bpy, so the functions that are run this way
+must be in modules that don't import bpy. This file is run as the script of the worker,
+and imports their module through the package without running its `__init__.py`.
+
+The arguments and the result of each call are passed as JSON, so workers write large
+outputs such as coordinates to a file rather than returning them.
+"""
+
+import importlib
+import json
+import os
+import subprocess
+import sys
+import types
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+class WorkerError(RuntimeError):
+    "A worker process failed, with the end of its error output as the message."
+
+def call(function, args):
+    """
+    Calls `function(*args)` in a new python process and returns its result.
+
+    Args:
+        function (callable): A function at the top level of a module that doesn't import
+        bpy.
+        args (list): Arguments of the function, which must be JSON serialisable.
+
+    Raises:
+        WorkerError: If the worker process exits with an error.
+    """
+    module = sys.modules[function.__module__]
+    package = function.__module__.rpartition('.')[0]
+    command = [
+        os.path.realpath(sys.executable), os.path.abspath(__file__),
+        package, os.path.dirname(os.path.abspath(module.__file__)),
+        function.__module__, function.__name__
+    ]
+    # the worker finds the same packages as the current process, such as those that were
+    # installed into the python of Blender
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(path for path in sys.path if path))
+
+    process = subprocess.run(
+        command,
+        input = json.dumps(list(args)),
+        capture_output = True,
+        text = True,
+        env = env,
+        # stops a console window opening for each worker on Windows
+        creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+    )
+    if process.returncode != 0:
+        raise WorkerError(f"{function.__module__}.{function.__name__} failed:\n{process.stderr[-2000:]}")
+
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def run(function, jobs, n_workers = 1):
+    """
+    Calls `function(*args)` for each of the `args` in `jobs`, with up to `n_workers` worker
+    processes running at a time (see `call()`), yielding the index of each job and a future
+    of its result as they finish. With a single worker the jobs are run one at a time in
+    the current process instead.
+
+    Jobs that haven't started are cancelled if the caller stops iterating early, such as
+    when the result of an earlier job raises.
+    """
+    if n_workers <= 1:
+        for i, args in enumerate(jobs):
+            future = Future()
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            yield i, future
+        return
+
+    pool = ThreadPoolExecutor(max_workers = n_workers)
+    try:
+        futures = {pool.submit(call, function, args): i for i, args in enumerate(jobs)}
+        for future in as_completed(futures):
+            yield futures[future], future
+    finally:
+        pool.shutdown(wait = True, cancel_futures = True)
+
+def main():
+    package, path, module, name = sys.argv[1:5]
+
+    # only the modules of the package are imported, not the other files next to this one
+    if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+        sys.path.pop(0)
+
+    if package and package not in sys.modules:
+        module_package = types.ModuleType(package)
+        module_package.__path__ = [path]
+        sys.modules[package] = module_package
+
+    function = getattr(importlib.import_module(module), name)
+    result = function(*json.loads(sys.stdin.read()))
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
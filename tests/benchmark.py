@@ -0,0 +1,278 @@
+"""
+Benchmarks of the import paths of the addon, printed as a table of timings.
+
+Run with `python tests/benchmark.py <name>` from the root of the repository, where the
+benchmarks that need Blender are run inside of it with
+`blender -b --python tests/benchmark.py -- <name>`.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Blender doesn't put the directory of the script on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# registers the `MolecularNodes` package without running its `__init__.py`
+import conftest
+
+BENCHMARKS = {}
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+def timed(function, *args, **kwargs):
+    "Seconds taken by a single call of the function."
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def report(rows, header):
+    print(" | ".join(f"{name:>14}" for name in header))
+    for row in rows:
+        print(" | ".join(f"{value:>14.4f}" if isinstance(value, float) else f"{value:>14}" for value in row))
+
+@benchmark
+def attributes(sizes = (10_000, 1_000_000, 5_000_000)):
+    "Per-attribute timings of the lookup tables against the per-atom loops they replaced."
+    from MolecularNodes import data, encode
+    from test_encode import atomic_numbers_loop, vdw_radii_loop, atom_name_numbers_loop, res_name_numbers_loop
+
+    rng = np.random.default_rng(0)
+    elements = np.array(['C', 'N', 'O', 'S', 'H', 'P', 'FE', 'ZN'])
+    res_names = np.array(list(data.residues))
+    atom_names = np.array(list(data.atom_names))
+
+    rows = []
+    for size in sizes:
+        atoms = {
+            'element': rng.choice(elements, size),
+            'res_name': rng.choice(res_names, size),
+            'atom_name': rng.choice(atom_names, size)
+        }
+        cases = (
+            ('atomic_number', encode.atomic_numbers, atomic_numbers_loop, 'element'),
+            ('vdw_radii', encode.vdw_radii, vdw_radii_loop, 'element'),
+            ('atom_name', encode.atom_name_numbers, atom_name_numbers_loop, 'atom_name'),
+            ('res_name', encode.res_name_numbers, lambda x: res_name_numbers_loop(x, 9999), 'res_name'),
+        )
+        for name, new, old, field in cases:
+            t_new = timed(new, atoms[field])
+            t_old = timed(old, atoms[field])
+            rows.append((size, name, t_old, t_new, t_old / t_new))
+
+    report(rows, ('atoms', 'attribute', 'loop (s)', 'lookup (s)', 'speedup'))
+
+@benchmark
+def chains(n_chains = (10, 100, 500), n_atoms = 1_000_000):
+    "Encoding the chain IDs of the atoms, against the per-atom search of the MD import."
+    from MolecularNodes import encode
+    from test_encode import chain_ids, chain_id_loop
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for n in n_chains:
+        chain_id = chain_ids(rng, n, n_atoms)
+        t_old = timed(chain_id_loop, chain_id)
+        t_new = timed(encode.chain_id_encode, chain_id)
+        rows.append((n, t_old, t_new, t_old / t_new))
+
+    print(f"{n_atoms} atoms")
+    report(rows, ('chains', 'loop (s)', 'unique (s)', 'speedup'))
+
+@benchmark
+def dssp(n_frames = 100):
+    "The DSSP of `dssp.py` against the P-SEA of biotite, for a structure and for its frames."
+    import biotite.structure as struc
+    from MolecularNodes import dssp
+    from test_dssp import read_backbone
+
+    rows = []
+    for name in ('4ake_backbone.pdb.gz', '1a28_backbone.pdb.gz'):
+        coord, atom_names, res_names, res_index, chain_ids = read_backbone(name)
+        mol_array = struc.AtomArray(len(coord))
+        mol_array.coord = coord
+        mol_array.atom_name = atom_names
+        mol_array.res_name = res_names
+        mol_array.res_id = res_index
+        mol_array.chain_id = chain_ids
+        # frames with a little noise, as from a trajectory
+        rng = np.random.default_rng(0)
+        frames = coord + rng.normal(0, 0.1, (n_frames, *coord.shape))
+
+        # the first call includes the imports of biotite
+        struc.annotate_sse(mol_array)
+        t_psea = timed(struc.annotate_sse, mol_array)
+        t_dssp = timed(dssp.secondary_structure, coord, atom_names, res_index, res_names = res_names)
+        t_frames = timed(dssp.secondary_structure, frames, atom_names, res_index, res_names = res_names)
+        rows.append((name.split('_')[0], t_psea, t_dssp, t_frames / n_frames))
+
+    report(rows, ('structure', 'P-SEA (s)', 'DSSP (s)', 'DSSP / frame'))
+
+@benchmark
+def esmfold(workers = (1, 4, 8, 16), n_sequences = 64, latency = 0.2):
+    """
+    Sequences folded per second by `download.fold_esmfold_batch()`, against a local 
+    stand-in for the ESMFold server that answers each request after a delay.
+    """
+    import tempfile
+    from types import SimpleNamespace
+    from MolecularNodes import cache, download
+    from conftest import fold_server
+
+    rng = np.random.default_rng(0)
+    amino_acids = np.array(list('ACDEFGHIKLMNPQRSTVWY'))
+    rows = []
+    with fold_server(latency = latency) as (server, url):
+        for n_workers in workers:
+            # a new cache each time, so every sequence is a miss
+            cache._preferences = SimpleNamespace(cache_dir = tempfile.mkdtemp(), cache_size = 1024, cache_offline = False)
+            sequences = ["".join(rng.choice(amino_acids, 100)) for i in range(n_sequences)]
+            seconds = timed(download.fold_esmfold_batch, sequences, url = url, n_workers = n_workers)
+            rows.append((n_workers, n_sequences / seconds))
+
+    print(f"{n_sequences} sequences, {latency} s per request")
+    report(rows, ('workers', 'sequences / s'))
+
+@benchmark
+def mesh(sizes = (100_000, 1_000_000, 5_000_000)):
+    "Creation of the mesh of a molecule with `foreach_set()`, against `Mesh.from_pydata()`."
+    try:
+        import bpy
+    except ImportError:
+        sys.exit("The mesh benchmark needs Blender: blender -b --python tests/benchmark.py -- mesh")
+    from MolecularNodes.load import create_object
+
+    def from_pydata(name, collection, locations, bonds):
+        mol_mesh = bpy.data.meshes.new(name)
+        mol_mesh.from_pydata(locations, bonds, faces = [])
+        mol_object = bpy.data.objects.new(name, mol_mesh)
+        collection.objects.link(mol_object)
+        return mol_object
+
+    rng = np.random.default_rng(0)
+    collection = bpy.context.scene.collection
+    rows = []
+    for size in sizes:
+        locations = rng.uniform(-10, 10, (size, 3)).astype(np.float32)
+        # a chain of bonds, about as many as a molecule has atoms
+        bonds = np.stack((np.arange(size - 1), np.arange(1, size)), axis = 1)
+        t_old = timed(from_pydata, 'from_pydata', collection, locations, bonds)
+        t_new = timed(create_object, 'foreach_set', collection, locations, bonds)
+        rows.append((size, t_old, t_new, t_old / t_new))
+
+        for mesh in list(bpy.data.meshes):
+            bpy.data.meshes.remove(mesh)
+
+    report(rows, ('atoms', 'from_pydata (s)', 'foreach_set (s)', 'speedup'))
+
+@benchmark
+def parsed(sizes = (10_000, 100_000)):
+    """
+    Opening a structure from a .cif and an .mmtf file by parsing it (cold), against opening
+    the parsed structure from the cache with `parsed.load_structure()` (warm).
+    """
+    import tempfile
+    from types import SimpleNamespace
+    import biotite.structure as struc
+    import biotite.structure.io.pdbx as pdbx
+    import biotite.structure.io.mmtf as mmtf
+    from MolecularNodes import cache, parsed
+    from test_dssp import read_backbone
+
+    directory = tempfile.mkdtemp()
+    cache._preferences = SimpleNamespace(cache_dir = directory, cache_size = 100_000, cache_offline = False)
+
+    coord, atom_names, res_names, res_index, chain_ids = read_backbone('1a28_backbone.pdb.gz')
+
+    # parsed as by `load.open_structure_local_pdbx()` and `load.open_structure_rcsb()`
+    def parse_cif(file_path):
+        mol = pdbx.get_structure(pdbx.PDBxFile.read(file_path), extra_fields = ['b_factor', 'charge'])
+        mol[0].bonds = struc.bonds.connect_via_residue_names(mol[0], inter_residue = True)
+        return mol
+
+    def parse_mmtf(file_path):
+        return mmtf.get_structure(mmtf.MMTFFile.read(file_path), extra_fields = ['b_factor', 'charge'], include_bonds = True)
+
+    rows = []
+    for size in sizes:
+        # copies of the chains of 1A28 side by side, up to the number of atoms
+        copy, atom = np.divmod(np.arange(size), len(coord))
+        mol = struc.AtomArray(size)
+        mol.coord = coord[atom] + copy[:, None] * 60
+        mol.atom_name = atom_names[atom]
+        mol.res_name = res_names[atom]
+        mol.res_id = res_index[atom] + 1
+        mol.chain_id = np.char.add(chain_ids[atom], (copy % 100).astype(str))
+        mol.element = np.array([name[0] for name in atom_names])[atom]
+        mol.add_annotation('b_factor', dtype = float)
+        mol.add_annotation('charge', dtype = int)
+        # the bonds are written to the MMTF file, as they are by the PDB
+        mol.bonds = struc.connect_via_residue_names(mol, inter_residue = True)
+
+        file_cif = os.path.join(directory, f'{size}.cif')
+        cif = pdbx.PDBxFile()
+        pdbx.set_structure(cif, mol, data_block = 'bench')
+        cif.write(file_cif)
+        file_mmtf = os.path.join(directory, f'{size}.mmtf')
+        mmtf_file = mmtf.MMTFFile()
+        mmtf.set_structure(mmtf_file, mol)
+        mmtf_file.write(file_mmtf)
+
+        for format, parse, file_path in (('cif', parse_cif, file_cif), ('mmtf', parse_mmtf, file_mmtf)):
+            name = parsed.structure_cache_name(file_path)
+            start = time.perf_counter()
+            parsed.save_structure(parse(file_path), name)
+            t_cold = time.perf_counter() - start
+            t_warm = timed(parsed.load_structure, name)
+            rows.append((size, format, t_cold, t_warm, t_cold / t_warm))
+
+    report(rows, ('atoms', 'format', 'cold (s)', 'warm (s)', 'speedup'))
+
+@benchmark
+def trajectory(workers = (1, 4, 16, 64), n_atoms = 20_000, n_frames = 1_000):
+    "Frames per second read from an XTC trajectory by `trajectory.read_coords()`."
+    import tempfile
+    import MDAnalysis as mda
+    from MolecularNodes.trajectory import read_coords
+
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp()
+    univ = mda.Universe.empty(n_atoms, trajectory = True)
+    univ.add_TopologyAttr('name', ['CA'] * n_atoms)
+    univ.add_TopologyAttr('resname', ['ALA'])
+    univ.add_TopologyAttr('resid', [1])
+    file_top = os.path.join(directory, 'top.pdb')
+    file_traj = os.path.join(directory, 'traj.xtc')
+    univ.atoms.positions = rng.uniform(0, 100, (n_atoms, 3))
+    univ.atoms.write(file_top)
+    with mda.Writer(file_traj, n_atoms) as writer:
+        for frame in range(n_frames):
+            univ.atoms.positions += rng.normal(0, 0.1, (n_atoms, 3))
+            writer.write(univ.atoms)
+
+    def serial():
+        atoms = mda.Universe(file_top, file_traj).atoms
+        coords = np.zeros((n_frames, n_atoms, 3), dtype = np.float32)
+        for i, ts in enumerate(atoms.universe.trajectory):
+            coords[i] = atoms.positions
+
+    rows = [('serial loop', n_frames / timed(serial))]
+    for n_workers in workers:
+        seconds = timed(read_coords, file_top, file_traj, "", range(n_frames), n_atoms, n_workers)
+        rows.append((n_workers, n_frames / seconds))
+
+    print(f"{n_atoms} atoms, {n_frames} frames, {os.cpu_count()} CPUs")
+    report(rows, ('workers', 'frames / s'))
+
+if __name__ == '__main__':
+    # arguments after `--` when run inside of Blender
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('name', choices = sorted(BENCHMARKS))
+    parser.add_argument('--workers', type = int, nargs = '+', help = "Numbers of workers to time.")
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.name](**({'workers': args.workers} if args.workers else {}))
@@ -0,0 +1,89 @@
+"""
+The tests cover the modules of the addon that don't need Blender, such as `encode.py` and
+`dssp.py`. They are imported through the `MolecularNodes` package without running its
+`__init__.py`, which imports bpy to register the addon.
+
+Run them from the root of the repository with `python -m pytest tests`. The tests marked
+`large`, which write and convert files of several GB, are only run with `--run-large`.
+"""
+
+import contextlib
+import http.server
+import os
+import sys
+import threading
+import time
+import types
+from types import SimpleNamespace
+
+import pytest
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'MolecularNodes')
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+if 'MolecularNodes' not in sys.modules:
+    package = types.ModuleType('MolecularNodes')
+    package.__path__ = [ADDON_DIR]
+    sys.modules['MolecularNodes'] = package
+
+@pytest.fixture
+def cache_root(tmp_path, monkeypatch):
+    "A cache directory of 1 MB, in place of the addon preferences."
+    from MolecularNodes import cache
+    monkeypatch.setattr(cache, '_preferences', SimpleNamespace(
+        cache_dir = str(tmp_path), cache_size = 1, cache_offline = False
+    ))
+    return tmp_path
+
+class FoldHandler(http.server.BaseHTTPRequestHandler):
+    """
+    A stand-in for the ESMFold server, which answers each POST of a sequence with a .pdb 
+    after the latency of the server, or with the next of its error statuses.
+    """
+    def do_POST(self):
+        sequence = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        with self.server.lock:
+            self.server.requests.append(sequence)
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        time.sleep(self.server.latency)
+        body = f"REMARK {sequence}\nEND\n" if status == 200 else "busy"
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+@contextlib.contextmanager
+def fold_server(latency = 0.0, statuses = ()):
+    """
+    Runs a `FoldHandler` server on a local port, yielding the server, with the sequences it
+    was sent in `server.requests`, and its URL.
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FoldHandler)
+    server.latency = latency
+    server.statuses = list(statuses)
+    server.requests = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target = server.serve_forever, kwargs = {'poll_interval': 0.05}, daemon = True)
+    thread.start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_port}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def pytest_addoption(parser):
+    parser.addoption('--run-large', action = 'store_true', help = "Run the tests marked as large.")
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "large: writes and converts files of several GB, run with --run-large")
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-large'):
+        return
+    skip = pytest.mark.skip(reason = "A large test, run with --run-large.")
+    for item in items:
+        if 'large' in item.keywords:
+            item.add_marker(skip)
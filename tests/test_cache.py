@@ -0,0 +1,139 @@
+import hashlib
+import io
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import fold_server
+from MolecularNodes import cache
+from MolecularNodes import download
+
+def offline(monkeypatch):
+    monkeypatch.setattr(cache._preferences, 'cache_offline', True)
+
+def seed(root, subdir, name, data = b'cached'):
+    os.makedirs(root / subdir, exist_ok = True)
+    path = root / subdir / name
+    path.write_bytes(data)
+    return str(path)
+
+class NoNetwork:
+    "A requests session that fails any request."
+    def post(self, *args, **kwargs):
+        raise AssertionError("The cache was missed and a request was made.")
+
+def test_rcsb_hit(cache_root, monkeypatch):
+    path = seed(cache_root, 'rcsb', '4ozs.mmtf')
+    # biotite isn't imported for a structure that is in the cache
+    monkeypatch.setitem(sys.modules, 'biotite.database.rcsb', None)
+    assert download.fetch_rcsb('4OZS') == path
+
+    offline(monkeypatch)
+    assert download.fetch_rcsb('4ozs') == path
+
+def test_esmfold_hit(cache_root, monkeypatch):
+    sequence = 'MKTAYIAKQR'
+    name = hashlib.sha256(sequence.encode()).hexdigest() + '.pdb'
+    path = seed(cache_root, 'esmfold', name)
+    # the sequence is normalised before it is looked up
+    assert download.fold_esmfold(' mkta yiakqr\n', session = NoNetwork()) == path
+
+def test_rcsb_miss(cache_root, monkeypatch):
+    fetched = []
+    def fetch(pdb_code, format):
+        fetched.append(pdb_code)
+        return io.BytesIO(b'downloaded')
+    # a stand-in for biotite, which is imported on the miss
+    rcsb = SimpleNamespace(fetch = fetch)
+    biotite = SimpleNamespace(database = SimpleNamespace(rcsb = rcsb))
+    monkeypatch.setitem(sys.modules, 'biotite', biotite)
+    monkeypatch.setitem(sys.modules, 'biotite.database', biotite.database)
+    monkeypatch.setitem(sys.modules, 'biotite.database.rcsb', rcsb)
+
+    path = download.fetch_rcsb('4OZS')
+    assert fetched == ['4OZS']
+    assert path == str(cache_root / 'rcsb' / '4ozs.mmtf')
+    assert open(path, 'rb').read() == b'downloaded'
+    # the stored file is a hit, without another download
+    assert download.fetch_rcsb('4ozs') == path
+    assert fetched == ['4OZS']
+
+def test_esmfold_miss(cache_root):
+    pytest.importorskip('requests')
+    sequence = 'MKTAYIAKQR'
+    name = hashlib.sha256(sequence.encode()).hexdigest() + '.pdb'
+    with fold_server() as (server, url):
+        path = download.fold_esmfold(sequence, url = url)
+        assert server.requests == [sequence]
+        assert path == str(cache_root / 'esmfold' / name)
+        assert open(path).read() == f"REMARK {sequence}\nEND\n"
+
+        # the stored prediction is a hit for the same sequence, without another request
+        assert download.fold_esmfold(' mkta yiakqr\n', url = url) == path
+        assert download.fold_esmfold(sequence, session = NoNetwork()) == path
+        assert server.requests == [sequence]
+
+def test_offline_miss(cache_root, monkeypatch):
+    offline(monkeypatch)
+    start = time.perf_counter()
+    with pytest.raises(FileNotFoundError):
+        download.fetch_rcsb('1abc')
+    with pytest.raises(FileNotFoundError):
+        download.fold_esmfold('MKTAYIAKQR', session = NoNetwork())
+    assert time.perf_counter() - start < 1
+
+def test_store_and_get(cache_root):
+    path = cache.store('rcsb', 'text.pdb', 'ATOM')
+    assert cache.get('rcsb', 'text.pdb') == path
+    assert open(path).read() == 'ATOM'
+    assert cache.get('rcsb', 'missing.pdb') is None
+    # nothing is left from the write
+    assert os.listdir(cache_root / 'rcsb') == ['text.pdb']
+
+def test_eviction(cache_root):
+    size = 300 * 1024
+    paths = [seed(cache_root, 'rcsb', f'{i}.mmtf', bytes(size)) for i in range(3)]
+    for i, path in enumerate(paths):
+        os.utime(path, (1000 + i, 1000 + i))
+    # using the oldest file makes it the most recently used
+    cache.get('rcsb', '0.mmtf')
+
+    # the cache of 1 MB only fits 3 of the 4 files, so the least recently used is evicted
+    new = cache.store('esmfold', 'new.pdb', bytes(size))
+    assert os.path.exists(new)
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
+    assert os.path.exists(paths[2])
+
+def test_eviction_keeps_new_file(cache_root):
+    # a file larger than the cache is still kept after it is stored
+    path = cache.store('rcsb', 'large.mmtf', bytes(2 * 1024 ** 2))
+    assert os.path.exists(path)
+
+def test_persistent_not_evicted(cache_root):
+    kept = seed(cache_root, 'attributes', 'store.npz', bytes(2 * 1024 ** 2))
+    os.utime(kept, (1000, 1000))
+    old = seed(cache_root, 'rcsb', 'old.mmtf', bytes(300 * 1024))
+    os.utime(old, (2000, 2000))
+
+    # the side stores are neither evicted nor counted towards the size of the cache
+    cache.store('rcsb', 'new.mmtf', bytes(300 * 1024))
+    assert os.path.exists(kept)
+    assert os.path.exists(old)
+
+def test_prune(cache_root):
+    day = 24 * 60 * 60
+    used = seed(cache_root, 'attributes', 'used.npz')
+    old = seed(cache_root, 'attributes', 'old.npz')
+    recent = seed(cache_root, 'attributes', 'recent.npz')
+    for path in (used, old):
+        os.utime(path, (time.time() - 40 * day, time.time() - 40 * day))
+
+    # only the stores that are neither used nor recently used are deleted
+    assert cache.prune('attributes', {'used.npz'}, 30 * day) == ['old.npz']
+    assert os.path.exists(used)
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from conftest import fold_server
+from MolecularNodes import download
+
+pytest.importorskip('requests')
+
+def test_retry(cache_root):
+    # the server is busy for the first request, and the prediction is returned on the retry
+    with fold_server(statuses = [503]) as (server, url):
+        path = download.fold_esmfold('MKTAYIAKQR', url = url, retries = 2, backoff = 0)
+    assert server.requests == ['MKTAYIAKQR', 'MKTAYIAKQR']
+    assert open(path).read().startswith('REMARK MKTAYIAKQR')
+
+def test_retries_exhausted(cache_root):
+    with fold_server(statuses = [503, 429, 500]) as (server, url):
+        with pytest.raises(ValueError):
+            download.fold_esmfold('MKTAYIAKQR', url = url, retries = 2, backoff = 0)
+    assert len(server.requests) == 3
+    # nothing is cached for a failed prediction
+    assert os.listdir(cache_root / 'esmfold') == []
+
+def test_client_error_not_retried(cache_root):
+    with fold_server(statuses = [400]) as (server, url):
+        with pytest.raises(ValueError):
+            download.fold_esmfold('MKTAYIAKQR', url = url, retries = 2, backoff = 0)
+    assert len(server.requests) == 1
+
+def test_batch(cache_root):
+    sequences = ['MKTAYIAKQR', 'mkta yiakqr', 'GSHMLE', 'PEPTIDE']
+    with fold_server(statuses = [503]) as (server, url):
+        results = download.fold_esmfold_batch(sequences, url = url, n_workers = 3, retries = 1, backoff = 0)
+    # the same sequence is folded once
+    assert sorted(results) == ['GSHMLE', 'MKTAYIAKQR', 'PEPTIDE']
+    assert sorted(set(server.requests)) == sorted(results)
+    for sequence, path in results.items():
+        assert open(path).read().startswith(f'REMARK {sequence}')
+
+def test_batch_errors(cache_root):
+    with fold_server(statuses = [500]) as (server, url):
+        results = download.fold_esmfold_batch(['MKTAYIAKQR'], url = url, n_workers = 1, retries = 0)
+    assert isinstance(results['MKTAYIAKQR'], ValueError)
+
+def test_read_fasta(tmp_path):
+    fasta = ">first protein\nMKTA\nYIAKQR\n>second\nGSHMLE\n"
+    assert download.read_fasta(fasta) == [('first', 'MKTAYIAKQR'), ('second', 'GSHMLE')]
+    file = tmp_path / 'sequences.fasta'
+    file.write_text(fasta)
+    assert download.read_fasta(str(file)) == download.read_fasta(fasta)
+
+def test_read_fasta_plain_sequence():
+    # a plain sequence isn't silently read as no records
+    with pytest.raises(ValueError):
+        download.read_fasta('MKTAYIAKQR')
@@ -0,0 +1,121 @@
+"""
+The reference secondary structure of the backbones in `data/` is from the DSSP of mdtraj
+(`mdtraj.compute_dssp(simplified = True)`) on the full protein atoms, of adenylate kinase
+(4AKE, from adk_open.pdb of MDAnalysisTests) and of both chains of 1A28.
+"""
+
+import gzip
+import json
+import os
+import numpy as np
+import pytest
+
+from conftest import DATA_DIR
+from MolecularNodes import dssp
+
+CODES = {'H': 1, 'E': 2, 'C': 3}
+
+def read_backbone(name):
+    "The coordinates, atom names, residue names, residue index and chain of the atoms of a PDB file."
+    with gzip.open(os.path.join(DATA_DIR, name), 'rt') as f:
+        lines = [line for line in f if line.startswith('ATOM')]
+    coord = np.array([[float(line[i:i + 8]) for i in (30, 38, 46)] for line in lines])
+    atom_names = np.array([line[12:16].strip() for line in lines])
+    res_names = np.array([line[17:20].strip() for line in lines])
+    residues = [(line[21], line[22:27]) for line in lines]
+    res_index = np.cumsum([0] + [a != b for a, b in zip(residues[:-1], residues[1:])])
+    chain_ids = np.array([line[21] for line in lines])
+    return coord, atom_names, res_names, res_index, chain_ids
+
+def reference(name):
+    with open(os.path.join(DATA_DIR, 'dssp_reference.json')) as f:
+        return np.array([CODES[code] for code in json.load(f)[name]])
+
+def place(a, b, c, bond, angle, torsion):
+    "Position of the atom bonded to `c`, from the bond length, angle and torsion (NeRF)."
+    bc = (c - b) / np.linalg.norm(c - b)
+    normal = np.cross(b - a, bc)
+    normal /= np.linalg.norm(normal)
+    angle, torsion = np.radians(angle), np.radians(torsion)
+    return c + bond * (
+        -np.cos(angle) * bc +
+        np.sin(angle) * np.cos(torsion) * np.cross(normal, bc) +
+        np.sin(angle) * np.sin(torsion) * normal
+    )
+
+def ideal_backbone(n_residues, phi, psi, omega = 180):
+    "(n_residues, 4, 3) coordinates of the N, CA, C and O of a chain with the same torsions."
+    n = np.zeros(3)
+    ca = np.array([1.458, 0, 0])
+    c = place(np.array([0, 1.0, 0]), n, ca, 1.525, 111.2, -60)
+    backbone = []
+    for i in range(n_residues):
+        n_next = place(n, ca, c, 1.329, 116.2, psi)
+        o = place(n, ca, c, 1.231, 120.5, psi + 180)
+        backbone.append([n, ca, c, o])
+        ca_next = place(ca, c, n_next, 1.458, 121.7, omega)
+        c_next = place(c, n_next, ca_next, 1.525, 111.2, phi)
+        n, ca, c = n_next, ca_next, c_next
+    return np.array(backbone)
+
+def assign(backbone, res_name = 'ALA'):
+    n_residues = len(backbone)
+    return dssp.secondary_structure(
+        backbone.reshape(-1, 3),
+        np.tile(dssp.BACKBONE, n_residues),
+        np.repeat(np.arange(n_residues), 4),
+        res_names = np.full(n_residues * 4, res_name)
+        )[0]
+
+def test_ideal_helix():
+    sse = assign(ideal_backbone(20, -57, -47))
+    # the first and last residues have no hydrogen bond that starts the helix
+    assert np.array_equal(sse, [3] + [1] * 18 + [3])
+
+def test_extended_chain():
+    # a single strand has no partner for a bridge
+    assert np.all(assign(ideal_backbone(20, -120, 130)) == 3)
+
+def test_proline_does_not_donate():
+    assert np.all(assign(ideal_backbone(20, -57, -47), res_name = 'PRO') == 3)
+
+def test_frames():
+    helix = ideal_backbone(20, -57, -47).reshape(-1, 3)
+    extended = ideal_backbone(20, -120, 130).reshape(-1, 3)
+    atom_names = np.tile(dssp.BACKBONE, 20)
+    res_index = np.repeat(np.arange(20), 4)
+
+    frames = dssp.secondary_structure(np.stack([helix, extended, helix]), atom_names, res_index)
+    for frame, coord in zip(frames, [helix, extended, helix]):
+        assert np.array_equal(frame, dssp.secondary_structure(coord, atom_names, res_index)[0])
+
+def test_not_protein():
+    # residues without the full backbone are given 0
+    sse = dssp.secondary_structure(np.zeros((3, 3)), np.array(['N', 'CA', 'O1']), np.array([0, 0, 1]))
+    assert np.array_equal(sse, [[0, 0]])
+
+@pytest.mark.parametrize('name', ['4ake_backbone.pdb.gz', '1a28_backbone.pdb.gz'])
+def test_reference(name):
+    coord, atom_names, res_names, res_index, chain_ids = read_backbone(name)
+    sse = dssp.secondary_structure(coord, atom_names, res_index, res_names = res_names)[0]
+    # the last residue of 4AKE has no O, so it isn't assigned
+    is_assigned = sse > 0
+    assert np.mean(~is_assigned) < 0.01
+    assert np.mean(sse[is_assigned] == reference(name)[is_assigned]) > 0.95
+
+@pytest.mark.parametrize('name', ['4ake_backbone.pdb.gz', '1a28_backbone.pdb.gz'])
+def test_compared_to_annotate_sse(name):
+    # the P-SEA assignment of biotite, which was used before, agrees less with DSSP
+    struc = pytest.importorskip('biotite.structure')
+    coord, atom_names, res_names, res_index, chain_ids = read_backbone(name)
+    sse = dssp.secondary_structure(coord, atom_names, res_index, res_names = res_names)[0]
+
+    mol_array = struc.AtomArray(len(coord))
+    mol_array.coord = coord
+    mol_array.atom_name = atom_names
+    mol_array.res_name = res_names
+    mol_array.res_id = res_index
+    mol_array.chain_id = chain_ids
+    psea = np.array([{'a': 1, 'b': 2, 'c': 3, '': 0}[code] for code in struc.annotate_sse(mol_array)])
+
+    assert np.mean(sse == reference(name)) > np.mean(psea == reference(name))
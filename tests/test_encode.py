@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from MolecularNodes import data
+from MolecularNodes import encode
+
+# the per-atom implementations that the lookup tables replaced, as regression references
+
+def atomic_numbers_loop(elements):
+    return np.array(list(map(
+        lambda x: data.elements.get(x, {'atomic_number': -1}).get("atomic_number"),
+        np.char.title(elements))))
+
+def vdw_radii_loop(elements):
+    return np.array(list(map(
+        lambda x: data.elements.get(x, {'vdw_radii': 100}).get('vdw_radii', 100),
+        np.char.title(elements))))
+
+def atom_name_numbers_loop(atom_names):
+    return np.array(list(map(lambda x: data.atom_names.get(x, 9999), atom_names)))
+
+def res_name_numbers_loop(res_names, default):
+    return np.array(list(map(
+        lambda x: data.residues.get(x, {'res_name_num': default}).get('res_name_num'),
+        res_names)))
+
+def chain_id_loop(chain_ids):
+    # the per-atom search of the MD import
+    chain_id_unique = np.unique(chain_ids)
+    return np.array(list(map(lambda x: np.where(x == chain_id_unique)[0][0], chain_ids))), list(chain_id_unique)
+
+def chain_id_searchsorted(chain_ids):
+    # the structure import
+    return np.searchsorted(np.unique(chain_ids), chain_ids), list(np.unique(chain_ids))
+
+def chain_ids(rng, n_chains, n_atoms):
+    "Chain IDs of 1 to 4 characters, in contiguous blocks of atoms as in a structure."
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'))
+    names = np.unique([''.join(rng.choice(letters, rng.integers(1, 5))) for _ in range(n_chains * 2)])[:n_chains]
+    return np.repeat(rng.permutation(names), rng.multinomial(n_atoms, np.full(len(names), 1 / len(names))))
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(1)
+
+def test_element_lookups(rng):
+    symbols = list(data.elements)
+    # elements are written in upper case by most files, title case by some
+    choices = symbols + [s.upper() for s in symbols] + [s.lower() for s in symbols] + ['XX', '']
+    elements = rng.choice(np.array(choices), 10_000)
+
+    assert np.array_equal(encode.atomic_numbers(elements), atomic_numbers_loop(elements))
+    assert np.array_equal(encode.vdw_radii(elements), vdw_radii_loop(elements))
+
+def test_atom_name_lookup(rng):
+    atom_names = rng.choice(np.array(list(data.atom_names) + ['XYZ', "O5'", 'HH21X']), 10_000)
+    assert np.array_equal(encode.atom_name_numbers(atom_names), atom_name_numbers_loop(atom_names))
+
+@pytest.mark.parametrize('default', [9999, 0])
+def test_res_name_lookup(rng, default):
+    res_names = rng.choice(np.array(list(data.residues) + ['HOH', 'POPC', 'NAG']), 10_000)
+    assert np.array_equal(
+        encode.res_name_numbers(res_names, default = default),
+        res_name_numbers_loop(res_names, default)
+        )
+
+def test_empty():
+    assert len(encode.atomic_numbers(np.array([], dtype = str))) == 0
+    assert len(encode.atom_name_numbers(np.array([], dtype = str))) == 0
+
+@pytest.mark.parametrize('n_chains', [1, 26, 500])
+def test_chain_id(rng, n_chains):
+    chain_id = chain_ids(rng, n_chains, 20_000)
+    codes, unique = encode.chain_id_encode(chain_id)
+
+    for reference in (chain_id_loop, chain_id_searchsorted):
+        codes_ref, unique_ref = reference(chain_id)
+        assert np.array_equal(codes, codes_ref)
+        assert unique == unique_ref
+    # the unique chains are stored as an object property, which needs python strings
+    assert all(type(chain) is str for chain in unique)
+
+def test_pack_annotations(rng):
+    struc = pytest.importorskip('biotite.structure')
+    n_atoms = 1_000
+    mol_array = struc.AtomArray(n_atoms)
+    mol_array.res_name = rng.choice(np.array(['ALA', 'GLY', 'HOH', 'POPC']), n_atoms)
+    mol_array.element = rng.choice(np.array(['C', 'N', 'O', 'FE']), n_atoms)
+    mol_array.chain_id = rng.choice(np.array(['A', 'B', 'AA']), n_atoms)
+    mol_array.res_id = rng.integers(-5, 5_000, n_atoms)
+    mol_array.hetero = rng.random(n_atoms) > 0.5
+    mol_array.add_annotation('b_factor', float)
+    mol_array.b_factor = rng.uniform(0, 100, n_atoms)
+
+    arrays = encode.pack_annotations(mol_array)
+    # the strings are kept as small codes, and annotations the atoms don't have are skipped
+    assert arrays['codes_res_name'].dtype == np.uint8
+    assert 'codes_res_index' not in arrays and 'values_res_index' not in arrays
+
+    annotations = encode.unpack_annotations(arrays)
+    for field in ('res_name', 'element', 'chain_id', 'res_id', 'hetero', 'atom_name'):
+        assert np.array_equal(annotations[field], mol_array.get_annotation(field))
+    assert np.allclose(annotations['b_factor'], mol_array.b_factor, atol = 1e-4)
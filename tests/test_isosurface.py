@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from MolecularNodes import isosurface
+
+def sphere(shape = (24, 24, 24), radius = 8.0):
+    "A volume of the distance from its centre, negated so the sphere has the higher values."
+    z, y, x = np.indices(shape, dtype = np.float32)
+    centre = (np.array(shape) - 1) / 2
+    return -np.sqrt((z - centre[0]) ** 2 + (y - centre[1]) ** 2 + (x - centre[2]) ** 2), radius
+
+def signed_volume(vertices, faces):
+    "The volume enclosed by the triangles, positive when they face outwards."
+    v0, v1, v2 = (vertices[faces[:, i]].astype(np.float64) for i in range(3))
+    return np.sum(np.einsum('ij,ij->i', v0, np.cross(v1, v2))) / 6
+
+def assert_closed(faces):
+    "Each edge is shared by two triangles that go along it in opposite directions."
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    unique, counts = np.unique(edges, axis = 0, return_counts = True)
+    assert np.all(counts == 1)
+    reverse = {tuple(edge) for edge in edges[:, ::-1]}
+    assert all(tuple(edge) in reverse for edge in unique)
+
+def test_sphere():
+    volume, radius = sphere()
+    vertices, faces = isosurface.triangles(volume, -radius)
+
+    assert_closed(faces)
+    # the vertices lie on the sphere and the triangles face outwards
+    distance = np.linalg.norm(vertices - (np.array(volume.shape) - 1) / 2, axis = 1)
+    assert np.allclose(distance, radius, atol = 0.3)
+    assert signed_volume(vertices, faces) == pytest.approx(4 / 3 * np.pi * radius ** 3, rel = 0.05)
+
+def test_inverted_sphere():
+    # enclosing the voxels below the level gives the same surface, facing outwards
+    volume, radius = sphere()
+    vertices, faces = isosurface.triangles(-volume, radius, invert = True)
+    assert_closed(faces)
+    assert signed_volume(vertices, faces) == pytest.approx(4 / 3 * np.pi * radius ** 3, rel = 0.05)
+
+def test_slabs():
+    # slabs of 2 voxels, whose surfaces are joined on the edges between them
+    volume, radius = sphere()
+    whole = isosurface.triangles(volume, -radius)
+    vertices, faces = isosurface.triangles(volume, -radius, chunk_size = 2 * 24 * 24)
+
+    assert_closed(faces)
+    assert len(vertices) == len(whole[0])
+    assert len(faces) == len(whole[1])
+    assert signed_volume(vertices, faces) == pytest.approx(signed_volume(*whole), rel = 1e-5)
+
+def test_reverse_axes():
+    # the mirrored surface still faces outwards
+    volume, radius = sphere((20, 24, 28))
+    vertices, faces = isosurface.reverse_axes(*isosurface.triangles(volume, -radius))
+    assert_closed(faces)
+    assert signed_volume(vertices, faces) > 0
+
+@pytest.mark.parametrize('budget', [2000, 500, 100])
+def test_decimate(budget):
+    volume, radius = sphere((40, 40, 40), radius = 15.0)
+    vertices, faces = isosurface.triangles(volume, -radius)
+    assert len(faces) > budget
+
+    decimated, decimated_faces = isosurface.decimate(vertices, faces, budget)
+    assert 0 < len(decimated_faces) <= budget
+    # every vertex is used by a triangle, and the surface keeps about the same size
+    assert np.array_equal(np.unique(decimated_faces), np.arange(len(decimated)))
+    assert np.all(np.abs(decimated - vertices.mean(axis = 0)).max(axis = 0) < radius + 1)
+
+def test_decimate_within_budget():
+    volume, radius = sphere()
+    vertices, faces = isosurface.triangles(volume, -radius)
+    assert isosurface.decimate(vertices, faces, len(faces))[1] is faces
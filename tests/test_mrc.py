@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+from conftest import ADDON_DIR
+
+mrcfile = pytest.importorskip('mrcfile')
+vdb = pytest.importorskip('pyopenvdb')
+
+from MolecularNodes import mrc
+
+PARAMS = {'invert': False, 'world_scale': 0.01, 'threshold': None, 'tolerance': 0, 'pyramid': False}
+
+# converts a map in a child process with a cap on its anonymous memory, which the
+# memory-mapped map doesn't count towards, and prints the statistics of the grid with
+# the peak memory of the process
+CONVERT = """
+import json, resource, sys, types
+file, params, cap, addon_dir = sys.argv[1], json.loads(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+resource.setrlimit(resource.RLIMIT_DATA, (cap, cap))
+
+package = types.ModuleType('MolecularNodes')
+package.__path__ = [addon_dir]
+sys.modules['MolecularNodes'] = package
+from MolecularNodes import mrc
+
+stats = mrc.convert_map(file, 'capped', params)
+status = dict(line.split(':', 1) for line in open('/proc/self/status'))
+print(json.dumps({'stats': stats, 'peak_rss': status['VmHWM'].strip(), 'rss_anon': status['RssAnon'].strip()}))
+"""
+
+def write_map(file, shape, background = 0.0, blob = 1.0, voxel_size = 1.0):
+    """
+    A float32 map with a ball of `blob` in its centre and `background` elsewhere, written
+    a slab at a time so the map never has to fit in memory.
+
+    Returns:
+        int: The number of voxels in the ball.
+    """
+    centre = np.array(shape) / 2
+    radius = min(shape) / 4
+    y, x = np.ogrid[:shape[1], :shape[2]]
+    n_ball = 0
+    with mrcfile.new_mmap(file, shape, mrc_mode = 2, overwrite = True) as mrc_file:
+        mrc_file.voxel_size = voxel_size
+        for z in range(shape[0]):
+            in_ball = (z - centre[0]) ** 2 + (y - centre[1]) ** 2 + (x - centre[2]) ** 2 < radius ** 2
+            mrc_file.data[z] = np.where(in_ball, blob, background)
+            n_ball += int(in_ball.sum())
+    return n_ball
+
+def test_convert_map(tmp_path):
+    file = str(tmp_path / 'small.mrc')
+    n_ball = write_map(file, (20, 30, 40), voxel_size = 2.0)
+
+    stats = mrc.convert_map(file, 'small', PARAMS)
+    assert stats['total_voxel_count'] == 20 * 30 * 40
+    assert stats['active_voxel_count'] == n_ball
+
+    grid = vdb.read(mrc.path_to_vdb(file, key = 'small'), 'density')
+    assert grid.activeVoxelCount() == n_ball
+    assert not os.path.exists(mrc.path_to_vdb(file, key = 'small') + '.part')
+
+def test_invert_with_pyramid(tmp_path):
+    file = str(tmp_path / 'inverted.mrc')
+    n_ball = write_map(file, (16, 16, 16), background = 1.0, blob = 0.0)
+
+    stats = mrc.convert_map(file, 'inverted', dict(PARAMS, invert = True, pyramid = True))
+    # the maximum of the map is found first, so the background becomes 0 and is inactive
+    assert stats['active_voxel_count'] == n_ball
+    for level in mrc.PYRAMID_LEVELS:
+        assert os.path.exists(mrc.path_to_vdb(file, level, 'inverted'))
+
+def test_threshold(tmp_path):
+    # the background is above the tolerance of 0, so only the threshold makes it inactive
+    file = str(tmp_path / 'threshold.mrc')
+    n_ball = write_map(file, (16, 20, 24), background = 0.5, blob = 1.0)
+
+    assert mrc.convert_map(file, 'none', PARAMS)['active_voxel_count'] == 16 * 20 * 24
+    stats = mrc.convert_map(file, 'above', dict(PARAMS, threshold = 0.75))
+    assert stats['active_voxel_count'] == n_ball
+    stats = mrc.convert_map(file, 'below', dict(PARAMS, threshold = 0.25))
+    assert stats['active_voxel_count'] == 16 * 20 * 24
+
+def test_threshold_after_invert(tmp_path):
+    # inverted, the ball is 0.8 and the background 0. Thresholding before inverting would 
+    # keep the background instead
+    file = str(tmp_path / 'inverted_threshold.mrc')
+    n_ball = write_map(file, (16, 16, 16), background = 0.8, blob = 0.0)
+
+    stats = mrc.convert_map(file, 'inverted', dict(PARAMS, invert = True, threshold = 0.4))
+    assert stats['active_voxel_count'] == n_ball
+
+def test_threshold_pyramid(tmp_path):
+    # the binned levels are thresholded after averaging, so a level is no more active 
+    # than its voxels that average above the threshold
+    file = str(tmp_path / 'pyramid_threshold.mrc')
+    write_map(file, (32, 32, 32), background = 0.5, blob = 1.0)
+    params = dict(PARAMS, threshold = 0.75, pyramid = True)
+    mrc.convert_map(file, 'pyramid', params)
+
+    with mrcfile.open(file) as mrc_file:
+        volume = mrc_file.data.copy()
+    for level in mrc.PYRAMID_LEVELS:
+        grid = vdb.read(mrc.path_to_vdb(file, level, 'pyramid'), 'density')
+        binned = volume if level == 1 else mrc.bin_volume(volume, level)
+        assert grid.activeVoxelCount() == np.count_nonzero(binned >= 0.75)
+
+def convert_capped(file, params, memory_cap):
+    "Converts the map in a child process with a cap on its anonymous memory, see `CONVERT`."
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(path for path in sys.path if path))
+    process = subprocess.run(
+        [sys.executable, '-c', CONVERT, file, json.dumps(params), str(memory_cap), ADDON_DIR],
+        capture_output = True, text = True, env = env
+    )
+    assert process.returncode == 0, process.stderr[-2000:]
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+@pytest.mark.large
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason = "The memory cap and peak memory are read on Linux.")
+def test_large_map_under_memory_cap(tmp_path):
+    # a 2 GiB map converted with 1 GiB of memory, inverted so the maximum is found in a
+    # first pass over the map. Most of the map becomes inactive background, which is 
+    # what keeps the grid small, see `test_dense_map_memory()`
+    shape = (800, 800, 800)
+    memory_cap = 2 ** 30
+    if shutil.disk_usage(tmp_path).free < 3 * np.prod(shape) * 4:
+        pytest.skip("Not enough disk space for the map.")
+
+    file = str(tmp_path / 'large.mrc')
+    n_ball = write_map(file, shape, background = 1.0, blob = 0.0)
+
+    result = convert_capped(file, dict(PARAMS, invert = True), memory_cap)
+    print(f"Peak RSS {result['peak_rss']} with {result['rss_anon']} anonymous, for a map of {np.prod(shape) * 4 / 2 ** 30:.1f} GiB")
+
+    assert result['stats']['total_voxel_count'] == np.prod(shape)
+    assert result['stats']['active_voxel_count'] == n_ball
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason = "The memory cap and peak memory are read on Linux.")
+def test_dense_map_memory(tmp_path):
+    # noise with no background, as in a dense tomogram, where every voxel is active and
+    # the grid holds every voxel in memory. The cap fits the grid and a slab, but not
+    # another copy of the whole map
+    shape = (512, 512, 512)
+    map_bytes = int(np.prod(shape)) * 4
+    memory_cap = int(1.5 * map_bytes) + 2 ** 28
+    if shutil.disk_usage(tmp_path).free < 2 * map_bytes:
+        pytest.skip("Not enough disk space for the map.")
+
+    rng = np.random.default_rng(0)
+    file = str(tmp_path / 'dense.mrc')
+    with mrcfile.new_mmap(file, shape, mrc_mode = 2, overwrite = True) as mrc_file:
+        for z in range(shape[0]):
+            mrc_file.data[z] = rng.uniform(1, 2, shape[1:])
+
+    result = convert_capped(file, PARAMS, memory_cap)
+    print(f"Peak RSS {result['peak_rss']}, for a dense map of {map_bytes / 2 ** 20:.0f} MiB")
+
+    assert result['stats']['active_voxel_count'] == np.prod(shape)
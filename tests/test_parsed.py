@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from MolecularNodes import parsed
+
+struc = pytest.importorskip('biotite.structure')
+
+def structure(n_models = 2, n_atoms = 6):
+    "A small AtomArrayStack with the annotations of a parsed file, extra fields and bonds."
+    rng = np.random.default_rng(0)
+    mol = struc.AtomArrayStack(n_models, n_atoms)
+    mol.coord = rng.uniform(-10, 10, (n_models, n_atoms, 3)).astype(np.float32)
+    mol.chain_id = np.array(['A'] * 3 + ['B'] * 3)
+    mol.res_id = np.array([1, 1, 2, 1, 1, 2])
+    mol.res_name = np.array(['ALA', 'ALA', 'GLY', 'HOH', 'NAG', 'NAG'])
+    mol.atom_name = np.array(['N', 'CA', 'N', 'O', 'C1', 'O1'])
+    mol.element = np.array(['N', 'C', 'N', 'O', 'C', 'O'])
+    mol.hetero = np.array([False, False, False, True, True, True])
+    mol.add_annotation('b_factor', dtype = float)
+    mol.b_factor = rng.uniform(0, 100, n_atoms)
+    mol.add_annotation('charge', dtype = int)
+    mol.charge = np.array([1, 0, 0, -1, 0, 0])
+    mol.bonds = struc.BondList(n_atoms, np.array([[0, 1, 1], [4, 5, 2]]))
+    return mol
+
+def test_round_trip(cache_root):
+    mol = structure()
+    # the fields of an MMTF file that are used after it is parsed
+    file_fields = {
+        'secStructList': np.array([0, 0, -1], dtype = np.int8), 
+        'bioAssemblyList': [{
+            'name': '1', 
+            'transformList': [{
+                'chainIndexList': np.array([0, 1]), 
+                'matrix': np.eye(4).reshape(-1)
+            }]
+        }]
+    }
+    name = parsed.structure_cache_name('test', 'round trip')
+    parsed.save_structure(mol, name, file_fields)
+
+    loaded, fields = parsed.load_structure(name)
+    assert np.array_equal(loaded.coord, mol.coord)
+    assert sorted(loaded.get_annotation_categories()) == sorted(mol.get_annotation_categories())
+    for category in mol.get_annotation_categories():
+        assert np.array_equal(loaded.get_annotation(category), mol.get_annotation(category))
+        assert loaded.get_annotation(category).dtype == mol.get_annotation(category).dtype
+    assert np.array_equal(loaded.bonds.as_array(), mol.bonds.as_array())
+
+    # arrays are kept as they are, and other fields go through JSON as lists
+    assert np.array_equal(fields['secStructList'], file_fields['secStructList'])
+    assert fields['secStructList'].dtype == np.int8
+    transform = fields['bioAssemblyList'][0]['transformList'][0]
+    assert fields['bioAssemblyList'][0]['name'] == '1'
+    assert transform['chainIndexList'] == [0, 1]
+    assert np.array_equal(transform['matrix'], np.eye(4).reshape(-1))
+
+def test_without_bonds_or_fields(cache_root):
+    mol = structure(n_models = 1)
+    mol.bonds = None
+    name = parsed.structure_cache_name('test', 'no bonds')
+    parsed.save_structure(mol, name)
+
+    loaded, fields = parsed.load_structure(name)
+    assert loaded.bonds is None
+    assert fields is None
+
+def test_miss(cache_root):
+    assert parsed.load_structure(parsed.structure_cache_name('missing')) is None
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from MolecularNodes import data
+from MolecularNodes import encode
+
+def res_name_encode_loop(res_names, res_ids):
+    """
+    The original per-atom `att_res_name` of `load.create_molecule()`, which is quadratic in
+    the number of non-standard residues, as the regression reference.
+    """
+    other_res = []
+    counter = 0
+    id_counter = -1
+    res_nums = []
+
+    for name in res_names:
+        res_num = data.residues.get(name, {'res_name_num': 9999}).get('res_name_num')
+
+        if res_num == 9999:
+            if res_names[counter - 1] != name or res_ids[counter] != res_ids[counter - 1]:
+                id_counter += 1
+
+            unique_res_name = str(id_counter + 100) + "_" + str(name)
+            other_res.append(unique_res_name)
+
+            num = np.where(np.isin(np.unique(other_res), unique_res_name))[0][0] + 100
+            res_nums.append(num)
+        else:
+            res_nums.append(res_num)
+        counter += 1
+
+    return np.array(res_nums), np.unique(other_res)
+
+def lipid_system(n_lipids, seed = 0):
+    """
+    A membrane-like system of residue names and ids: a protein followed by lipids,
+    cholesterol, water and ions, with the number of atoms of each residue.
+    """
+    rng = np.random.default_rng(seed)
+    amino_acids = [name for name in data.residues if len(name) == 3][:20]
+    residues = [(rng.choice(amino_acids), 8) for _ in range(50)]
+    residues += [(rng.choice(['POPC', 'POPE', 'DPPC', 'CHL1']), int(rng.integers(1, 6))) for _ in range(n_lipids)]
+    residues += [('HOH', 3)] * 20 + [('NA', 1), ('CL', 1)] * 5
+
+    res_names = np.concatenate([[name] * n for name, n in residues])
+    res_ids = np.concatenate([[i + 1] * n for i, (name, n) in enumerate(residues)])
+    return res_names, res_ids
+
+def check(res_names, res_ids):
+    res_nums, ligands = encode.res_name_encode(np.asarray(res_names), np.asarray(res_ids))
+    res_nums_loop, ligands_loop = res_name_encode_loop(res_names, res_ids)
+    assert np.array_equal(res_nums, res_nums_loop)
+    assert np.array_equal(ligands, ligands_loop)
+
+def test_lipid_rich():
+    # over 900 ligands, where the labels reach 4 digits and their string order differs
+    # from the order they appear in
+    res_names, res_ids = lipid_system(1200)
+    assert len(encode.res_name_encode(res_names, res_ids)[1]) > 900
+    check(res_names, res_ids)
+
+def test_repeated_ligand_ids():
+    # the same ligand name and id in consecutive chains are a single ligand
+    res_names = np.array(['ALA', 'ALA', 'NAG', 'NAG', 'NAG', 'NAG', 'GLY', 'NAG'])
+    res_ids = np.array([1, 1, 2, 2, 2, 3, 4, 2])
+    check(res_names, res_ids)
+
+def test_first_and_last_atom():
+    # the first atom is compared with the last, so a structure that starts and ends in the
+    # same ligand doesn't count the first as a new ligand
+    res_names = np.array(['HEM', 'HEM', 'ALA', 'HEM'])
+    res_ids = np.array([5, 5, 1, 5])
+    check(res_names, res_ids)
+
+def test_standard_only():
+    res_names = np.array(['ALA', 'GLY', 'SER'])
+    check(res_names, np.array([1, 2, 3]))
+
+def test_martini_bilayer():
+    mda = pytest.importorskip('MDAnalysis')
+    datafiles = pytest.importorskip('MDAnalysisTests.datafiles')
+
+    atoms = mda.Universe(datafiles.Martini_membrane_gro).atoms
+    check(np.asarray(atoms.resnames).astype('<U3'), atoms.resids)
+
+@pytest.mark.parametrize('n', [0, 1, 2, 7, 64, 1000])
+def test_count_preceding_smaller(n):
+    values = np.random.default_rng(n).permutation(n)
+    expected = [np.sum(values[:i] < value) for i, value in enumerate(values)]
+    assert np.array_equal(encode.count_preceding_smaller(values), expected)
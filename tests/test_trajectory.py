@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pytest
+
+from MolecularNodes import trajectory
+from MolecularNodes import workers
+
+mda = pytest.importorskip('MDAnalysis')
+
+def write_trajectory(directory, n_atoms = 50, n_frames = 20, seed = 0):
+    "A random trajectory, as a .pdb topology and a .dcd trajectory in the directory."
+    rng = np.random.default_rng(seed)
+    univ = mda.Universe.empty(n_atoms, trajectory = True)
+    univ.add_TopologyAttr('name', ['CA'] * n_atoms)
+    univ.add_TopologyAttr('resname', ['ALA'])
+    univ.add_TopologyAttr('resid', [1])
+    positions = rng.uniform(0, 50, (n_frames, n_atoms, 3)).astype(np.float32)
+
+    file_top = os.path.join(directory, 'top.pdb')
+    file_traj = os.path.join(directory, 'traj.dcd')
+    univ.atoms.positions = positions[0]
+    univ.atoms.write(file_top)
+    with mda.Writer(file_traj, n_atoms) as writer:
+        for frame in positions:
+            univ.atoms.positions = frame
+            writer.write(univ.atoms)
+
+    return file_top, file_traj, positions
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_read_coords(tmp_path, n_workers):
+    file_top, file_traj, positions = write_trajectory(tmp_path)
+    frames = range(len(positions))[2:17:2]
+
+    coords = trajectory.read_coords(file_top, file_traj, "", frames, positions.shape[1], n_workers)
+    assert isinstance(coords, np.memmap)
+    assert np.allclose(coords, positions[2:17:2], atol = 1e-3)
+
+def test_read_coords_to_file(tmp_path):
+    file_top, file_traj, positions = write_trajectory(tmp_path)
+    file_coords = str(tmp_path / 'coords.npy')
+
+    coords = trajectory.read_coords(
+        file_top, file_traj, "index 0:9", range(len(positions)), 10, n_workers = 2,
+        file_path = file_coords
+        )
+    assert np.allclose(np.load(file_coords), positions[:, :10], atol = 1e-3)
+    assert np.array_equal(coords, np.load(file_coords))
+    assert not os.path.exists(file_coords + '.part')
+
+def test_worker_error(tmp_path):
+    file_coords = str(tmp_path / 'coords.npy')
+    with pytest.raises(workers.WorkerError):
+        trajectory.read_coords(
+            'missing.pdb', 'missing.dcd', "", range(4), 10, n_workers = 2, file_path = file_coords
+            )
+    # the partial file is removed
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,84 @@
+import itertools
+import os
+
+import pytest
+
+from MolecularNodes import mrc
+
+PARAMS = mrc.vdb_params()
+
+@pytest.fixture
+def clock(monkeypatch):
+    "A clock that ticks once a call, so the conversions are recorded in a strict order."
+    ticks = itertools.count()
+    monkeypatch.setattr(mrc.time, 'time', lambda: float(next(ticks)))
+
+def convert(folder, name, size = 100, params = PARAMS):
+    """
+    A stand-in for a conversion of the map `name`, which writes the map and a .vdb file of
+    `size` bytes. The map is written only once, so it keeps its key.
+
+    Returns:
+        tuple: The path of the map and the key of the conversion.
+    """
+    file = str(folder / f'{name}.mrc')
+    if not os.path.exists(file):
+        with open(file, 'wb') as f:
+            f.write(b'map')
+    key = mrc.vdb_key(file, params)
+    with open(mrc.path_to_vdb(file, key = key), 'wb') as f:
+        f.write(bytes(size))
+    return file, key
+
+def record(folder, name, in_use = (), max_size = None, keep = None):
+    file, key = convert(folder, name)
+    mrc.record_vdb(file, key, PARAMS, set(in_use), max_size = max_size, keep = keep)
+    return mrc.path_to_vdb(file, key = key)
+
+def test_evicts_least_recently_used(cache_root, clock):
+    a, b, c = (record(cache_root, name) for name in 'abc')
+    # using a again makes b the least recently used
+    record(cache_root, 'a')
+    d = record(cache_root, 'd', max_size = 250)
+
+    assert [os.path.exists(path) for path in (a, b, c, d)] == [True, False, False, True]
+    index = mrc.read_vdb_index(str(cache_root))
+    assert sorted(entry['files'][0] for entry in index.values()) == sorted([a, d])
+
+def test_keep(cache_root, clock):
+    a = record(cache_root, 'a')
+    b = record(cache_root, 'b')
+    key_a = mrc.vdb_key(str(cache_root / 'a.mrc'), PARAMS)
+    c = record(cache_root, 'c', max_size = 100, keep = {key_a})
+
+    # the recorded conversion and those in `keep` stay, even over the budget
+    assert [os.path.exists(path) for path in (a, b, c)] == [True, False, True]
+
+def test_in_use(cache_root, clock):
+    a = record(cache_root, 'a')
+    b = record(cache_root, 'b')
+    c = record(cache_root, 'c', in_use = {a}, max_size = 100)
+
+    assert [os.path.exists(path) for path in (a, b, c)] == [True, False, True]
+    assert len(mrc.read_vdb_index(str(cache_root))) == 2
+
+def test_stale(cache_root, clock):
+    old = record(cache_root, 'a')
+    # the map changes, which gives a new key, and the conversion of the old map is stale
+    with open(cache_root / 'a.mrc', 'ab') as f:
+        f.write(b'changed')
+    new = record(cache_root, 'a', max_size = 10_000)
+
+    assert new != old
+    assert not os.path.exists(old) and os.path.exists(new)
+
+def test_budget_off(cache_root, clock):
+    # without a budget in the preferences nothing is deleted, not even stale conversions
+    assert mrc.cache.vdb_max_size() is None
+    old = record(cache_root, 'a')
+    with open(cache_root / 'a.mrc', 'ab') as f:
+        f.write(b'changed')
+    paths = [record(cache_root, name) for name in 'abc']
+
+    assert all(os.path.exists(path) for path in [old] + paths)
+    assert len(mrc.read_vdb_index(str(cache_root))) == 4
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from MolecularNodes import mrc
+
+def bin_volume_loop(volume, factor):
+    "The mean of each block of the volume, cut off at the edges, as the reference."
+    shape = [-(-size // factor) for size in volume.shape]
+    binned = np.zeros(shape)
+    for index in np.ndindex(*shape):
+        block = tuple(slice(i * factor, (i + 1) * factor) for i in index)
+        binned[index] = volume[block].mean()
+    return binned
+
+@pytest.mark.parametrize('factor', [1, 2, 3, 4, 8])
+@pytest.mark.parametrize('shape', [(8, 8, 8), (5, 7, 9), (1, 3, 17)])
+def test_bin_volume(shape, factor):
+    volume = np.random.default_rng(0).uniform(-1, 1, shape).astype(np.float32)
+    binned = mrc.bin_volume(volume, factor)
+    assert binned.dtype == np.float32
+    assert binned.shape == tuple(-(-size // factor) for size in shape)
+    assert np.allclose(binned, bin_volume_loop(volume, factor), atol = 1e-6)
+
+def test_bin_volume_edges():
+    # the blocks cut off at the edges are the mean of the voxels they have, not diluted by
+    # the voxels they're missing
+    volume = np.ones((5, 5, 5), dtype = np.int16)
+    binned = mrc.bin_volume(volume, 4)
+    assert binned.shape == (2, 2, 2)
+    assert np.all(binned == 1)
+
+def test_bin_volume_slabs():
+    # slabs that are a multiple of the factor deep are binned the same as the whole
+    # volume, as `volume_to_grids()` relies on
+    volume = np.random.default_rng(1).uniform(0, 1, (13, 6, 10)).astype(np.float32)
+    slabs = [mrc.bin_volume(volume[i:i + 4], 2) for i in range(0, 13, 4)]
+    assert np.allclose(np.concatenate(slabs), mrc.bin_volume(volume, 2))
+
+def write_map_with_axes(file, volume, axes):
+    """
+    Writes a volume indexed by z, y and x to an MRC file whose sections, rows and columns
+    are the axes `axes` (1, 2, 3 for x, y, z), as set by MAPS, MAPR and MAPC in the header.
+    """
+    mrcfile = pytest.importorskip('mrcfile')
+    with mrcfile.new(file, overwrite = True) as mrc_file:
+        mrc_file.set_data(np.ascontiguousarray(volume.transpose([3 - axis for axis in axes])))
+        mrc_file.header.maps, mrc_file.header.mapr, mrc_file.header.mapc = axes
+
+AXIS_ORDERS = [(3, 2, 1), (3, 1, 2), (2, 3, 1), (2, 1, 3), (1, 3, 2), (1, 2, 3)]
+
+@pytest.mark.parametrize('axes', AXIS_ORDERS)
+def test_map_volume_axes(tmp_path, axes):
+    # a value for each voxel from its z, y and x, on axes of different lengths
+    z, y, x = np.indices((3, 4, 5))
+    volume = (100 * z + 10 * y + x).astype(np.float32)
+    file = str(tmp_path / 'axes.mrc')
+    write_map_with_axes(file, volume, axes)
+
+    with mrc.open_map(file) as mrc_file:
+        result = mrc.map_volume(mrc_file)
+        assert np.array_equal(result, volume)
+        # a view of the memory-mapped data, which isn't read into memory
+        assert np.shares_memory(result, mrc_file.data)
+
+def test_map_volume_invalid_axes(tmp_path):
+    # a header with invalid axes is read in the usual order
+    volume = np.arange(60, dtype = np.float32).reshape(3, 4, 5)
+    file = str(tmp_path / 'invalid.mrc')
+    write_map_with_axes(file, volume, (3, 2, 1))
+    with open(file, 'r+b') as f:
+        # MAPC, MAPR and MAPS are the words 17 to 19 of the header
+        f.seek(16 * 4)
+        f.write(np.array([1, 1, 3], dtype = np.int32).tobytes())
+
+    with mrc.open_map(file) as mrc_file:
+        assert np.array_equal(mrc.map_volume(mrc_file), volume)